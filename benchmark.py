@@ -0,0 +1,730 @@
+from datetime import datetime
+from os import path, makedirs, getuid, getgid
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial, wraps
+
+import docker, docker.errors
+import argparse, threading, time, hashlib, json, random, shlex, shutil, statistics, subprocess
+import io, tarfile, zipfile
+
+import package
+from package import os, database, options, name, version, common
+
+# stand-in mirror, served to the build containers over the docker bridge network
+default_mirror_directory_name = 'bench-mirror'
+default_results_directory_name = 'bench-results'
+default_port = 18080
+
+# os images whose repositories are switched to the stand-in mirror
+bench_image_repository = 'opensql-packager-bench'
+
+# real packages put into the stand-in base repository while seeding (tools needed by the worker image and the components)
+base_artifacts = [ 'tar', 'python3', 'python3-pip', 'yum-utils', 'make', 'llvm', 'gcc', 'python3-devel', 'python3-psycopg2', 'createrepo_c' ]
+
+# synthetic shared libraries required by the component rpms, so the dependency resolution and the deduplication have work to do
+synthetic_library_count = 8
+
+# synthetic pip packages (name -> version, requirements)
+synthetic_pip_packages = {
+    'patroni': ('{version}', [ 'PyYAML', 'click>=4.1', 'prettytable>=0.7', 'psutil>=2.0.0', 'python-dateutil', 'urllib3>=1.19.1', 'python-etcd>=0.4.3; extra == "etcd"' ]),
+    'PyYAML': ('6.0.2', []),
+    'click': ('8.1.7', []),
+    'prettytable': ('3.11.0', [ 'wcwidth' ]),
+    'wcwidth': ('0.2.13', []),
+    'psutil': ('6.0.0', []),
+    'python-dateutil': ('2.9.0', [ 'six>=1.5' ]),
+    'six': ('1.16.0', []),
+    'urllib3': ('2.2.3', []),
+    'python-etcd': ('0.4.5', [ 'urllib3>=1.7.1', 'dnspython>=1.13.0' ]),
+    'dnspython': ('2.6.1', [])
+}
+
+# stages timed in every run (package.py functions)
+timed_functions = [
+    'get_os_docker_image', 'get_or_prepare_worker_docker_image', 'download_components', 'deduplicate_package_files', 'verify_package_files', 'write_install_files', 'export_package',
+    'get_postgresql', 'set_pgpool_repository', 'get_pgpool', 'get_postgis', 'get_barman', 'get_pg_hint_plan', 'get_pg_build_extension_install_utils',
+    'get_pg_build_extension', 'get_etcd', 'get_patroni'
+]
+
+# a stage slower than the base result by this ratio (and by more than the noise floor) is reported as a regression
+default_regression_threshold = 0.1
+regression_noise_floor = 0.5
+
+# upstream os images (package.os_repositories is switched to the benchmark os images)
+upstream_os_repositories = dict(package.os_repositories)
+
+stage_times = []
+stage_times_lock = threading.Lock()
+
+def __main__():
+
+    arguments = parse_arguments()
+
+    if arguments.compare is not None:
+        success = compare_results(arguments.compare[0], arguments.compare[1], arguments.threshold)
+        raise SystemExit(0 if success else 1)
+
+    spec = package.read_yaml(arguments.setting)
+    targets = package.expand_spec_targets(spec)
+
+    if targets is None: return
+
+    for target in targets:
+        if not package.check_spec(target): return
+
+    mirror_directory = path.abspath(arguments.mirror_directory)
+    docker_client = docker.from_env()
+
+    # the containers reach the host through the gateway of the default bridge network
+    host = docker_client.networks.get('bridge').attrs['IPAM']['Config'][0]['Gateway']
+    base_url = f'http://{host}:{arguments.port}'
+
+    server, served_bytes = start_mirror_server(mirror_directory, arguments.port)
+
+    try:
+        results = []
+
+        for target in targets:
+
+            if not seed_mirror(target, mirror_directory, base_url, docker_client, arguments): return
+
+            if not prepare_bench_os_image(target, base_url, docker_client): return
+
+            set_standin_settings(target, base_url)
+
+            results.append(run_target(target, served_bytes, docker_client, arguments))
+
+        write_results(results, arguments)
+
+    finally:
+        server.shutdown()
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description="OpenSQL packager benchmark with a local stand-in mirror")
+
+    parser.add_argument('--setting', type=str, default=package.default_input_file_name, help="OpenSQL package setting yaml file name")
+    parser.add_argument('--runs', type=int, default=3, help="number of packaging runs for each target")
+    parser.add_argument('--warm-cache', action='store_true', help="keep the download cache between runs (default: every run downloads everything)")
+    parser.add_argument('--rebuild-worker-image', action='store_true', help="prepare the worker image in every run, to time the image preparation")
+    parser.add_argument('--package-arguments', type=str, default='', help="extra package.py arguments (ex. \"--jobs 8 --compression zstd\")")
+    parser.add_argument('--mirror-directory', type=str, default=default_mirror_directory_name, help="stand-in mirror directory (seeded once)")
+    parser.add_argument('--reseed', action='store_true', help="seed the stand-in mirror again")
+    parser.add_argument('--port', type=int, default=default_port, help="stand-in mirror http port")
+    parser.add_argument('--rpm-size', type=str, default='4M', help="payload size of each synthetic rpm")
+    parser.add_argument('--tarball-size', type=str, default='8M', help="payload size of each synthetic tarball")
+    parser.add_argument('--output', type=str, default=None, help="result json file name (default: bench-results/{time}.json)")
+    parser.add_argument('--compare', type=str, nargs=2, default=None, metavar=('BASE', 'NEW'), help="compare two result files and report regressions")
+    parser.add_argument('--threshold', type=float, default=default_regression_threshold, help="slowdown ratio reported as a regression")
+
+    args = parser.parse_args()
+
+    if args.runs < 1:
+        parser.error('--runs must be 1 or more')
+
+    for size_option in [ 'rpm_size', 'tarball_size' ]:
+        if package.parse_size(getattr(args, size_option)) is None:
+            parser.error(f'--{size_option.replace("_", "-")} is invalid. ({getattr(args, size_option)})')
+
+    return args
+
+def start_mirror_server(mirror_directory, port):
+
+    makedirs(mirror_directory, exist_ok=True)
+
+    # bytes sent by the server, to report the download throughput
+    served_bytes = { 'total': 0 }
+    served_bytes_lock = threading.Lock()
+
+    class MirrorRequestHandler(SimpleHTTPRequestHandler):
+
+        def copyfile(self, source, outputfile):
+            while True:
+                data = source.read(1024 * 1024)
+                if not data: break
+                outputfile.write(data)
+                with served_bytes_lock: served_bytes['total'] += len(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), partial(MirrorRequestHandler, directory=mirror_directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f'[INFO] stand-in mirror is served on port {port}. ({mirror_directory})')
+
+    return server, served_bytes
+
+def get_standin_url(base_url, url):
+
+    # the files of an upstream url are served under files/{host}/{path}
+    return f'{base_url}/files/{url.split("://", 1)[1]}'
+
+def get_format_arguments(target, component=None):
+
+    os_major_version = target[os][version].split('.')[0]
+    pg_major_version = target[database][version].split('.')[0]
+
+    format_arguments = {
+        'os_name': target[os][name],
+        'os_version': target[os][version],
+        'os_major_version': os_major_version,
+        'pg_major_version': pg_major_version
+    }
+
+    if component is not None:
+        version_tokens = (component[version].split('.') + [ '0', '0' ])[:3]
+        format_arguments.update({
+            name: component[name],
+            version: component[version],
+            'major_version': version_tokens[0],
+            'minor_version': version_tokens[1],
+            'patch_version': version_tokens[2]
+        })
+
+    return format_arguments
+
+def get_synthetic_rpms(target, base_url):
+
+    # rpm specs of the target: (name, version, release, arch, requirements, repository file, destination)
+    format_arguments = get_format_arguments(target)
+    os_major_version = format_arguments['os_major_version']
+    pg_major_version = format_arguments['pg_major_version']
+    synthetic_directory = f'el{os_major_version}/synthetic'
+
+    def libraries(package_name):
+        digest = int(hashlib.sha256(package_name.encode()).hexdigest(), 16)
+        return [ f'opensql-bench-lib{(digest >> shift) % synthetic_library_count}' for shift in (0, 8, 16) ]
+
+    rpms = [ (f'opensql-bench-lib{number}', '1.0', '1', 'x86_64', [], None, synthetic_directory) for number in range(synthetic_library_count) ]
+
+    # the pgdg release rpm sets the synthetic repository
+    repository_url = component_url(target, 'postgresql', base_url)
+    rpms.append(('pgdg-redhat-repo', '42.0', '1', 'noarch', [], ('opensql-bench-synthetic', f'{base_url}/{synthetic_directory}'), repository_url))
+
+    pg_version = target[database][version]
+    postgresql_names = [ artifact.format(major_version=pg_major_version, version=pg_version).removesuffix(f'-{pg_version}') for artifact in package.component_registry['postgresql']['artifacts'] ]
+
+    for package_name in sorted(postgresql_names):
+        requirements = libraries(package_name) + ([ f'postgresql{pg_major_version}' ] if package_name != f'postgresql{pg_major_version}' else [])
+        rpms.append((package_name, pg_version, f'1PGDG.rhel{os_major_version}', 'x86_64', requirements, None, synthetic_directory))
+
+    for component in target[options]:
+
+        component_arguments = get_format_arguments(target, component)
+
+        if component[name] == 'pgpool':
+            # the release rpm is put at number 2, so the release number probing is exercised
+            pgpool_directory = f'el{os_major_version}/pgpool'
+            release_url = component_url(target, 'pgpool', base_url, component, number=2)
+            rpms.append(('pgpool-II-release', f'{component_arguments["major_version"]}.{component_arguments["minor_version"]}', '2', 'noarch', [], ('opensql-bench-pgpool', f'{base_url}/{pgpool_directory}'), release_url))
+            rpms.append((f'pgpool-II-pg{pg_major_version}', component[version], '1', 'x86_64', libraries('pgpool'), None, pgpool_directory))
+
+        if component[name] == 'postgis':
+            # postgis3{minor}_{pg major}, as the upstream package names
+            number = component_arguments['minor_version']
+            rpms.append((f'postgis3{number}_{pg_major_version}', component[version], '1', 'x86_64', libraries('postgis') + [ f'postgresql{pg_major_version}-server' ], None, synthetic_directory))
+
+        if component[name] == 'barman':
+            rpms.append(('barman', component[version], '1', 'noarch', libraries('barman'), None, synthetic_directory))
+
+        if component[name] == 'pg_hint_plan':
+            rpms.append((f'pg_hint_plan{pg_major_version}', component[version], f'1.pg{pg_major_version}.rhel{os_major_version}', 'x86_64', [ f'postgresql{pg_major_version}-server' ], None, component_url(target, 'pg_hint_plan', base_url, component)))
+
+    return rpms
+
+def component_url(target, component_name, base_url, component=None, **format_arguments):
+
+    url = package.component_registry[component_name]['repository'].format(**get_format_arguments(target, component), **format_arguments)
+
+    # the settings are already switched to the stand-in mirror
+    if not url.startswith(base_url): url = get_standin_url(base_url, url)
+
+    return url
+
+def get_rpm_spec(rpm, size):
+
+    package_name, package_version, release, arch, requirements, repository, _ = rpm
+
+    spec = (
+        '%global debug_package %{nil}\n'
+        '%define __os_install_post %{nil}\n'
+        '%define _binary_payload w1.gzdio\n'
+        f'Name: {package_name}\nVersion: {package_version}\nRelease: {release}\nBuildArch: {arch}\n'
+        'Summary: opensql packager benchmark stand-in\nLicense: MIT\n'
+    )
+
+    spec += ''.join(f'Requires: {requirement}\n' for requirement in requirements)
+
+    spec += (
+        '%description\nopensql packager benchmark stand-in\n'
+        '%install\n'
+        'mkdir -p %{buildroot}/usr/share/opensql-bench/%{name}\n'
+        f'head -c {size} /dev/urandom > %{{buildroot}}/usr/share/opensql-bench/%{{name}}/payload\n'
+    )
+
+    if repository is not None:
+        repository_name, repository_url = repository
+        spec += (
+            'mkdir -p %{buildroot}/etc/yum.repos.d\n'
+            f'printf "[{repository_name}]\\nname={repository_name}\\nbaseurl={repository_url}\\ngpgcheck=0\\n" > %{{buildroot}}/etc/yum.repos.d/{repository_name}.repo\n'
+        )
+
+    spec += '%files\n/usr/share/opensql-bench/%{name}\n'
+
+    if repository is not None:
+        spec += f'/etc/yum.repos.d/{repository[0]}.repo\n'
+
+    return spec
+
+def write_file(file_path, data):
+
+    makedirs(path.dirname(file_path), exist_ok=True)
+
+    with open(file_path, 'wb') as file: file.write(data)
+
+def get_payload(seed, size):
+
+    return random.Random(seed).randbytes(size)
+
+def write_synthetic_tarballs(target, mirror_directory, base_url, size):
+
+    # pg build extensions are made for the os full version, and etcd as the upstream release tarball
+    for component in target[options]:
+
+        if package.component_registry[component[name]]['download'] == 'get_pg_build_extension':
+            url = component_url(target, component[name], base_url, component)
+            top_directory, compression = '', ''
+
+        elif component[name] == 'etcd':
+            url = component_url(target, 'etcd', base_url, component)
+            top_directory, compression = f'etcd-v{component[version]}-linux-amd64/', 'gz'
+
+        else: continue
+
+        file_path = path.join(mirror_directory, url.removeprefix(base_url + '/'))
+
+        if path.isfile(file_path): continue
+
+        payload = get_payload(url, size)
+        buffer = io.BytesIO()
+
+        with tarfile.open(fileobj=buffer, mode=f'w:{compression}') as archive:
+            member = tarfile.TarInfo(f'{top_directory}{component[name]}.payload')
+            member.size = len(payload)
+            archive.addfile(member, io.BytesIO(payload))
+
+        write_file(file_path, buffer.getvalue())
+
+def write_synthetic_pip_index(target, mirror_directory):
+
+    # a PEP 503 simple index with one wheel for each package
+    patroni_versions = [ component[version] for component in target[options] if component[name] == 'patroni' ]
+
+    for package_name, (package_version, requirements) in synthetic_pip_packages.items():
+
+        package_versions = [ package_version.format(version=patroni_version) for patroni_version in patroni_versions ] if '{version}' in package_version else [ package_version ]
+
+        normalized_name = package_name.lower().replace('_', '-').replace('.', '-')
+        links = []
+
+        for package_version in package_versions:
+
+            wheel_name = f'{package_name.replace("-", "_")}-{package_version}-py3-none-any.whl'
+            wheel_path = path.join(mirror_directory, 'pypi', 'files', wheel_name)
+
+            if not path.isfile(wheel_path):
+                write_file(wheel_path, get_wheel(package_name, package_version, requirements))
+
+            with open(wheel_path, 'rb') as file: digest = hashlib.sha256(file.read()).hexdigest()
+
+            links.append(f'<a href="../../files/{wheel_name}#sha256={digest}">{wheel_name}</a><br/>')
+
+        write_file(path.join(mirror_directory, 'pypi', 'simple', normalized_name, 'index.html'), f'<html><body>\n{chr(10).join(links)}\n</body></html>\n'.encode())
+
+def get_wheel(package_name, package_version, requirements):
+
+    module_name = package_name.lower().replace('-', '_')
+    dist_info = f'{package_name.replace("-", "_")}-{package_version}.dist-info'
+
+    extras = sorted({ requirement.split('extra == ')[1].strip('"') for requirement in requirements if 'extra == ' in requirement })
+
+    files = {
+        f'{module_name}/__init__.py': f'__version__ = "{package_version}"\n',
+        f'{dist_info}/METADATA': (
+            f'Metadata-Version: 2.1\nName: {package_name}\nVersion: {package_version}\n'
+            + ''.join(f'Provides-Extra: {extra}\n' for extra in extras)
+            + ''.join(f'Requires-Dist: {requirement}\n' for requirement in requirements)
+        ),
+        f'{dist_info}/WHEEL': 'Wheel-Version: 1.0\nGenerator: opensql-bench\nRoot-Is-Purelib: true\nTag: py3-none-any\n'
+    }
+
+    files[f'{dist_info}/RECORD'] = ''.join(f'{file_name},,\n' for file_name in files) + f'{dist_info}/RECORD,,\n'
+
+    buffer = io.BytesIO()
+
+    with zipfile.ZipFile(buffer, 'w') as wheel:
+        for file_name, content in files.items():
+            wheel.writestr(zipfile.ZipInfo(file_name, date_time=(2024, 1, 1, 0, 0, 0)), content)
+
+    return buffer.getvalue()
+
+def seed_mirror(target, mirror_directory, base_url, docker_client, arguments):
+
+    os_name = target[os][name]
+    os_major_version = target[os][version].split('.')[0]
+    base_directory = f'{os_name}{os_major_version}/base'
+    synthetic_directory = f'el{os_major_version}'
+
+    rpms = get_synthetic_rpms(target, base_url)
+    rpm_size = package.parse_size(arguments.rpm_size)
+
+    # the synthetic rpms are built again only when their specs are changed
+    seed_key = hashlib.sha256(json.dumps([ rpms, rpm_size ]).encode()).hexdigest()
+    seed_file_path = path.join(mirror_directory, synthetic_directory, f'.seed-{seed_key[:12]}')
+
+    write_synthetic_tarballs(target, mirror_directory, base_url, package.parse_size(arguments.tarball_size))
+    write_synthetic_pip_index(target, mirror_directory)
+
+    seed_base = arguments.reseed or not path.isfile(path.join(mirror_directory, base_directory, 'repodata', 'repomd.xml'))
+    seed_synthetic = arguments.reseed or not path.isfile(seed_file_path)
+
+    if not seed_base and not seed_synthetic: return True
+
+    print(f'[INFO] seed the stand-in mirror for {os_name} {os_major_version}... (this needs the network once)')
+
+    specs_directory = path.join(mirror_directory, synthetic_directory, 'specs')
+
+    if seed_synthetic:
+        shutil.rmtree(path.join(mirror_directory, synthetic_directory), ignore_errors=True)
+
+        for rpm in rpms:
+            write_file(path.join(specs_directory, f'{rpm[0]}.spec'), get_rpm_spec(rpm, rpm_size).encode())
+
+        # built rpm file -> destination (a repository directory, or an upstream url path)
+        destinations = ''
+
+        for package_name, package_version, release, arch, _, _, destination in rpms:
+            file_name = f'{package_name}-{package_version}-{release}.{arch}.rpm'
+            destination = destination.removeprefix(base_url + '/')
+            destination = destination if destination.endswith('.rpm') else f'{destination}/{file_name}'
+            destinations += f'{file_name} {destination}\n'
+
+        write_file(path.join(specs_directory, 'destinations'), destinations.encode())
+
+        # 'dnf module disable postgresql' of the worker image preparation needs a postgresql module in the repositories
+        write_file(path.join(specs_directory, 'modules.yaml'), (
+            '---\ndocument: modulemd\nversion: 2\ndata:\n  name: postgresql\n  stream: "10"\n  version: 1\n  context: "00000000"\n'
+            '  arch: x86_64\n  summary: stand-in\n  description: stand-in\n  license:\n    module: [ MIT ]\n...\n'
+        ).encode())
+
+    script = 'set -e; dnf -y install rpm-build createrepo_c yum-utils\n'
+
+    if seed_base:
+        script += (
+            f'rm -rf /mirror/{base_directory} && mkdir -p /mirror/{base_directory}\n'
+            f'dnf download --resolve --alldeps --destdir /mirror/{base_directory} {" ".join(base_artifacts)}\n'
+            f'createrepo_c /mirror/{base_directory}\n'
+        )
+
+    if seed_synthetic:
+        specs = f'/mirror/{synthetic_directory}/specs'
+        script += (
+            f'for spec in {specs}/*.spec; do rpmbuild -bb --define "_topdir /tmp/rpmbuild" "$spec" > /dev/null; done\n'
+            f'while read -r file destination; do mkdir -p "/mirror/$(dirname "$destination")" && cp /tmp/rpmbuild/RPMS/*/"$file" "/mirror/$destination"; done < {specs}/destinations\n'
+            f'for repository in /mirror/{synthetic_directory}/synthetic /mirror/{synthetic_directory}/pgpool; do [ ! -d "$repository" ] || createrepo_c "$repository"; done\n'
+            f'modifyrepo_c --mdtype=modules {specs}/modules.yaml /mirror/{synthetic_directory}/synthetic/repodata\n'
+            f'touch /mirror/{synthetic_directory}/.seed-{seed_key[:12]}\n'
+        )
+
+    script += f'chown -R {getuid()}:{getgid()} /mirror\n'
+
+    docker_image = get_upstream_os_image(os_name, target[os][version], docker_client)
+
+    if docker_image is None: return False
+
+    output = run_container_script(docker_image, script, docker_client, volumes={ mirror_directory: { 'bind': '/mirror', 'mode': 'rw' } })
+
+    if output is None:
+        print(f'[ERROR] seeding the stand-in mirror is failed.')
+        return False
+
+    return True
+
+def get_upstream_os_image(os_name, os_version, docker_client):
+
+    bench_os_repository = package.os_repositories.get(os_name)
+    package.os_repositories[os_name] = upstream_os_repositories.get(os_name, os_name)
+
+    try:
+        return package.get_os_docker_image(os_name, os_version, docker_client)
+    finally:
+        if bench_os_repository is not None: package.os_repositories[os_name] = bench_os_repository
+
+def run_container_script(docker_image, script, docker_client, volumes=None, commit_as=None):
+
+    docker_container = docker_client.containers.run(docker_image, '/bin/bash', detach=True, tty=True, volumes=volumes or {})
+
+    try:
+        result = docker_container.exec_run(['sh', '-c', script])
+
+        if result.exit_code != 0:
+            print(result.output.decode()[-4096:])
+            return None
+
+        if commit_as is not None:
+            repository, tag = commit_as.split(':')
+            docker_container.commit(repository=repository, tag=tag)
+
+        return result.output
+
+    finally:
+        docker_container.kill()
+        docker_container.remove()
+
+def prepare_bench_os_image(target, base_url, docker_client):
+
+    # the os image with its repositories switched to the stand-in base repository, and pip to the stand-in index
+    os_name = target[os][name]
+    os_version = target[os][version]
+    os_major_version = os_version.split('.')[0]
+    host = base_url.split('://')[1].split(':')[0]
+
+    bench_repository = f'{bench_image_repository}-{os_name}'
+
+    try:
+        docker_client.images.get(f'{bench_repository}:{os_version}')
+        return True
+    except docker.errors.ImageNotFound:
+        pass
+
+    print(f'[INFO] prepare a benchmark os image ({bench_repository}:{os_version})...')
+
+    docker_image = get_upstream_os_image(os_name, os_version, docker_client)
+
+    if docker_image is None: return False
+
+    script = (
+        'sed -i "s/^enabled *= *1/enabled=0/" /etc/yum.repos.d/*.repo && '
+        f'printf "[opensql-bench-base]\\nname=opensql-bench-base\\nbaseurl={base_url}/{os_name}{os_major_version}/base\\ngpgcheck=0\\n" > /etc/yum.repos.d/opensql-bench-base.repo && '
+        f'printf "[global]\\nindex-url = {base_url}/pypi/simple\\ntrusted-host = {host}\\n" > /etc/pip.conf'
+    )
+
+    return run_container_script(docker_image, script, docker_client, commit_as=f'{bench_repository}:{os_version}') is not None
+
+def set_standin_settings(target, base_url):
+
+    # upstream urls keep their patterns under the stand-in mirror, and the os init settings install only the tools of the base repository
+    for entry in package.component_registry.values():
+        if 'repository' in entry and not entry['repository'].startswith(base_url):
+            entry['repository'] = get_standin_url(base_url, entry['repository'])
+
+    package.os_repositories[target[os][name]] = f'{bench_image_repository}-{target[os][name]}'
+    package.os_init_settings[target[os][name]] = { common: { 'dnf -y install tar python3 python3-pip' } }
+    package.worker_image_repository = f'{bench_image_repository}-worker'
+
+def time_function(function_name, function):
+
+    @wraps(function)
+    def timed_function(*args, **kwargs):
+
+        # a component getter is timed with its component name (the getters of a single component keep their plain names)
+        component = next((arg for arg in args if type(arg) == dict and name in arg and os not in arg), None)
+        stage = function_name if component is None or function_name in ('get_postgresql', 'get_pg_build_extension_install_utils') else f'{function_name}[{component[name]}]'
+
+        started_at = time.monotonic()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with stage_times_lock:
+                stage_times.append((stage, time.monotonic() - started_at))
+
+    return timed_function
+
+def run_target(target, served_bytes, docker_client, arguments):
+
+    target_name = package.get_target_name(target)
+
+    package_arguments = package.parse_arguments(shlex.split(arguments.package_arguments))
+    package_arguments.rebuild_worker_image = arguments.rebuild_worker_image
+
+    # download limits given by --package-arguments (ex. --download-rate-limit) are applied as package.py does
+    package.set_download_limits(package_arguments)
+
+    functions = { function_name: getattr(package, function_name) for function_name in timed_functions }
+
+    for function_name, function in functions.items():
+        setattr(package, function_name, time_function(function_name, function))
+
+    runs = []
+
+    try:
+        for run in range(arguments.runs):
+
+            print(f'[INFO] benchmark {target_name} run {run + 1}/{arguments.runs}...')
+
+            # every run starts with an empty download cache, unless --warm-cache
+            cache_directory = path.abspath(path.join(arguments.mirror_directory, '..', 'bench-cache'))
+
+            if not arguments.warm_cache: shutil.rmtree(cache_directory, ignore_errors=True)
+
+            package.make_download_cache_directories(cache_directory)
+            package.download_cache_directory = cache_directory
+            package.url_probe_results.clear()
+
+            stage_times.clear()
+            served_bytes_before = served_bytes['total']
+            package_file_name = package.get_package_file_name(f'bench-{target_name}.tar', package_arguments.compression)
+
+            started_at = time.monotonic()
+            success = package.build_package(target, package_file_name, package_arguments, docker_client, target_name)
+            elapsed_time = time.monotonic() - started_at
+
+            stages = {}
+
+            for stage, stage_time in stage_times:
+                stages[stage] = stages.get(stage, 0.0) + stage_time
+
+            run_result = {
+                'success': success,
+                'total': elapsed_time,
+                'stages': stages,
+                'downloaded_bytes': served_bytes['total'] - served_bytes_before,
+                'package_size': path.getsize(package_file_name) if success else None
+            }
+
+            runs.append(run_result)
+
+            print(f'[INFO] run {run + 1}: {"success" if success else "failed"} in {elapsed_time:.1f}s, {package.format_size(run_result["downloaded_bytes"])} downloaded')
+
+    finally:
+        for function_name, function in functions.items():
+            setattr(package, function_name, function)
+
+    return { 'target': target_name, 'runs': runs, 'summary': summarize_runs(runs) }
+
+def summarize_runs(runs):
+
+    runs = [ run for run in runs if run['success'] ] or runs
+    summary = { 'total': statistics.median(run['total'] for run in runs), 'stages': {} }
+
+    for stage in sorted({ stage for run in runs for stage in run['stages'] }):
+        summary['stages'][stage] = statistics.median(run['stages'].get(stage, 0.0) for run in runs)
+
+    # download throughput over the component downloads, and export throughput over the archive export
+    download_time = summary['stages'].get('download_components')
+    export_time = summary['stages'].get('export_package')
+    downloaded_bytes = statistics.median(run['downloaded_bytes'] for run in runs)
+    package_sizes = [ run['package_size'] for run in runs if run['package_size'] is not None ]
+
+    summary['download_throughput'] = downloaded_bytes / download_time if download_time else None
+    summary['export_throughput'] = statistics.median(package_sizes) / export_time if export_time and package_sizes else None
+
+    return summary
+
+def get_package_revision():
+
+    try:
+        result = subprocess.run([ 'git', 'describe', '--always', '--dirty' ], cwd=path.dirname(path.abspath(package.__file__)), capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def write_results(results, arguments):
+
+    output = arguments.output or path.join(default_results_directory_name, f'{datetime.now():%Y%m%d-%H%M%S}.json')
+    makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+
+    report = {
+        'revision': get_package_revision(),
+        'created_at': datetime.now().isoformat(),
+        'settings': {
+            'runs': arguments.runs,
+            'warm_cache': arguments.warm_cache,
+            'rebuild_worker_image': arguments.rebuild_worker_image,
+            'package_arguments': arguments.package_arguments,
+            'rpm_size': arguments.rpm_size,
+            'tarball_size': arguments.tarball_size
+        },
+        'targets': results
+    }
+
+    with open(output, 'w') as file: json.dump(report, file, indent=2)
+
+    for result in results:
+        print_summary(result)
+
+    print(f'[INFO] benchmark result is written. ({output})')
+
+def format_throughput(throughput):
+
+    return f'{package.format_size(throughput)}/s' if throughput else '-'
+
+def print_summary(result):
+
+    summary = result['summary']
+
+    print(f'[INFO] {result["target"]} (median of {len(result["runs"])} runs)')
+    print(f'    {"stage":<56} {"time":>9}')
+
+    for stage, stage_time in summary['stages'].items():
+        print(f'    {stage:<56} {stage_time:>8.1f}s')
+
+    print(f'    {"total":<56} {summary["total"]:>8.1f}s')
+    print(f'    download throughput: {format_throughput(summary["download_throughput"])}, export throughput: {format_throughput(summary["export_throughput"])}')
+
+def compare_results(base_file_name, new_file_name, threshold):
+
+    with open(base_file_name, 'r') as file: base_report = json.load(file)
+    with open(new_file_name, 'r') as file: new_report = json.load(file)
+
+    base_targets = { result['target']: result['summary'] for result in base_report['targets'] }
+    regressions = []
+
+    print(f'[INFO] compare {base_report.get("revision")} -> {new_report.get("revision")}')
+
+    for result in new_report['targets']:
+
+        if result['target'] not in base_targets:
+            print(f'[WARN] {result["target"]} is not in {base_file_name}.')
+            continue
+
+        base_summary, new_summary = base_targets[result['target']], result['summary']
+
+        print(f'[INFO] {result["target"]}')
+        print(f'    {"stage":<56} {"base":>9} {"new":>9} {"change":>8}')
+
+        base_stages = { **base_summary['stages'], 'total': base_summary['total'] }
+        new_stages = { **new_summary['stages'], 'total': new_summary['total'] }
+
+        for stage in sorted(set(base_stages) | set(new_stages), key=lambda stage: (stage == 'total', stage)):
+
+            base_time, new_time = base_stages.get(stage), new_stages.get(stage)
+
+            if base_time is None or new_time is None:
+                print(f'    {stage:<56} {base_time or 0:>8.1f}s {new_time or 0:>8.1f}s {"-":>8}')
+                continue
+
+            change = (new_time - base_time) / base_time if base_time else 0.0
+            regression = change > threshold and new_time - base_time > regression_noise_floor
+
+            if regression: regressions.append((result['target'], stage, change))
+
+            print(f'    {stage:<56} {base_time:>8.1f}s {new_time:>8.1f}s {change:>+7.0%}{" (regression)" if regression else ""}')
+
+        for throughput in [ 'download_throughput', 'export_throughput' ]:
+            print(f'    {throughput.replace("_", " ")}: {format_throughput(base_summary.get(throughput))} -> {format_throughput(new_summary.get(throughput))}')
+
+    if regressions:
+        print(f'[ERROR] {len(regressions)} stages are slower than {threshold:.0%}.')
+        return False
+
+    print(f'[INFO] there is no regression.')
+
+    return True
+
+# python3 benchmark.py
+if __name__ == '__main__':
+
+    __main__()
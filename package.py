@@ -1,9 +1,13 @@
 from datetime import datetime
-from os import path, makedirs
+from os import path, makedirs, walk, listdir, stat, remove, replace, utime, getpid, pipe
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import yaml, docker, docker.errors
 import logging, traceback
-import argparse
+import argparse, threading, time, hashlib, json, itertools, gzip, importlib.util, functools
+import tarfile, tempfile, copy, shlex, uuid, io, shutil, sqlite3, http.server, socketserver
+import asyncio, base64, ssl, urllib.parse, urllib.request, atexit, contextlib
+from docker.models.containers import ExecResult
 
 # label variables for convenience and readability
 os = 'os'
@@ -18,38 +22,137 @@ patch_version = 'patch_version'
 
 common = 'common'
 
-# opensql component definitions
-component_groups = {
-    'os': { 'oraclelinux', 'rockylinux' },
-    'database': { 'postgresql' },
-    'pg_build_extensions': { 'pgaudit', 'credcheck', 'system_stats' }
-}
-
+# opensql os definitions
 os_repositories = {
     'oraclelinux': 'oraclelinux',
     'rockylinux': 'rockylinux/rockylinux',
 }
 
-# dnf repositories for opensql components
-component_repositories = {
-    'postgresql': 'https://download.postgresql.org/pub/repos/yum/reporpms/EL-{os_major_version}-x86_64/pgdg-redhat-repo-latest.noarch.rpm',
-    'pgpool': 'https://www.pgpool.net/yum/rpms/{major_version}.{minor_version}/redhat/rhel-{os_major_version}-x86_64/pgpool-II-release-{major_version}.{minor_version}-{number}.noarch.rpm',
-    'pg_hint_plan': 'https://github.com/ossc-db/pg_hint_plan/releases/download/REL{pg_major_version}_{major_version}_{minor_version}_{patch_version}/pg_hint_plan{pg_major_version}-{version}-1.pg{pg_major_version}.rhel{os_major_version}.x86_64.rpm',
-    'pg_build_extensions': 'https://raw.githubusercontent.com/tmaxopensql/tmax-opensql-extensions/refs/heads/main/{name}/{version}/{name}-{version}-{os_name}{os_version}-pg{pg_major_version}.tar',
-    'etcd': 'https://github.com/etcd-io/etcd/releases/download/v{version}/etcd-v{version}-linux-amd64.tar.gz'
-}
-
-# opensql component artifact names
-component_artifacts = {
+pg_build_extension_repository = 'https://raw.githubusercontent.com/tmaxopensql/tmax-opensql-extensions/refs/heads/main/{name}/{version}/{name}-{version}-{os_name}{os_version}-pg{pg_major_version}.tar'
+
+# opensql component registry. every component declares
+#   kind: database or option
+#   versions: supported versions (a map of pg major version to versions if they differ by pg major version)
+#   download: getter function name, called with (spec, component, docker_container, docker_container_log)
+#   setup: repository setup function name (called like the getter), run as its own step ({name}-repository) before the download
+#   strategy: how its files are taken (rpm: repotrack of dnf artifacts, tarball: curl and tar, pip: pip download)
+#   repository: url of its dnf repository, release rpm or tarball
+#   artifacts: dnf artifact names
+#   directories: package directories (the component name if it is not given)
+#   install: install.sh steps of the directories, as (directory, install type, arguments)
+#            ({artifacts} in the arguments is replaced with the artifacts of the component)
+#   dependencies: components or repository setup steps completed before its download (not waited for if they are not in the package)
+# (os init and the pgdg repository are set while preparing the worker image, so no component depends on them.
+#  the pgpool release rpm is installed by dnf in the worker container, so every component resolved by dnf waits for that
+#  setup step, not for the pgpool download, instead of resolving while the repositories and the rpm database change.)
+component_registry = {
     'postgresql': {
-        'postgresql{major_version}-{version}',
-        'postgresql{major_version}-server-{version}',
-        'postgresql{major_version}-contrib-{version}',
-        'postgresql{major_version}-devel-{version}'
+        'kind': 'database',
+        'versions': { '14.13', '15.8' },
+        'download': 'get_postgresql',
+        'strategy': 'rpm',
+        'repository': 'https://download.postgresql.org/pub/repos/yum/reporpms/EL-{os_major_version}-x86_64/pgdg-redhat-repo-latest.noarch.rpm',
+        'artifacts': {
+            'postgresql{major_version}-{version}',
+            'postgresql{major_version}-server-{version}',
+            'postgresql{major_version}-contrib-{version}',
+            'postgresql{major_version}-devel-{version}'
+        },
+        'install': [ ('postgresql', 'rpm', '{artifacts}') ],
+        'dependencies': { 'pgpool-repository' }
+    },
+    'pgpool': {
+        'kind': 'option',
+        'versions': { '4.4.4' },
+        'download': 'get_pgpool',
+        'setup': 'set_pgpool_repository',
+        'strategy': 'rpm',
+        'repository': 'https://www.pgpool.net/yum/rpms/{major_version}.{minor_version}/redhat/rhel-{os_major_version}-x86_64/pgpool-II-release-{major_version}.{minor_version}-{number}.noarch.rpm',
+        'artifacts': { 'pgpool-II-pg{pg_major_version}-{version}' },
+        'install': [ ('pgpool', 'rpm', '{artifacts}') ]
+    },
+    'postgis': {
+        'kind': 'option',
+        'versions': { '3.4.0' },
+        'download': 'get_postgis',
+        'strategy': 'rpm',
+        'artifacts': { 'postgis3{number}_{pg_major_version}-{version}' }, # epel needed
+        'install': [ ('postgis', 'rpm', 'postgis3*_{pg_major_version}-{version}') ],
+        'dependencies': { 'pgpool-repository' }
+    },
+    'barman': {
+        'kind': 'option',
+        'versions': { '3.11.1' },
+        'download': 'get_barman',
+        'strategy': 'rpm',
+        'artifacts': { 'barman-{version}' },                            # epel needed
+        'install': [ ('barman', 'rpm', '{artifacts}') ],
+        'dependencies': { 'pgpool-repository' }
+    },
+    'pg_hint_plan': {
+        'kind': 'option',
+        'versions': {
+            '14': { '1.4.3' },
+            '15': { '1.5.2' }
+        },
+        'download': 'get_pg_hint_plan',
+        'strategy': 'rpm',
+        'repository': 'https://github.com/ossc-db/pg_hint_plan/releases/download/REL{pg_major_version}_{major_version}_{minor_version}_{patch_version}/pg_hint_plan{pg_major_version}-{version}-1.pg{pg_major_version}.rhel{os_major_version}.x86_64.rpm',
+        'install': [ ('pg_hint_plan', 'rpm', 'pg_hint_plan{pg_major_version}-{version}') ],
+        'dependencies': { 'pgpool-repository' }
+    },
+    'pg_build_extension_install_utils': {
+        'kind': 'option',
+        'versions': { '1.0.0' },
+        'download': 'get_pg_build_extension_install_utils',
+        'strategy': 'rpm',
+        'artifacts': { 'make', 'llvm' },
+        'directories': [ 'extension-utils' ],
+        'install': [ ('extension-utils', 'rpm', '{artifacts}') ],
+        'dependencies': { 'pgpool-repository' }
+    },
+    'pgaudit': {
+        'kind': 'option',
+        'versions': { '1.7.0' },
+        'download': 'get_pg_build_extension',
+        'strategy': 'tarball',
+        'repository': pg_build_extension_repository,
+        'install': [ ('pgaudit', 'make', 'USE_PGXS=1 PG_CONFIG=/usr/pgsql-{pg_major_version}/bin/pg_config') ]
+    },
+    'credcheck': {
+        'kind': 'option',
+        'versions': { '2.8.0' },
+        'download': 'get_pg_build_extension',
+        'strategy': 'tarball',
+        'repository': pg_build_extension_repository,
+        'install': [ ('credcheck', 'make', 'USE_PGXS=1 PG_CONFIG=/usr/pgsql-{pg_major_version}/bin/pg_config') ]
+    },
+    'system_stats': {
+        'kind': 'option',
+        'versions': { '3.2' },
+        'download': 'get_pg_build_extension',
+        'strategy': 'tarball',
+        'repository': pg_build_extension_repository,
+        'install': [ ('system_stats', 'make', 'USE_PGXS=1 PG_CONFIG=/usr/pgsql-{pg_major_version}/bin/pg_config') ]
+    },
+    'etcd': {
+        'kind': 'option',
+        'versions': { '3.5.6' },
+        'download': 'get_etcd',
+        'strategy': 'tarball',
+        'repository': 'https://github.com/etcd-io/etcd/releases/download/v{version}/etcd-v{version}-linux-amd64.tar.gz',
+        'install': [ ('etcd', 'binary', '') ]
     },
-    'pgpool': 'pgpool-II-pg{pg_major_version}-{version}',
-    'postgis': 'postgis3{number}_{pg_major_version}-{version}', # epel needed
-    'barman': 'barman-{version}',                               # epel needed
+    'patroni': {
+        'kind': 'option',
+        'versions': { '4.0.3' },
+        'download': 'get_patroni',
+        'strategy': 'pip',
+        'artifacts': { 'python3', 'python3-psycopg2', 'gcc', 'python3-devel' },
+        'directories': [ 'patroni', 'patroni-dependencies' ],
+        'install': [ ('patroni', 'pip', 'patroni[etcd]=={version}'), ('patroni-dependencies', 'rpm', '{artifacts}') ],
+        'dependencies': { 'pgpool-repository' }
+    }
 }
 
 # init settings for redhat os
@@ -73,8 +176,8 @@ os_init_settings = {
     }
 }
 
-# available version restrictions
-support_versions = {
+# available os versions
+support_os_versions = {
     'oraclelinux': {
         '8.0','8.1','8.2','8.3',
         '8.4','8.5','8.6','8.7',
@@ -83,591 +186,5084 @@ support_versions = {
     'rockylinux': {
         '8.4','8.5','8.6','8.7','8.8','8.9','8.10',
         '9.0','9.1','9.2','9.3','9.4'
-    },
-    'postgresql': { '14.13', '15.8' },
-    'pgpool': { '4.4.4' },
-    'postgis': { '3.4.0' },
-    'barman': { '3.11.1' },
-    'pg_build_extension_install_utils': { '1.0.0' },
-    'pg_hint_plan': {
-        '14': { '1.4.3' },
-        '15': { '1.5.2' }
-    },
-    'pgaudit': { '1.7.0' },
-    'credcheck': { '2.8.0' },
-    'system_stats': { '3.2' },
-    'etcd': { '3.5.6' },
-    'patroni': { '4.0.3' }
+    }
 }
 
+# download history of the components (time and size of the last download), used by --dry-run estimates
+download_history_file_name = 'history.json'
+download_history_lock = threading.Lock()
+
+# prepared worker images (repotrack, os init settings and pgdg repository are already set)
+worker_image_repository = 'opensql-packager-worker'
+
+# the asyncio engine takes the transport (unix socket, tcp with tls, ssh) and the negotiated api version of the docker client
+docker_engine_chunk_size = 256 * 1024
+
+# docker engine shared by every target and component of the run (created on first use)
+docker_engine = None
+docker_engine_lock = threading.Lock()
+
 # docker container directories
 work_directory = '/opensql'
 
 # log directory
 log_directory_name = 'logs'
 
-# output tar name
-package_name = 'opensql.tar'
+# download cache directories (host side, and where it is mounted in the docker container)
+default_cache_directory_name = 'cache'
+container_cache_directory = '/var/cache/opensql'
+default_cache_size_limit = '20G'
+
+# host cache directory of the current run (None if the cache is disabled)
+download_cache_directory = None
+
+# mirrors of download urls (url prefix -> mirror url prefixes), extended by 'mirrors' of the setting file
+url_mirrors = {}
+
+# url probe answers of the current run (url -> latency in seconds, or None if not available).
+# available urls are also kept in the download cache for a day.
+url_probe_results = {}
+url_probe_lock = threading.Lock()
+url_probe_cache_ttl = 24 * 60 * 60
+url_probe_timeout = 10
+
+# urls checked from the host at the same time by --validate
+url_check_workers = 16
+
+# resolved rpm artifact names of the current run ((worker image, candidates) -> artifact)
+resolved_artifacts = {}
+
+# download limits of the run, shared by every target (set from the arguments).
+# the downloads in the build containers run through the download script, which takes a download slot (global and by host)
+# from lock files in a host directory mounted into every build container.
+download_limits = {
+    'retries': 5,
+    'retry_delay': 2,
+    'connect_timeout': 30,
+    'stall_time': 60,
+    'max_downloads': 8,
+    'max_host_downloads': 4,
+    'rate': None,
+    'host_rate': None,
+    'segments': 4,
+    'segment_size': 32 * 1024 * 1024,
+    'metadata_ttl': '6h'
+}
 
-# default input file name
-default_input_file_name = 'input.yaml'
+# dnf metadata kept in the download cache by os (dnf/{os name}{os major version}), and copied into every worker container.
+# metadata older than the metadata ttl (dnf metadata_expire: seconds, with s, m, h or d, or never) is downloaded again,
+# and the refreshed one is written back.
+container_dnf_cache_directory = '/var/cache/dnf'
+dnf_metadata_marker_path = '/tmp/opensql-dnf-metadata'
+
+# rpms kept in the download cache by os (rpms/{os name}{os major version}). in a build container, it is linked here and
+# the dnf package directory of every repository links to it, so dnf reuses the kept rpms after verifying them by itself.
+container_rpm_cache_directory = '/var/cache/opensql-rpms'
+
+download_script_path = '/usr/local/bin/opensql-download'
+container_download_lock_directory = '/var/lock/opensql'
+
+# host directory of the download slots (created on first use, removed at exit)
+download_lock_directory = None
+download_lock_directory_lock = threading.Lock()
+
+download_script_template = '''#!/bin/sh
+# download helper of the packager (generated by package.py)
+#
+#   opensql-download fetch URL FILE      download with retries, range resume, and parallel segments for a large file
+#   opensql-download run KEY COMMAND...  run a download command with retries, in a download slot of KEY
+#
+# the download slots are lock files in a directory shared by every build container, so the limits hold for the whole run.
+# the bytes received by a download are added to $OPENSQL_RECEIVED_BYTES (set by the packager for each of its steps).
+
+retries=@RETRIES@
+retry_delay=@RETRY_DELAY@
+max_downloads=@MAX_DOWNLOADS@
+max_host_downloads=@MAX_HOST_DOWNLOADS@
+transfer_rate=@TRANSFER_RATE@
+segments=@SEGMENTS@
+segment_size=@SEGMENT_SIZE@
+locks=@LOCK_DIRECTORY@
+
+curl_options="-L -s -S -f --connect-timeout @CONNECT_TIMEOUT@ --speed-limit 1 --speed-time @STALL_TIME@"
+
+# holds a free slot of the key on the file descriptor until the process exits
+acquire() {
+    [ -d "$locks" ] && command -v flock > /dev/null || return 0
+
+    while :; do
+        slot=0
+        while [ $slot -lt "$2" ]; do
+            eval "exec $3>\\"\\$locks/\\$1.\\$slot\\""
+            flock -n "$3" && return 0
+            slot=$((slot + 1))
+        done
+        sleep 0.5
+    done
+}
 
-def __main__():
+count_received() {
+    [ -z "$OPENSQL_RECEIVED_BYTES" ] || echo "${1:-0}" >> "$OPENSQL_RECEIVED_BYTES"
+}
 
-    input_file_name = get_input_yaml_file_name()
+# runs the command until it succeeds, waiting twice as long after each failure
+retry() {
+    attempt=1 delay=$retry_delay
 
-    if not path.isfile(input_file_name):
-        print(f'[ERROR] there is no setting file("{input_file_name}")')
-        return
+    until "$@"; do
+        status=$?
+        [ $attempt -lt $retries ] || return $status
 
-    spec = read_yaml(input_file_name)
+        echo "[WARN] attempt $attempt failed ($status). retry in ${delay}s: $*" >&2
+        sleep $delay
+        attempt=$((attempt + 1)) delay=$((delay * 2))
+    done
+}
 
-    # Check input parameters
-    if os not in spec or spec[os][name] not in component_groups[os]:
-        print(f'[ERROR] target OS must be set. Please input an OS argument. (available os: {component_groups[os]})')
-        return
+rate_option() {
+    [ "$1" -eq 0 ] || echo "--limit-rate $1"
+}
 
-    if database not in spec or spec[database][name] not in component_groups[database]:
-        print(f'[ERROR] target Database must be set. Please input Database argument. (available database: {component_groups[database]})')
-        return
+fetch_file() {
+    transferred=$(curl $curl_options $(rate_option $transfer_rate) -C - -o "$2" -w '%{size_download}' "$1")
+    status=$?
+    count_received "$transferred"
 
-    if spec[os][version] not in support_versions[spec[os][name]]:
-        print(f'[ERROR] os version {spec[os][version]} is not supported. (available versions: {support_versions[spec[os][name]]})')
-        return
-    
-    if spec[database][version] not in support_versions[spec[database][name]]:
-        print(f'[ERROR] database version {spec[database][version]} is not supported. (available versions: {support_versions[spec[database][name]]})')
-        return
+    # the server cannot resume the partial file, so it is downloaded again from the start
+    [ $status -ne 22 ] && [ $status -ne 33 ] || rm -f "$2"
 
-    db_version = spec[database][version]
-    db_major_version = db_version.split('.')[0]
+    return $status
+}
 
-    # Check components vailidity
-    for component in spec[options]:
+fetch_segment() {
+    received=$(stat -c %s "$2" 2>/dev/null || echo 0)
+    [ $(($3 + received)) -le "$4" ] || return 0
 
-        if component[name] not in support_versions: continue
+    result=$(curl $curl_options $(rate_option $((transfer_rate / segments))) -r "$(($3 + received))-$4" -o "$2.part" -w '%{http_code} %{size_download}' "$1")
+    status=$?
+    code=${result%% *}
+    count_received "${result#* }"
 
-        if db_major_version in support_versions[component[name]]:
-            if component[version] not in support_versions[component[name]][db_major_version]:
-                print(f'[ERROR] there is no supported version {component[version]} of {component[name]} for db major version {db_major_version}. (available versions: {support_versions[component[name]]})')
-                return
-            continue
+    # the received bytes of the range are kept even if the transfer failed, and the next attempt resumes after them
+    [ "$code" != 206 ] || cat "$2.part" >> "$2"
+    rm -f "$2.part"
 
-        if component[version] not in support_versions[component[name]]:
-            print(f'[ERROR] {component[name]} version {component[version]} is not supported. (available versions: {support_versions[component[name]]})')
-            return
+    [ "$code" = 206 ] || return 1
+    return $status
+}
 
-    specifications = parse_spec(spec)
-    print(specifications)
+fetch() {
+    url=$1 file=$2
+    host=$(echo "$url" | sed -n 's#^[a-zA-Z]*://\\([^/:]*\\).*#\\1#p')
 
-    # Prepare a docker container based on the target os
-    os_name = spec[os][name]
-    os_version = spec[os][version]
-    os_major_version = spec[os][version].split('.')[0]
+    acquire all "$max_downloads" 8
+    acquire "host-$host" "$max_host_downloads" 9
 
-    docker_client = docker.from_env()
-    docker_image = get_os_docker_image(os_name, os_version, docker_client)
+    # a large file is downloaded in parallel segments, if the server takes byte ranges
+    size=$(curl $curl_options -I "$url" | tr -d '\\r' | awk '
+        /^HTTP\\// { size = ""; ranges = 0 }
+        tolower($1) == "content-length:" { size = $2 }
+        tolower($1) == "accept-ranges:" && $2 == "bytes" { ranges = 1 }
+        END { if (ranges) print size }')
 
-    if docker_image is None: return
+    if [ "$segments" -gt 1 ] && [ -n "$size" ] && [ "$size" -ge "$segment_size" ]; then
 
-    docker_container = None
-    docker_container_log = None
+        length=$(((size + segments - 1) / segments))
+        index=0 pids=''
 
-    try:
-        print(f'[INFO] make a docker container...')
-        docker_container = docker_client.containers.run(docker_image, '/bin/bash', detach=True, tty=True)
+        while [ $((index * length)) -lt "$size" ]; do
+            end=$(((index + 1) * length - 1))
+            [ $end -lt "$size" ] || end=$((size - 1))
 
-        # save the logs of the docker container
-        if not path.isdir(log_directory_name):
-            makedirs(log_directory_name)
+            retry fetch_segment "$url" "$file.$index" $((index * length)) $end &
+            pids="$pids $!" index=$((index + 1))
+        done
 
-        docker_container_log = open(f'{log_directory_name}/{datetime.now()}.log', 'ab')
+        failed=0
+        for pid in $pids; do wait $pid || failed=1; done
 
-        print(f'[INFO] make a work directory...')
+        if [ $failed -eq 0 ]; then
+            : > "$file"
+            index=0
+            while [ -f "$file.$index" ]; do cat "$file.$index" >> "$file" && rm -f "$file.$index"; index=$((index + 1)); done
 
-        execute_and_log_container(f'mkdir {work_directory}', docker_container, docker_container_log)
+            [ "$(stat -c %s "$file")" != "$size" ] || return 0
+        fi
 
-        # set repotrack
-        success = get_repotrack_if_not_exists(docker_container, docker_container_log)
+        index=0
+        while [ -f "$file.$index" ]; do rm -f "$file.$index"; index=$((index + 1)); done
+        rm -f "$file"
 
-        if not success: return
+        echo "[WARN] segmented download failed. download the whole file: $url" >&2
+    fi
 
-        # os init settings
-        if os_name in os_init_settings:
+    retry fetch_file "$url" "$file"
+}
 
-            success = init_os(os_name, os_major_version, docker_container, docker_container_log)
+# the directory a download command writes its files to (repotrack --destdir, pip download -d, otherwise the working directory)
+destination() {
+    directory=. command=$1
 
-            if not success: return
+    while [ $# -gt 0 ]; do
+        case "$command $1" in
+            "repotrack --destdir"|"pip3 -d"|"pip3 --dest") directory=$2; shift ;;
+            "repotrack --destdir="*|"pip3 --dest="*) directory=${1#*=} ;;
+        esac
+        shift
+    done
 
-        # database: postgresql
-        if 'postgresql' == spec[database][name]:
+    echo "$directory"
+}
 
-            print(f'[INFO] pg download setting...')
+directory_size() {
+    size=$(du -sb "$1" 2>/dev/null | cut -f 1)
+    echo "${size:-0}"
+}
 
-            success = get_postgresql(os_major_version, db_version, docker_container, docker_container_log)
+# total size of the rpms in the directory downloaded into the dnf package cache after the marker file
+downloaded_rpms() {
+    for file in "$1"/*.rpm; do
+        for cached in @DNF_CACHE_DIRECTORY@/*/packages/"${file##*/}"; do
+            [ "$cached" -nt "$2" ] && stat -c %s "$cached" && break
+        done
+    done | awk '{ size += $1 } END { print size + 0 }'
+}
 
-            if not success: return
+run() {
+    key=$1
+    shift
 
-        # optional components
-        for component in spec[options]:
+    acquire all "$max_downloads" 8
+    acquire "host-$key" "$max_host_downloads" 9
 
-            if 'pgpool' == component[name]:
-                success = get_pgpool(os_major_version, db_major_version, component, docker_container, docker_container_log)
+    # the received bytes of a command are the bytes its files grew by (the packages installed by dnf are not counted).
+    # repotrack copies the rpms from the dnf package cache, so only the ones downloaded into the cache are received.
+    directory=$(destination "$@")
+    size=$(directory_size "$directory")
+    started=$(mktemp)
 
-            if 'postgis' == component[name]:
-                success = get_postgis(db_major_version, component, docker_container, docker_container_log)
+    retry "$@"
+    status=$?
 
-            if 'barman' == component[name]:
-                success = get_barman(component, docker_container, docker_container_log)
+    if [ "$1" = repotrack ]; then
+        grown=$(downloaded_rpms "$directory" "$started")
+    else
+        grown=$(($(directory_size "$directory") - size))
+        [ $grown -gt 0 ] || grown=0
+    fi
 
-            if 'pg_hint_plan' == component[name]:
-                success = get_pg_hint_plan(os_major_version, db_major_version, component, docker_container, docker_container_log)
+    rm -f "$started"
+    count_received $grown
 
-            if 'pg_build_extension_install_utils' == component[name]:
-                success = get_pg_build_extension_install_utils(docker_container, docker_container_log)
+    return $status
+}
 
-            if component[name] in component_groups['pg_build_extensions']:
-                success = get_pg_build_extension(spec, component, docker_container, docker_container_log)
+case "$1" in
+    fetch) shift; fetch "$@" ;;
+    run) shift; run "$@" ;;
+    *) echo "usage: opensql-download fetch URL FILE | run KEY COMMAND..." >&2; exit 2 ;;
+esac
+'''
 
-            if 'etcd' == component[name]:
-                success = get_etcd(component, docker_container, docker_container_log)
+# output tar name
+package_name = 'opensql.tar'
 
-            if 'patroni' == component[name]:
-                success = get_patroni(component, docker_container, docker_container_log)
+# package compression (file name suffix by compression type)
+package_compressions = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
 
-            if not success: return
-            else: continue
+# checksum list of every file in the package (sha256sum format)
+manifest_file_name = 'MANIFEST'
+
+# spec info of the package
+metadata_file_name = 'METADATA'
+
+# changes of a delta package against its base package
+delta_file_name = 'DELTA'
+
+# verification of the package files, run in the worker container with a job per core.
+#   rpm: digests (corrupt or truncated files) and signatures with the keys installed by the repository settings
+#   pip: wheel and sdist archives
+# the results are written to a list file, one line per file: R (rpm), P (pip file), T (tarball directory),
+# D (missing dependency of a component), F (number of files)
+verification_list_path = '/tmp/opensql-verification.list'
+
+verify_rpms_script = '''for file; do
+    output=$(rpm -Kv "$file" 2>&1)
+    if printf "%s\\n" "$output" | grep -q -e "digest: BAD" -e "error:" -e "not an rpm"; then status=corrupt
+    elif printf "%s\\n" "$output" | grep -q "Signature.*: BAD"; then status=bad-signature
+    elif printf "%s\\n" "$output" | grep -q "NOKEY"; then status=nokey
+    elif printf "%s\\n" "$output" | grep -q "Signature.*: OK"; then status=signed
+    else status=unsigned; fi
+    echo "R $status $file"
+done'''
+
+verify_pip_files_script = '''import sys, tarfile, zipfile
+for file_name in sys.argv[1:]:
+    try:
+        if file_name.endswith(('.whl', '.zip')):
+            status = 'ok' if zipfile.ZipFile(file_name).testzip() is None else 'corrupt'
+        else:
+            with tarfile.open(file_name) as archive: archive.getmembers()
+            status = 'ok'
+    except Exception:
+        status = 'corrupt'
+    print('P', status, file_name)'''
+
+# slim packages (--slim) leave out the rpms installed in the base os image at the same or a newer version.
+# the rpm database of the os image is taken once per image in a run, and put under a root directory of the build container,
+# where rpm --root lists its rpms and the verification test installs on it.
+base_rpm_databases = {}
+base_rpm_database_locks = {}
+base_root_directory = '/opensql-base'
+prune_list_path = '/tmp/opensql-prune.list'
+pruned_rpms_section = 'PRUNED RPMS'
+
+# index of the package files (files, rpms, provides and requires) queried without extracting the package
+index_file_name = 'INDEX.sqlite'
+package_index_version = '1'
+
+package_index_schema = '''
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE rpms (id INTEGER PRIMARY KEY, sha256 TEXT UNIQUE, name TEXT, epoch INTEGER, version TEXT, release TEXT, arch TEXT);
+CREATE TABLE files (path TEXT PRIMARY KEY, component TEXT, size INTEGER, sha256 TEXT, rpm_id INTEGER REFERENCES rpms (id));
+CREATE TABLE capabilities (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE provides (rpm_id INTEGER, capability_id INTEGER, PRIMARY KEY (rpm_id, capability_id)) WITHOUT ROWID;
+CREATE TABLE requires (rpm_id INTEGER, capability_id INTEGER, PRIMARY KEY (rpm_id, capability_id)) WITHOUT ROWID;
+CREATE INDEX rpms_name ON rpms (name);
+CREATE INDEX files_rpm ON files (rpm_id);
+CREATE INDEX provides_capability ON provides (capability_id);
+CREATE INDEX requires_capability ON requires (capability_id);
+'''
+
+# package index queries (query -> sql statement, default argument).
+# a file shared by several components (a hard link) is stored once, in the first path.
+package_index_queries = {
+    'components': (
+        'SELECT component, COUNT(*) AS files, COUNT(rpm_id) AS rpms, SUM(size) AS size, SUM(CASE WHEN stored THEN size ELSE 0 END) AS stored_size '
+        'FROM (SELECT *, sha256 IS NULL OR ROW_NUMBER() OVER (PARTITION BY sha256 ORDER BY path) = 1 AS stored FROM files) '
+        'GROUP BY component ORDER BY size DESC',
+        None
+    ),
+    'rpms': (
+        'SELECT files.component, rpms.name, rpms.epoch || \':\' || rpms.version || \'-\' || rpms.release AS evr, rpms.arch, files.size, files.path '
+        'FROM files JOIN rpms ON rpms.id = files.rpm_id WHERE files.component LIKE ? ORDER BY files.component, rpms.name',
+        '%'
+    ),
+    'whatrequires': (
+        'SELECT DISTINCT files.component, rpms.name AS rpm, capabilities.name AS capability '
+        'FROM rpms AS target JOIN provides ON provides.rpm_id = target.id JOIN capabilities ON capabilities.id = provides.capability_id '
+        'JOIN requires ON requires.capability_id = capabilities.id JOIN rpms ON rpms.id = requires.rpm_id JOIN files ON files.rpm_id = rpms.id '
+        'WHERE target.name LIKE ? AND rpms.id != target.id ORDER BY 1, 2, 3',
+        None
+    ),
+    'whatprovides': (
+        'SELECT DISTINCT files.component, rpms.name AS rpm, capabilities.name AS capability '
+        'FROM capabilities JOIN provides ON provides.capability_id = capabilities.id JOIN rpms ON rpms.id = provides.rpm_id JOIN files ON files.rpm_id = rpms.id '
+        'WHERE capabilities.name LIKE ? ORDER BY 1, 2, 3',
+        None
+    ),
+    'requires': (
+        'SELECT capabilities.name AS capability, group_concat(DISTINCT provider.name) AS provided_by '
+        'FROM rpms JOIN requires ON requires.rpm_id = rpms.id JOIN capabilities ON capabilities.id = requires.capability_id '
+        'LEFT JOIN provides ON provides.capability_id = capabilities.id LEFT JOIN rpms AS provider ON provider.id = provides.rpm_id '
+        'WHERE rpms.name LIKE ? GROUP BY capabilities.name ORDER BY 1',
+        None
+    ),
+    'files': ('SELECT path, component, size, sha256 FROM files WHERE path GLOB ? ORDER BY path', '*'),
+    'sql': (None, None)
+}
 
-        # put spec info
-        print(f'[INFO] all package download is completed.')
-        result = execute_and_log_container(f'sh -c \'echo "{specifications}" > {work_directory}/METADATA\'', docker_container, docker_container_log)
+# lockfile of the resolved package files (rpm nevra and url, pip file hashes, tarball urls)
+lock_file_version = '1'
 
-        # get archive from container
-        print('[INFO] make an package archive and get the archive from worker container...')
-        stream, stat = docker_container.get_archive(work_directory)
+# container directory where the locked files are downloaded before being linked into the work directory
+lock_directory = '/opensql-lock'
 
-        file = open(package_name, 'wb')
-        for chunk in stream: file.write(chunk)
-        file.close()
+# listings of the lockfile (files with their checksums, and the rpm locations), written to files in the container
+# since the output of a command is only kept as its tail
+lock_list_path = '/tmp/opensql-lock.list'
+lock_locations_path = '/tmp/opensql-lock-locations.list'
 
-        print(f'[INFO] packaging is completed.')
+# downloads of each build container recorded for the lockfile (container id -> { 'tarballs': [...], 'rpm_urls': [...] })
+download_records = {}
+download_records_lock = threading.Lock()
 
-    except Exception as e:
-        logging.error(traceback.format_exc())
+# stage times and byte counters of every build of the run, written as the run report (and the --metrics-file)
+run_report_version = '1'
+build_reports = []
+build_reports_lock = threading.Lock()
 
-    finally:
+# report of the build running in the current thread, and its stages counting the bytes received by the steps
+# (set by build_package and measure_stage, and passed to the threads they start)
+build_report_context = threading.local()
 
-        if docker_container_log is not None:
-            docker_container_log.close()
+# prometheus textfile metrics (ex. for the node exporter textfile collector)
+metrics_prefix = 'opensql_packager'
 
-        if docker_container is not None:
+# offline install script in the package root. the rpms of the selected components are installed in one dnf transaction
+# from the package repository (repodata), then the other directories at the same time.
+install_script_name = 'install.sh'
 
-            docker_container.kill()
-            docker_container.remove()
+install_script_template = '''#!/bin/sh
+# installs the opensql components of this package without network (generated by package.py)
+#
+#   ./install.sh                    every component
+#   ./install.sh pgpool patroni     the given components
+#   ./install.sh --list             components of this package
 
-def get_input_yaml_file_name():
+set -f
 
-    parser = argparse.ArgumentParser(description="OpenSQL package setting file parser")
+package_directory=$(cd "$(dirname "$0")" && pwd)
 
-    parser.add_argument('--setting', type=str, default=default_input_file_name, help="OpenSQL package setting yaml file name")
+# component, install type, directory and install arguments
+plan='@PLAN@'
 
-    args = parser.parse_args()
+components=$(printf '%s\\n' "$plan" | awk '!seen[$1]++ { print $1 }')
 
-    return args.setting
+if [ "$1" = "--list" ]; then
+    printf '%s\\n' "$components"
+    exit 0
+fi
 
-def read_yaml(file_path: str):
+selected=$(echo ${*:-$components})
 
-    if file_path is None: return None
+for component in $selected; do
+    printf '%s\\n' "$components" | grep -qx "$component" || { echo "[ERROR] $component is not in this package. (components: $(echo $components))" >&2; exit 1; }
+done
 
-    file = open(file_path, 'r')
+if [ "$(id -u)" -ne 0 ]; then
+    echo "[ERROR] install.sh must be run as root." >&2
+    exit 1
+fi
 
-    data = yaml.load(file, Loader=yaml.BaseLoader)
+steps=$(printf '%s\\n' "$plan" | awk -v selected=" $selected " 'index(selected, " " $1 " ")')
+rpm_artifacts=$(printf '%s\\n' "$steps" | awk '$2 == "rpm" { for (i = 4; i <= NF; i++) print $i }' | sort -u)
 
-    return data
+temporary_directory=$(mktemp -d /tmp/opensql-install.XXXXXX)
 
-def execute_and_log_container(command, container, log, workdir=None):
+# only the package repository is used, so nothing is taken from the network
+if [ -n "$rpm_artifacts" ]; then
 
-    log.write(f'\n[{datetime.now()}] {command}\n'.encode())
+    echo "[INFO] install rpms from the package repository..."
 
-    result = container.exec_run(command, workdir=workdir)
+    cat > "$temporary_directory/opensql.repo" <<EOF
+[opensql]
+name=OpenSQL package
+baseurl=file://$package_directory
+gpgcheck=0
+metadata_expire=0
+module_hotfixes=1
+EOF
 
-    log.write(result.output)
+    if ! dnf install -y --setopt=reposdir="$temporary_directory" $rpm_artifacts; then
+        echo "[ERROR] rpm install is failed." >&2
+        exit 1
+    fi
+fi
 
-    return result
+install_package_directory() {
+    kind=$1 directory=$package_directory/$2
+    shift 2
 
-def parse_spec(spec: dict):
+    case "$kind" in
+        make) make -C "$directory" install "$@" ;;
+        binary) find "$directory" -type f -perm -u+x -exec cp -f {} /usr/local/bin/ \\; ;;
+        pip) pip3 install --no-index --find-links "$directory" "$@" ;;
+    esac
+}
 
-    if spec is None or type(spec) != dict: return None
+jobs=''
 
-    specifications = '[SUPPORTED OS VERSION]'
-    specifications += f'\n{spec[os][name]} {spec[os][version]}'
+while read -r component kind directory arguments; do
+    [ -n "$kind" ] && [ "$kind" != rpm ] || continue
 
-    specifications += '\n[INSTALLABLE BINARIES]'
-    specifications += f'\n{spec[database][name]} {spec[database][version]}'
+    echo "[INFO] install $directory ($kind)..."
+    install_package_directory "$kind" "$directory" $arguments > "$temporary_directory/$directory.log" 2>&1 &
+    jobs="$jobs $!:$directory"
+done <<EOF
+$steps
+EOF
 
-    for component in spec[options]:
-        specifications += f'\n{component[name]} {component[version]}'
+failed=0
 
-    return specifications
+for job in $jobs; do
+    if wait "${job%%:*}"; then
+        echo "[INFO] ${job#*:} is installed."
+    else
+        echo "[ERROR] ${job#*:} install is failed. ($temporary_directory/${job#*:}.log)" >&2
+        failed=1
+    fi
+done
 
-def get_os_docker_image(os_name, os_version, docker_client):
+[ $failed -ne 0 ] || rm -rf "$temporary_directory"
 
-    docker_image = None
-    try:
+exit $failed
+'''
 
-        os_repository = os_repositories.get(os_name, os_name)
+# deduplicated package store (content-addressed blobs shared by targets, and a manifest of archive members per target)
+store_manifest_version = '1'
 
-        docker_image = docker_client.images.get(os_repository+':'+os_version)
+# checkpoints of the completed components of a build (host directory, a directory per target and setting)
+default_checkpoint_directory_name = 'checkpoints'
+checkpoint_state_file_name = 'state.json'
+checkpoint_version = '1'
+checkpoint_lock = threading.Lock()
 
-    except docker.errors.ImageNotFound:
+# default input file name
+default_input_file_name = 'input.yaml'
 
-        print(f'[WARN] docker image ({os_repository}:{os_version}) does not exist in this machine. docker pull will be started.')
+# default number of download steps running at the same time
+default_jobs = 4
 
-    if docker_image is None:
-        try:
+# default number of targets packaged at the same time in a matrix build
+default_workers = 2
 
-            docker_image = docker_client.images.pull(os_repository, os_version)
+# output kept in memory for each command (older output is only in the log file)
+output_tail_limit = 64 * 1024
 
-            print(f'[INFO] docker image ({os_repository}:{os_version}) pull is completed.')
+# targets sharing a worker image wait for the one preparing it
+worker_image_locks = {}
+prepared_worker_images = set()
 
-        except docker.errors.NotFound:
+# warm build containers of the served builds (--serve), kept for each worker image (image id -> { 'idle': [...], 'starting': n }).
+# a container is reset before it is used again: its work directories and /tmp are removed, and so are the rpms installed by the build.
+worker_container_pool = None
+worker_container_pool_size = 1
+worker_container_pool_lock = threading.Lock()
+worker_container_pool_log = None
+worker_rpm_list_path = '/var/lib/opensql-worker.rpms'
 
-            print(f'[ERROR] docker image ({os_repository}:{os_version}) pull is failed. please check the os name and version.')
-            return None
+# builds requested to the server (build id -> build) and the last report of each served target (for the --metrics-file)
+default_serve_directory_name = 'served'
+served_builds = {}
+served_target_reports = {}
+served_builds_lock = threading.Lock()
 
-    return docker_image
+def __main__():
 
-def get_repotrack_if_not_exists(docker_container, docker_container_log):
+    global download_cache_directory
 
-    print(f'[INFO] check repotrack exists...')
-    result = execute_and_log_container('command -v repotrack', docker_container, docker_container_log)
+    arguments = parse_arguments()
+    input_file_name = arguments.setting
 
-    if result.exit_code != 0:
-        print(f'[INFO] repotrack is not found. install yum-utils with dnf...')
-        result = execute_and_log_container('dnf install -y yum-utils', docker_container, docker_container_log)
+    cache_directory = path.abspath(arguments.cache_directory)
+    cache_size_limit = parse_size(arguments.cache_size_limit)
 
-        if result.exit_code != 0:
-            print(f'[ERROR] yum-utils install failed.')
-            return False
+    if arguments.cache_info:
+        print_download_cache_info(cache_directory, cache_size_limit)
+        return
 
-        print(f'[INFO] yum-utils install is completed.')
+    if arguments.cache_prune:
+        prune_download_cache(cache_directory, cache_size_limit)
+        return
 
-        result = execute_and_log_container('command -v repotrack', docker_container, docker_container_log)
+    if arguments.query is not None:
+        query_package_index(arguments.query[0], arguments.query[1], arguments.query[2:])
+        return
 
-        if result.exit_code != 0:
-            print(f'[ERROR] yum-utils is installed, but repotrack is not found.')
-            return False
+    if arguments.materialize is not None:
+        materialize_package(arguments.materialize[0], arguments.materialize[1], arguments.compression, arguments.compression_level, arguments.compression_threads)
+        return
 
-    return True
+    if arguments.store_info is not None:
+        print_store_info(arguments.store_info)
+        return
 
-def init_os(os_name, os_major_version, docker_container, docker_container_log):
+    if arguments.store_prune is not None:
+        prune_store(arguments.store_prune)
+        return
 
-    print(f'[INFO] os init setting...')
+    if not path.isfile(input_file_name):
+        print(f'[ERROR] there is no setting file("{input_file_name}")')
+        return
 
-    epel_setting = os_init_settings[os_name]
+    spec = read_yaml(input_file_name)
 
-    if common in epel_setting:
-        commands = epel_setting[common]
-    else:
-        commands = epel_setting[os_major_version]
+    # a spec with version lists is expanded into several targets
+    targets = expand_spec_targets(spec)
 
-    for command in commands:
-        result = execute_and_log_container(command.format(os_major_version=os_major_version), docker_container, docker_container_log)
+    if targets is None: return
 
-        if result.exit_code != 0:
-            print(f'[ERROR] os init setting is failed.\n{result.output.decode()}')
-            return False
+    if not check_targets(targets): return
 
-    return True
+    mirrors = spec.get('mirrors') or {}
 
-def make_component_directory(component_name, docker_container, docker_container_log):
+    if type(mirrors) != dict or any(type(mirror_prefixes) != list for mirror_prefixes in mirrors.values()):
+        print(f'[ERROR] mirrors must be a map of url prefix to a list of mirror url prefixes.')
+        return
 
-    download_directory = work_directory + '/' + component_name
-    result = execute_and_log_container(f'mkdir -p {download_directory}', docker_container, docker_container_log)
+    url_mirrors.update(mirrors)
 
-    if result.exit_code != 0:
-        print(f'[ERROR] make a directory of {component_name} is failed.\n{result.output.decode()}')
-        return None
+    set_download_limits(arguments)
 
-    return download_directory
+    # the download plans are printed without starting any container
+    if arguments.dry_run:
+        target_names = get_matrix_target_names(targets) if len(targets) > 1 else [ None ]
 
-def download_rpms(artifact, directory, docker_container, docker_container_log):
+        for target, target_name in zip(targets, target_names):
+            if not print_download_plan(target, arguments, target_name): return
 
-    print(f'[INFO] {artifact} download...')
+        return
 
-    download_directory = make_component_directory(directory, docker_container, docker_container_log)
+    if arguments.previous is not None and len(targets) > 1:
+        print(f'[ERROR] --previous cannot be used with a matrix build.')
+        return
 
-    if download_directory is None: return False
+    if (arguments.lock is not None or arguments.write_lock is not None) and len(targets) > 1:
+        print(f'[ERROR] --lock and --write-lock cannot be used with a matrix build.')
+        return
 
-    result = execute_and_log_container(f'repotrack --destdir {download_directory} {artifact}', docker_container, docker_container_log)
+    if arguments.store is not None:
+        make_store_directories(arguments.store)
 
-    if result.exit_code != 0:
-        print(f'[ERROR] {artifact} download is failed.\n{result.output.decode()}')
-        return False
+    if not arguments.no_cache:
+        make_download_cache_directories(cache_directory)
+        download_cache_directory = cache_directory
 
-    return True
+    # the urls are checked and the download plans are printed without docker
+    if arguments.validate:
+        validate_targets(targets, arguments)
+        return
 
-def get_postgresql(os_major_version, pg_version, docker_container, docker_container_log):
+    docker_client = docker.from_env()
+    run_started_at = datetime.now()
 
-    pg_major_version = pg_version.split('.')[0]
+    try:
+        # builds are taken over http until the server is stopped (the targets of the setting are warmed up)
+        if arguments.serve is not None:
+            serve_builds(targets, arguments, docker_client)
 
-    repository_url = component_repositories['postgresql'].format(os_major_version=os_major_version)
+        elif len(targets) == 1:
+            package_file_name = package_name
 
-    result = execute_and_log_container(f'dnf -y install {repository_url}', docker_container, docker_container_log)
+            if arguments.delta:
+                package_file_name = f'{path.splitext(package_name)[0]}-delta{path.splitext(package_name)[1]}'
 
-    if result.exit_code != 0:
-        print(f'[ERROR] dnf pg repository setting is failed.\n{result.output.decode()}')
-        return False
+            package_file_name = get_package_file_name(package_file_name, arguments.compression)
 
-    result = execute_and_log_container('dnf -qy module disable postgresql', docker_container, docker_container_log)
+            # a stored target is written as its manifest in the store
+            if arguments.store is not None:
+                package_file_name = get_store_manifest_path(arguments.store, get_target_name(targets[0]))
 
-    if result.exit_code != 0:
-        print(f'[ERROR] dnf disable default postgresql is failed.\n{result.output.decode()}')
-        return False
+            build_package(targets[0], package_file_name, arguments, docker_client)
+        else:
+            build_matrix(targets, arguments, docker_client)
 
-    print(f'[INFO] pg download...')
+    finally:
 
-    for artifact_format in component_artifacts['postgresql']:
-        artifact = artifact_format.format(version=pg_version, major_version=pg_major_version)
+        # stage times and sizes of every target, also for a failed run
+        write_run_report(run_started_at, arguments.metrics_file)
 
-        success = download_rpms(artifact, 'postgresql', docker_container, docker_container_log)
+        if download_cache_directory is not None:
+            prune_download_cache(download_cache_directory, cache_size_limit)
 
-        if not success: return False
+def get_component_names(kind):
 
-    return True
+    return { component_name for component_name, entry in component_registry.items() if entry['kind'] == kind }
 
-def get_pgpool(os_major_version, pg_major_version, component, docker_container, docker_container_log):
+def get_supported_versions(component_name, pg_major_version):
 
-    print(f'[INFO] pgpool download setting...')
+    # versions of a component, for the pg major version if its versions differ by pg major version
+    versions = component_registry[component_name]['versions']
 
-    component_version_tokens = component[version].split('.')
+    return versions.get(pg_major_version, set()) if type(versions) == dict else versions
 
-    format_arguments = {
-        version: component[version],
-        major_version: component_version_tokens[0],
-        minor_version: component_version_tokens[1],
-        'os_major_version': os_major_version,
-        'pg_major_version': pg_major_version
-    }
+def get_spec_errors(spec):
 
-    number, limit = 1, 5
-    while number < limit:
-        format_arguments['number'] = number
-        repository_url = component_repositories['pgpool'].format(**format_arguments)
+    # every problem of the setting, so all of them are fixed at once
+    errors = []
 
-        result = execute_and_log_container(f'dnf -y install {repository_url}', docker_container, docker_container_log)
+    # Check input parameters
+    if type(spec.get(os)) != dict or spec[os].get(name) not in support_os_versions:
+        errors.append(f'target OS must be set. Please input an OS argument. (available os: {set(support_os_versions)})')
+    elif spec[os].get(version) not in support_os_versions[spec[os][name]]:
+        errors.append(f'os version {spec[os].get(version)} is not supported. (available versions: {support_os_versions[spec[os][name]]})')
 
-        if result.exit_code == 0: break
-        else: number += 1
+    if type(spec.get(database)) != dict or spec[database].get(name) not in get_component_names(database):
+        errors.append(f'target Database must be set. Please input Database argument. (available database: {get_component_names(database)})')
+        return errors
 
-    if number == limit:
-        print(f'[ERROR] pgpool download setting is failed.')
-        return False
+    db_major_version = str(spec[database].get(version)).split('.')[0]
 
-    artifact = component_artifacts['pgpool'].format(**format_arguments)
-    return download_rpms(artifact, 'pgpool', docker_container, docker_container_log)
+    if spec[database].get(version) not in get_supported_versions(spec[database][name], db_major_version):
+        errors.append(f'database version {spec[database].get(version)} is not supported. (available versions: {get_supported_versions(spec[database][name], db_major_version)})')
 
-def get_postgis(pg_major_version, component, docker_container, docker_container_log):
+    # Check components vailidity
+    for component in spec.get(options) or []:
 
-    print(f'[INFO] postgis download...')
+        if component[name] not in get_component_names('option'):
+            errors.append(f'{component[name]} is not an opensql component. (available components: {sorted(get_component_names("option"))})')
+            continue
 
-    format_arguments = {
-        version: component[version],
-        'pg_major_version': pg_major_version
-    }
+        if component[version] not in get_supported_versions(component[name], db_major_version):
+            errors.append(f'there is no supported version {component[version]} of {component[name]} for db major version {db_major_version}. (available versions: {get_supported_versions(component[name], db_major_version)})')
 
-    download_directory = make_component_directory('postgis', docker_container, docker_container_log)
+    return errors
 
-    if download_directory is None: return False
+def check_spec(spec):
 
-    number, limit = 1, 10
-    while number < limit:
-        format_arguments['number'] = number
-        artifact = component_artifacts['postgis'].format(**format_arguments)
-        result = execute_and_log_container(f'repotrack --destdir {download_directory} {artifact}', docker_container, docker_container_log)
+    errors = get_spec_errors(spec)
 
-        if result.exit_code == 0: break
-        else: number += 1
+    for error in errors:
+        print(f'[ERROR] {error}')
 
-    if number == limit:
-        print(f'[ERROR] postgis download is failed.')
-        return False
+    if errors: return False
 
-    return True
+    # the components depending on each other must be downloadable in order
+    return get_download_plan(spec) is not None
 
-def get_barman(component, docker_container, docker_container_log):
+def check_targets(targets):
 
-    artifact = component_artifacts['barman'].format(version=component[version])
+    # the errors of every target are printed at once (an error shared by several targets once)
+    errors = list(dict.fromkeys(error for target in targets for error in get_spec_errors(target)))
 
-    return download_rpms(artifact, 'barman', docker_container, docker_container_log)
+    for error in errors:
+        print(f'[ERROR] {error}')
 
-def get_pg_hint_plan(os_major_version, pg_major_version, component, docker_container, docker_container_log):
+    if errors:
+        print(f'[ERROR] the setting has {len(errors)} errors.')
+        return False
 
-    component_version_tokens = component[version].split('.')
+    return all(get_download_plan(target) is not None for target in targets)
 
-    format_arguments = {
-        version: component[version],
-        major_version: component_version_tokens[0],
-        minor_version: component_version_tokens[1],
-        patch_version: component_version_tokens[2],
-        'os_major_version': os_major_version,
-        'pg_major_version': pg_major_version
-    }
+def build_package(spec, package_file_name, arguments, docker_client, target_name=None):
 
-    artifact = component_repositories['pg_hint_plan'].format(**format_arguments)
+    specifications = parse_spec(spec)
+    print(specifications)
 
-    return download_rpms(artifact, 'pg_hint_plan', docker_container, docker_container_log)
+    # Prepare a docker container based on the target os
+    os_name = spec[os][name]
+    os_version = spec[os][version]
+    db_major_version = spec[database][version].split('.')[0]
 
-def get_pg_build_extension_install_utils(docker_container, docker_container_log):
+    # the stages of the build are measured for the run report
+    build_report = start_build_report(target_name or get_target_name(spec))
 
-    print(f'[INFO] pg build extension install utils download...')
+    docker_container = None
+    docker_container_log = None
+    reusable = True
 
-    success = download_rpms('make', 'extension-utils/make', docker_container, docker_container_log)
+    try:
+        with measure_stage('os_image') as stage:
+            docker_image = get_os_docker_image(os_name, os_version, docker_client)
 
-    if not success: return False
+            if docker_image is None: return False
 
-    success = download_rpms('llvm', 'extension-utils/llvm', docker_container, docker_container_log)
+            stage['size'] = docker_image.attrs.get('Size')
 
-    if not success: return False
+        # the locked files are downloaded as they are, without resolving dependencies
+        lock = None
 
-    return True
+        if arguments.lock is not None:
 
-def curl_check_file_available(url, docker_container, docker_container_log):
+            lock = read_lock_file(arguments.lock, spec)
 
-    result = execute_and_log_container(f'curl -s -f -I {url}', docker_container, docker_container_log)
+            if lock is None: return False
 
-    if result.exit_code == 0: return True
+        # save the logs of the docker container
+        if not path.isdir(log_directory_name):
+            makedirs(log_directory_name)
 
-    return False
+        log_file_name = f'{datetime.now()}.log' if target_name is None else f'{datetime.now()} {target_name}.log'
+        docker_container_log = ContainerLog(f'{log_directory_name}/{log_file_name}')
 
-def curl_download_file(url, path, docker_container, docker_container_log):
+        with measure_stage('worker_image'):
+            worker_image = get_worker_docker_image(os_name, os_version, db_major_version, docker_image, docker_client, docker_container_log, arguments.rebuild_worker_image)
 
-    result = execute_and_log_container(f'curl -L -s -o {path} {url}', docker_container, docker_container_log)
+        if worker_image is None: return False
 
-    if result.exit_code != 0:
-        print(f'[ERROR] curl download is failed.\n({url})\n{result.output.decode()}')
-        return False
+        print(f'[INFO] make a docker container...')
 
-    return True
+        with measure_stage('container'):
+            docker_container = acquire_worker_container(worker_image, docker_container_log)
 
-def get_pg_build_extension(spec, component, docker_container, docker_container_log):
+        if docker_container is None: return False
 
-    print(f'[INFO] pg build extension [{component[name]}] download...')
+        with measure_stage('dnf_metadata', docker_container):
+            success = restore_dnf_metadata(os_name, os_version.split('.')[0], docker_container, docker_container_log)
 
-    download_directory = make_component_directory(component[name], docker_container, docker_container_log)
+            if success:
+                success = link_rpm_cache(os_name, os_version.split('.')[0], lock is None, docker_container, docker_container_log)
 
-    if download_directory is None: return False
+        if not success: return False
 
-    format_arguments = {
-        name: component[name],
-        version: component[version],
-        'os_name': spec[os][name],
-        'os_version': spec[os][version],
-        'pg_major_version': spec[database][version].split('.')[0]
-    }
+        print(f'[INFO] make a work directory...')
 
-    # first, we try downloading with os full version info
-    url = component_repositories['pg_build_extensions'].format(**format_arguments)
+        execute_and_log_container(f'mkdir {work_directory}', docker_container, docker_container_log)
 
-    available = curl_check_file_available(url, docker_container, docker_container_log)
+        # components not changed since the previous package are restored from it instead of downloading
+        previous_package = None
+        reused_components = set()
 
-    # if url is not available, then retry with os major version
-    if not available:
-        print(f'[INFO] trying download pg build extension file with os major version')
-        format_arguments['os_version'] = spec[os][version].split('.')[0]
-        url = component_repositories['pg_build_extensions'].format(**format_arguments)
-        available = curl_check_file_available(url, docker_container, docker_container_log)
+        if arguments.previous is not None:
 
-    # if is not available with os major version, then we give up. no choice.
-    if not available:
-        print(f'[ERROR] there is no availabe pg build extension file {component} for {spec[os]} {spec[database]}')
-        return False
+            previous_package = read_previous_package(arguments.previous)
 
-    path = download_directory + '/tmp.tar'
+            if previous_package is None: return False
 
-    success = curl_download_file(url, path, docker_container, docker_container_log)
+            reused_components = get_reusable_components(spec, previous_package[metadata_file_name], arguments.slim)
 
-    if not success: return False
+            with measure_stage('previous_restore', docker_container):
+                reused_components = restore_previous_components(previous_package, reused_components, docker_container, docker_container_log)
 
-    result = execute_and_log_container('tar -xvf tmp.tar', docker_container, docker_container_log, download_directory)
+            if reused_components is None: return False
 
-    if result.exit_code != 0:
-        print(f'[ERROR] tar -xvf is failed.\n{result.output.decode()}')
-        return False
+        # components completed by a failed build of the same setting are restored from its checkpoint
+        restored_components = set()
 
-    result = execute_and_log_container('rm tmp.tar', docker_container, docker_container_log, download_directory)
+        if lock is None:
 
-    if result.exit_code != 0:
-        print(f'[ERROR] rm tmp.tar is failed.\n{result.output.decode()}')
-        return False
+            checkpoint_directory = get_checkpoint_directory(arguments.checkpoint_directory, spec, target_name)
 
-    return True
+            if arguments.resume:
+                with measure_stage('checkpoint_restore', docker_container):
+                    restored_components = restore_component_checkpoints(spec, checkpoint_directory, reused_components, docker_container, docker_container_log)
 
-def get_etcd(component, docker_container, docker_container_log):
+                if restored_components is None: return False
+            else:
+                shutil.rmtree(checkpoint_directory, ignore_errors=True)
 
-    print(f'[INFO] etcd download...')
+            makedirs(checkpoint_directory, exist_ok=True)
 
-    download_directory = make_component_directory(component[name], docker_container, docker_container_log)
+        # database and optional components
+        with measure_stage('downloads', docker_container):
+            if lock is not None:
+                success = download_locked_files(lock, arguments.jobs, docker_container, docker_container_log)
+            else:
+                success = download_components(spec, arguments.jobs, docker_container, docker_container_log, reused_components | restored_components, checkpoint_directory)
 
-    if download_directory is None: return False
+        # the dnf metadata refreshed by the downloads is kept for the next containers (even if a download is failed)
+        with measure_stage('dnf_metadata_save', docker_container):
+            save_dnf_metadata(os_name, os_version.split('.')[0], docker_container, docker_container_log)
 
-    # parse download url of etcd
-    url = component_repositories['etcd'].format(version=component[version])
+        if not success:
 
-    available = curl_check_file_available(url, docker_container, docker_container_log)
+            if lock is None:
+                print(f'[INFO] completed components are kept in {checkpoint_directory}. run again with --resume to download only the rest.')
 
-    # if is not available, then we give up. no choice.
-    if not available:
-        print(f'[ERROR] there is no availabe pg build extension file {component}')
-        return False
+            return False
 
-    path = download_directory + '/tmp.tar'
+        if arguments.write_lock is not None:
 
-    success = curl_download_file(url, path, docker_container, docker_container_log)
+            with measure_stage('lock_file', docker_container):
+                success = write_lock_file(spec, arguments.write_lock, docker_container, docker_container_log)
 
-    if not success: return False
+            if not success: return False
 
-    result = execute_and_log_container('tar -xvf tmp.tar', docker_container, docker_container_log, download_directory)
+        # leave out the rpms the base os image already has
+        pruned_rpms = ''
 
-    if result.exit_code != 0:
-        print(f'[ERROR] tar -xvf is failed.\n{result.output.decode()}')
-        return False
+        if arguments.slim:
 
-    result = execute_and_log_container('rm tmp.tar', docker_container, docker_container_log, download_directory)
+            with measure_stage('slim', docker_container):
+                pruned_rpms = prune_base_rpms(docker_image, docker_container, docker_container_log)
 
-    if result.exit_code != 0:
-        print(f'[ERROR] rm tmp.tar is failed.\n{result.output.decode()}')
-        return False
+            if pruned_rpms is None: return False
 
-    return True
+        # store the rpms shared between components only once
+        with measure_stage('deduplicate', docker_container):
+            success = deduplicate_package_files(docker_container, docker_container_log)
 
-def get_patroni(component, docker_container, docker_container_log):
+        if not success: return False
+
+        print(f'[INFO] all package download is completed.')
 
-    print(f'[INFO] patroni dependencies download...')
+        # verify the package files before they are packaged
+        with measure_stage('verify', docker_container):
+            verification = verify_package_files(spec, docker_container, docker_container_log, base_root_directory if arguments.slim else None)
 
-    dependencies = { 'python3', 'python3-psycopg2', 'gcc', 'python3-devel' }
+        if verification is None: return False
 
-    for artifact in dependencies:
+        # put spec info with the verification results (and the pruned rpms of a slim package)
+        execute_and_log_container(['sh', '-c', f'printf "%s\\n" "$0" > {work_directory}/{metadata_file_name}', f'{specifications}\n{verification}{pruned_rpms}'], docker_container, docker_container_log)
 
-        success = download_rpms(artifact, f'{component[name]}-dependencies/{artifact}', docker_container, docker_container_log)
+        # put the package repository and the install script
+        with measure_stage('install_files', docker_container):
+            success = write_install_files(spec, docker_container, docker_container_log)
 
         if not success: return False
 
-    print(f'[INFO] patroni download...')
+        # put the index of the package files
+        with measure_stage('index', docker_container):
+            success = write_package_index(spec, docker_container, docker_container_log)
 
-    component_directory = make_component_directory(component[name], docker_container, docker_container_log)
+        if not success: return False
 
-    if component_directory is None: return False
+        archive_directory = work_directory
 
-    artifact = 'patroni[etcd]==' + component[version]
-    result = execute_and_log_container(f'pip3 download {artifact}', docker_container, docker_container_log, component_directory)
+        # a delta package has only the changed components, to be extracted over the previous package
+        if arguments.delta:
+
+            with measure_stage('delta', docker_container):
+                archive_directory = prepare_delta_directory(spec, previous_package, reused_components, docker_container, docker_container_log)
+
+            if archive_directory is None: return False
+
+        # get archive from container
+        print('[INFO] make an package archive and get the archive from worker container...')
+
+        with measure_stage('export') as stage:
+            if arguments.store is not None:
+                stage['size'], stage['new_size'] = export_package_to_store(docker_container, arguments.store, target_name or get_target_name(spec), archive_directory)
+                success = True
+            else:
+                success = export_package(docker_container, package_file_name, arguments.compression, arguments.compression_level, arguments.compression_threads, archive_directory)
+
+                if success: stage['size'] = path.getsize(package_file_name)
+
+        if not success: return False
+
+        if lock is None:
+            shutil.rmtree(checkpoint_directory, ignore_errors=True)
+
+        print(f'[INFO] packaging is completed. ({package_file_name})')
+
+        build_report.update({ 'success': True, 'package': package_file_name, 'package_size': stage.get('size'), 'package_new_size': stage.get('new_size') })
+
+        return True
+
+    except Exception:
+        logging.error(traceback.format_exc())
+
+        # the container can be in the middle of a command
+        reusable = False
+
+        return False
+
+    finally:
+
+        finish_build_report(build_report)
+
+        if docker_container is not None:
+
+            with download_records_lock:
+                download_records.pop(docker_container.id, None)
+
+            release_worker_container(worker_image, docker_container, docker_container_log, reusable)
+
+        if docker_container_log is not None:
+            docker_container_log.close()
+
+def get_package_file_name(file_name, compression):
+
+    return file_name + package_compressions[compression]
+
+class HashingFileWriter:
+
+    # writes to a file and computes the sha256 of the written bytes at the same time
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+class HashingFileReader:
+
+    # reads from a file and computes the sha256 of the read bytes at the same time
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.hash.update(data)
+        return data
+
+def open_package_writer(writer, compression, level, threads):
+
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=level or 6)
+
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level or 3, threads=threads or -1).stream_writer(writer, closefd=False)
+
+    return None
+
+def export_package(docker_container, package_file_name, compression, level, threads, archive_directory=work_directory):
+
+    if compression == 'zstd' and importlib.util.find_spec('zstandard') is None:
+        print(f'[ERROR] zstd compression needs the zstandard library. (pip install zstandard)')
+        return False
+
+    # the archive stream is compressed and checksummed while it is written, without staging an uncompressed copy
+    with open(package_file_name, 'wb') as file:
+
+        writer = HashingFileWriter(file)
+        package_writer = open_package_writer(writer, compression, level, threads)
+
+        stream, _ = docker_container.get_archive(archive_directory)
+
+        for chunk in stream:
+            (package_writer or writer).write(chunk)
+
+        if package_writer is not None:
+            package_writer.close()
+
+    # sidecar checksum manifest (sha256sum -c format)
+    with open(f'{package_file_name}.sha256', 'w') as file:
+        file.write(f'{writer.hash.hexdigest()}  {path.basename(package_file_name)}\n')
+
+    print(f'[INFO] package archive is written. ({package_file_name}, {format_size(writer.size)}, sha256 {writer.hash.hexdigest()})')
+
+    return True
+
+class ChunkStreamReader(io.RawIOBase):
+
+    # file object over the chunks of a docker archive stream, to read it with tarfile in stream mode
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b''
+                return 0
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+
+        return size
+
+def get_store_blob_path(store_directory, digest):
+
+    return path.join(store_directory, 'blobs', digest[:2], digest)
+
+def get_store_manifest_path(store_directory, target_name):
+
+    return path.join(store_directory, 'targets', f'{target_name}.json')
+
+def export_package_to_store(docker_container, store_directory, target_name, archive_directory=work_directory):
+
+    # every file of the archive is stored once by its checksum, and the target keeps only the list of archive members.
+    # targets sharing files (ex. the same rpms for several os versions) share the blobs.
+    members = []
+    stored_size, new_size = 0, 0
+
+    stream, _ = docker_container.get_archive(archive_directory)
+
+    with tarfile.open(fileobj=io.BufferedReader(ChunkStreamReader(stream), 1024 * 1024), mode='r|') as archive:
+
+        for member in archive:
+
+            entry = {
+                'name': member.name, 'type': member.type.decode(), 'mode': member.mode, 'mtime': member.mtime,
+                'uid': member.uid, 'gid': member.gid, 'uname': member.uname, 'gname': member.gname
+            }
+
+            if member.issym() or member.islnk():
+                entry['linkname'] = member.linkname
+
+            if member.isreg():
+
+                temporary_path = path.join(store_directory, 'blobs', f'.{getpid()}.{threading.get_ident()}')
+                blob_hash = hashlib.sha256()
+
+                member_file = archive.extractfile(member)
+
+                with open(temporary_path, 'wb') as blob_file:
+                    for chunk in iter(lambda: member_file.read(1024 * 1024), b''):
+                        blob_hash.update(chunk)
+                        blob_file.write(chunk)
+
+                digest = blob_hash.hexdigest()
+                blob_path = get_store_blob_path(store_directory, digest)
+
+                if path.isfile(blob_path):
+                    remove(temporary_path)
+                else:
+                    makedirs(path.dirname(blob_path), exist_ok=True)
+                    replace(temporary_path, blob_path)
+                    new_size += member.size
+
+                entry.update({ 'size': member.size, 'sha256': digest })
+                stored_size += member.size
+
+            members.append(entry)
+
+    # new_size is the size of the blobs this target added to the store, when it was stored
+    manifest = {
+        'version': store_manifest_version,
+        'target': target_name,
+        'created_at': datetime.now().isoformat(),
+        'new_size': new_size,
+        'members': members
+    }
+
+    # the manifest is replaced atomically, so a target is always complete in the store
+    manifest_path = get_store_manifest_path(store_directory, target_name)
+    temporary_path = f'{manifest_path}.{getpid()}.{threading.get_ident()}'
+
+    with open(temporary_path, 'w') as file: json.dump(manifest, file)
+    replace(temporary_path, manifest_path)
+
+    print(f'[INFO] package is stored. ({manifest_path}, {format_size(stored_size)} of files, {format_size(new_size)} newly stored)')
+
+    return stored_size, new_size
+
+def get_stored_package_sizes(store_directory, target_name):
+
+    with open(get_store_manifest_path(store_directory, target_name), 'r') as file:
+        manifest = json.load(file)
+
+    return sum(member.get('size', 0) for member in manifest['members']), manifest.get('new_size')
+
+def make_store_directories(store_directory):
+
+    for directory in [ 'blobs', 'targets' ]:
+        makedirs(path.join(store_directory, directory), exist_ok=True)
+
+def read_store_manifests(store_directory):
+
+    manifests = {}
+    targets_directory = path.join(store_directory, 'targets')
+
+    for file_name in sorted(listdir(targets_directory)) if path.isdir(targets_directory) else []:
+        if not file_name.endswith('.json'): continue
+
+        with open(path.join(targets_directory, file_name), 'r') as file:
+            manifest = json.load(file)
+
+        manifests[manifest['target']] = manifest
+
+    return manifests
+
+def materialize_package(store_directory, target_name, compression, level, threads):
+
+    manifest_path = get_store_manifest_path(store_directory, target_name)
+
+    if not path.isfile(manifest_path):
+        print(f'[ERROR] there is no target {target_name} in the store. (targets: {", ".join(read_store_manifests(store_directory)) or "none"})')
+        return False
+
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+
+    missing_blobs = [ member['name'] for member in manifest['members'] if 'sha256' in member and not path.isfile(get_store_blob_path(store_directory, member['sha256'])) ]
+
+    if missing_blobs:
+        print(f'[ERROR] {len(missing_blobs)} files of {target_name} are missing in the store. ({missing_blobs[0]}, ...)')
+        return False
+
+    if compression == 'zstd' and importlib.util.find_spec('zstandard') is None:
+        print(f'[ERROR] zstd compression needs the zstandard library. (pip install zstandard)')
+        return False
+
+    package_file_name = get_package_file_name(f'{path.splitext(package_name)[0]}-{target_name}{path.splitext(package_name)[1]}', compression)
+
+    print(f'[INFO] materialize {target_name}... ({package_file_name})')
+
+    # the archive members are written in the stored order, so hard links follow the files they refer to
+    with open(package_file_name, 'wb') as file:
+
+        writer = HashingFileWriter(file)
+        package_writer = open_package_writer(writer, compression, level, threads)
+
+        with tarfile.open(fileobj=package_writer or writer, mode='w|') as archive:
+
+            for member in manifest['members']:
+
+                member_info = tarfile.TarInfo(member['name'])
+                member_info.type = member['type'].encode()
+
+                for attribute in [ 'mode', 'mtime', 'uid', 'gid', 'uname', 'gname', 'linkname' ]:
+                    if attribute in member: setattr(member_info, attribute, member[attribute])
+
+                if 'sha256' not in member:
+                    archive.addfile(member_info)
+                    continue
+
+                member_info.size = member['size']
+
+                with open(get_store_blob_path(store_directory, member['sha256']), 'rb') as blob_file:
+                    archive.addfile(member_info, blob_file)
+
+        if package_writer is not None:
+            package_writer.close()
+
+    with open(f'{package_file_name}.sha256', 'w') as file:
+        file.write(f'{writer.hash.hexdigest()}  {path.basename(package_file_name)}\n')
+
+    print(f'[INFO] package archive is written. ({package_file_name}, {format_size(writer.size)}, sha256 {writer.hash.hexdigest()})')
+
+    return True
+
+def get_store_blobs(store_directory):
+
+    blobs = {}
+
+    for root, _, file_names in walk(path.join(store_directory, 'blobs')):
+        for file_name in file_names:
+            if not file_name.startswith('.'): blobs[file_name] = stat(path.join(root, file_name)).st_size
+
+    return blobs
+
+def print_store_info(store_directory):
+
+    manifests = read_store_manifests(store_directory)
+    blobs = get_store_blobs(store_directory)
+
+    referenced_digests = set()
+    total_size = 0
+
+    print(f'[INFO] package store ({store_directory})')
+    print(f'    {"target":<48} {"files":>7} {"size":>10}')
+
+    for target_name, manifest in manifests.items():
+
+        files = [ member for member in manifest['members'] if 'sha256' in member ]
+        size = sum(member['size'] for member in files)
+
+        referenced_digests.update(member['sha256'] for member in files)
+        total_size += size
+
+        print(f'    {target_name:<48} {len(files):>7} {format_size(size):>10}')
+
+    stored_size = sum(blobs.values())
+    unreferenced_digests = set(blobs) - referenced_digests
+
+    print(f'    {len(manifests)} targets, {format_size(total_size)} of files stored as {len(blobs)} blobs of {format_size(stored_size)}'
+          + (f' ({total_size / stored_size:.1f}x deduplicated)' if stored_size else ''))
+
+    if unreferenced_digests:
+        print(f'    {len(unreferenced_digests)} blobs ({format_size(sum(blobs[digest] for digest in unreferenced_digests))}) are not referenced by any target. (--store-prune removes them)')
+
+def prune_store(store_directory):
+
+    # blobs not referenced by any target manifest (ex. after a manifest is removed) are removed
+    referenced_digests = { member['sha256'] for manifest in read_store_manifests(store_directory).values() for member in manifest['members'] if 'sha256' in member }
+    blobs = get_store_blobs(store_directory)
+
+    removed_size = 0
+
+    for digest, size in blobs.items():
+        if digest in referenced_digests: continue
+
+        remove(get_store_blob_path(store_directory, digest))
+        removed_size += size
+
+    print(f'[INFO] {len(set(blobs) - referenced_digests)} unreferenced blobs are removed. ({format_size(removed_size)})')
+
+def as_version_list(value):
+
+    return value if type(value) == list else [ value ]
+
+def sort_versions(versions):
+
+    return sorted(versions, key=lambda value: [ int(token) if token.isdigit() else token for token in value.split('.') ])
+
+def is_version_value(value):
+
+    return type(value) == str or (type(value) == list and len(value) > 0 and all(type(item) == str for item in value))
+
+def get_spec_structure_errors(spec):
+
+    # entries that cannot be expanded into targets, all of them at once
+    errors = []
+
+    for os_entry in as_version_list(spec[os]):
+        if type(os_entry) != dict or type(os_entry.get(name)) != str or not is_version_value(os_entry.get(version)):
+            errors.append(f'an os entry must have a name and a version. ({os_entry})')
+
+    if type(spec[database]) != dict or type(spec[database].get(name)) != str or not is_version_value(spec[database].get(version)):
+        errors.append(f'database must have a name and a version. ({spec[database]})')
+
+    if type(spec.get(options) or []) != list:
+        errors.append(f'options must be a list of components. ({spec[options]})')
+        return errors
+
+    # options without a name or a version cannot be expanded
+    for component in spec.get(options) or []:
+        if type(component) != dict or type(component.get(name)) != str or not is_version_value(component.get(version)):
+            errors.append(f'an option must have a name and a version. ({component})')
+
+    return errors
+
+def expand_spec_targets(spec):
+
+    if spec is None or type(spec) != dict: return None
+
+    if os not in spec or database not in spec:
+        print(f'[ERROR] target OS and Database must be set.')
+        return None
+
+    errors = get_spec_structure_errors(spec)
+
+    for error in errors:
+        print(f'[ERROR] {error}')
+
+    if errors:
+        print(f'[ERROR] the setting has {len(errors)} errors.')
+        return None
+
+    # os can be a list of os entries, and every version can be a list or '*' (all supported versions)
+    os_targets = []
+
+    for os_entry in as_version_list(spec[os]):
+
+        os_versions = as_version_list(os_entry[version])
+
+        if os_versions == [ '*' ]:
+            os_versions = sort_versions(support_os_versions.get(os_entry[name], set()))
+
+        os_targets += [ { name: os_entry[name], version: os_version } for os_version in os_versions ]
+
+    db_versions = as_version_list(spec[database][version])
+
+    if db_versions == [ '*' ]:
+        db_versions = sort_versions(component_registry.get(spec[database][name], {}).get('versions', set()))
+
+    targets = []
+
+    for os_target, db_version in itertools.product(os_targets, db_versions):
+
+        db_major_version = db_version.split('.')[0]
+
+        # an option with a version list takes the versions supported for the target db major version
+        option_choices = []
+
+        for component in spec.get(options) or []:
+
+            component_versions = as_version_list(component[version])
+
+            if len(component_versions) > 1 and type(component_registry.get(component[name], {}).get('versions')) == dict:
+                component_versions = [
+                    component_version for component_version in component_versions
+                    if component_version in get_supported_versions(component[name], db_major_version)
+                ] or component_versions
+
+            option_choices.append([ { **component, version: component_version } for component_version in component_versions ])
+
+        for option_components in itertools.product(*option_choices):
+            targets.append({
+                os: os_target,
+                database: { **spec[database], version: db_version },
+                options: list(option_components)
+            })
+
+    if not targets:
+        print(f'[ERROR] there is no target to package.')
+        return None
+
+    return targets
+
+def get_target_name(spec, varying_components=()):
+
+    target_name = f'{spec[os][name]}{spec[os][version]}-pg{spec[database][version]}'
+
+    for component in spec[options]:
+        if component[name] in varying_components:
+            target_name += f'-{component[name]}{component[version]}'
+
+    return target_name
+
+def build_target(target, target_name, arguments, docker_client, output_directory=None):
+
+    package_file_name = get_package_file_name(f'{path.splitext(package_name)[0]}-{target_name}{path.splitext(package_name)[1]}', arguments.compression)
+
+    if output_directory is not None:
+        package_file_name = path.join(output_directory, package_file_name)
+
+    # a stored target is written as its manifest in the store
+    if arguments.store is not None:
+        package_file_name = get_store_manifest_path(arguments.store, target_name)
+
+    started_at = time.monotonic()
+
+    success = build_package(target, package_file_name, arguments, docker_client, target_name)
+
+    elapsed_time = time.monotonic() - started_at
+    package_size, new_size = None, None
+
+    # a stored target has the size of its files, and the size newly stored in the store
+    if success and arguments.store is not None:
+        package_size, new_size = get_stored_package_sizes(arguments.store, target_name)
+    elif success and path.isfile(package_file_name):
+        package_size = path.getsize(package_file_name)
+
+    return success, package_file_name, elapsed_time, package_size, new_size
+
+def get_matrix_target_names(targets):
+
+    # options having several versions for the same os and database are added to the output names
+    component_versions = {}
+
+    for target in targets:
+        for component in target[options]:
+            key = (component[name], get_target_name(target))
+            component_versions.setdefault(key, set()).add(component[version])
+
+    varying_components = { component_name for (component_name, _), versions in component_versions.items() if len(versions) > 1 }
+
+    return [ get_target_name(target, varying_components) for target in targets ]
+
+def build_matrix(targets, arguments, docker_client):
+
+    target_names = get_matrix_target_names(targets)
+
+    print(f'[INFO] {len(targets)} targets will be packaged. (workers: {arguments.workers})')
+    for target_name in target_names:
+        print(f'    {target_name}')
+
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+
+        futures = {
+            executor.submit(build_target, target, target_name, arguments, docker_client): target_name
+            for target, target_name in zip(targets, target_names)
+        }
+
+        for future in futures:
+            results[futures[future]] = future.result()
+
+    # stored targets also show the size newly stored in the store (the files shared with other targets are stored once)
+    stored = arguments.store is not None
+
+    print('[INFO] matrix packaging summary')
+    print(f'    {"target":<48} {"status":<8} {"time":>9} {"size":>10}' + (f' {"new":>10}' if stored else '') + '  package')
+
+    for target_name in target_names:
+
+        success, package_file_name, elapsed_time, package_size, new_size = results[target_name]
+
+        status = 'success' if success else 'failed'
+        size = format_size(package_size) if package_size is not None else '-'
+        new = f' {format_size(new_size) if new_size is not None else "-":>10}' if stored else ''
+
+        print(f'    {target_name:<48} {status:<8} {elapsed_time:>8.1f}s {size:>10}{new}  {package_file_name if success else "-"}')
+
+    return all(result[0] for result in results.values())
+
+def start_build_report(target_name):
+
+    report = {
+        'target': target_name,
+        'started_at': datetime.now().isoformat(),
+        'success': False,
+        'duration': None,
+        'package': None,
+        'package_size': None,
+        'package_new_size': None,
+        'stages': []
+    }
+
+    # a served build keeps the reports of its thread, instead of the run
+    reports = getattr(build_report_context, 'reports', None)
+
+    with build_reports_lock:
+        (build_reports if reports is None else reports).append(report)
+
+    build_report_context.report = report
+
+    return report
+
+def finish_build_report(report):
+
+    report['duration'] = round((datetime.now() - datetime.fromisoformat(report['started_at'])).total_seconds(), 3)
+    build_report_context.report = None
+
+def run_with_build_report(report, stages, function, *args):
+
+    # the stages measured in another thread (ex. a component download) are added to the build report,
+    # and its received bytes to the stages running it
+    build_report_context.report = report
+    build_report_context.stages = stages
+
+    try:
+        return function(*args)
+    finally:
+        build_report_context.report = None
+        build_report_context.stages = ()
+
+def add_received_bytes(received_bytes):
+
+    with build_reports_lock:
+        for entry in getattr(build_report_context, 'stages', ()):
+            entry['received_bytes'] += received_bytes
+
+@contextlib.contextmanager
+def measure_stage(stage, docker_container=None, component=None):
+
+    # time of a stage of the current build, with the bytes received by the steps it runs in its container
+    # (also in the threads it starts, so other stages running at the same time are not counted).
+    # the stage is yielded, so the size of its result can be added.
+    report = getattr(build_report_context, 'report', None)
+    stages = getattr(build_report_context, 'stages', ())
+    entry = { 'stage': stage }
+
+    if component is not None:
+        entry.update({ 'component': component[name], 'version': component[version] })
+
+    started_at = time.time()
+
+    entry['started_at'] = datetime.fromtimestamp(started_at).isoformat()
+
+    if docker_container is not None:
+        entry['received_bytes'] = 0
+        build_report_context.stages = stages + (entry,)
+
+    try:
+        yield entry
+
+    finally:
+
+        entry['duration'] = round(time.time() - started_at, 3)
+        build_report_context.stages = stages
+
+        if report is not None:
+            with build_reports_lock:
+                report['stages'].append(entry)
+
+def get_run_report(run_started_at, reports):
+
+    return {
+        'version': run_report_version,
+        'started_at': run_started_at.isoformat(),
+        'ended_at': datetime.now().isoformat(),
+        'success': all(report['success'] for report in reports),
+        'targets': reports
+    }
+
+def write_run_report(run_started_at, metrics_file_name=None):
+
+    with build_reports_lock:
+        reports = copy.deepcopy(build_reports)
+
+    if not reports: return
+
+    run_report = get_run_report(run_started_at, reports)
+
+    makedirs(log_directory_name, exist_ok=True)
+    report_file_name = f'{log_directory_name}/{run_started_at} report.json'
+
+    with open(report_file_name, 'w') as file:
+        json.dump(run_report, file, indent=2)
+
+    print(f'[INFO] run report is written. ({report_file_name})')
+
+    if metrics_file_name is not None:
+        write_metrics_file(run_report, metrics_file_name)
+
+def write_metrics_file(run_report, metrics_file_name):
+
+    # the file is replaced atomically, so a collector never reads it half written
+    temporary_path = f'{metrics_file_name}.{getpid()}.{threading.get_ident()}'
+
+    with open(temporary_path, 'w') as file:
+        file.write(format_metrics(run_report))
+
+    replace(temporary_path, metrics_file_name)
+
+    print(f'[INFO] metrics are written. ({metrics_file_name})')
+
+def format_metric_labels(labels):
+
+    values = [ (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for label, value in labels.items() ]
+
+    return '{' + ','.join(f'{label}="{value}"' for label, value in values) + '}'
+
+def format_metrics(run_report):
+
+    # prometheus text format. the times of a stage run several times in a build (ex. with each component) are added up.
+    metrics = {
+        'build_success': ('gauge', 'whether the package build of the target succeeded (1) or failed (0)', {}),
+        'build_duration_seconds': ('gauge', 'time of the package build of the target', {}),
+        'package_size_bytes': ('gauge', 'size of the package file of the target (the size of its files if it is stored)', {}),
+        'package_new_bytes': ('gauge', 'size newly stored in the package store by the target (--store)', {}),
+        'stage_duration_seconds': ('gauge', 'time of a build stage (component downloads have the component label)', {}),
+        'stage_received_bytes': ('gauge', 'bytes received by the downloads of a build stage', {}),
+        'stage_size_bytes': ('gauge', 'size of the result of a build stage (os image, downloaded component, package)', {}),
+        'last_run_timestamp_seconds': ('gauge', 'time when the last packaging run ended', {})
+    }
+
+    for report in run_report['targets']:
+
+        target_labels = (('target', report['target']),)
+
+        metrics['build_success'][2][target_labels] = int(report['success'])
+        metrics['build_duration_seconds'][2][target_labels] = report['duration'] or 0
+
+        if report['package_size'] is not None:
+            metrics['package_size_bytes'][2][target_labels] = report['package_size']
+
+        if report.get('package_new_size') is not None:
+            metrics['package_new_bytes'][2][target_labels] = report['package_new_size']
+
+        for stage in report['stages']:
+
+            stage_labels = target_labels + (('stage', stage['stage']), ('component', stage.get('component', '')))
+
+            for metric, key in [ ('stage_duration_seconds', 'duration'), ('stage_received_bytes', 'received_bytes'), ('stage_size_bytes', 'size') ]:
+                if stage.get(key) is not None:
+                    metrics[metric][2][stage_labels] = metrics[metric][2].get(stage_labels, 0) + stage[key]
+
+    metrics['last_run_timestamp_seconds'][2][()] = round(datetime.fromisoformat(run_report['ended_at']).timestamp(), 3)
+
+    lines = []
+
+    for metric, (metric_type, description, samples) in metrics.items():
+
+        if not samples: continue
+
+        lines += [ f'# HELP {metrics_prefix}_{metric} {description}', f'# TYPE {metrics_prefix}_{metric} {metric_type}' ]
+        lines += [ f'{metrics_prefix}_{metric}{format_metric_labels(dict(labels)) if labels else ""} {value}' for labels, value in samples.items() ]
+
+    return '\n'.join(lines) + '\n'
+
+def get_served_build_status(build):
+
+    statuses = { target['status'] for target in build['targets'] }
+
+    if statuses == { 'queued' }: return 'queued'
+    if statuses & { 'queued', 'running' }: return 'running'
+
+    return 'succeeded' if statuses == { 'succeeded' } else 'failed'
+
+def get_served_build(build, with_reports=False):
+
+    with served_builds_lock:
+        targets = [ { key: value for key, value in target.items() if with_reports or key != 'report' } for target in build['targets'] ]
+
+        return copy.deepcopy({ 'id': build['id'], 'created_at': build['created_at'], 'status': get_served_build_status(build), 'targets': targets })
+
+def submit_served_build(body, arguments, docker_client, executor):
+
+    # the body is a setting (yaml or json), read and checked like a setting file. its targets are built by the workers.
+    try:
+        spec = yaml.load(body, Loader=yaml.BaseLoader)
+    except yaml.YAMLError as e:
+        return 400, { 'errors': [ f'setting cannot be read. ({e})' ] }
+
+    try:
+        # the entries that cannot be expanded are answered like the other setting errors
+        if type(spec) == dict and os in spec and database in spec and get_spec_structure_errors(spec):
+            return 400, { 'errors': get_spec_structure_errors(spec) }
+
+        targets = expand_spec_targets(spec)
+
+        if targets is None:
+            return 400, { 'errors': [ 'setting cannot be expanded into targets. (see the server output)' ] }
+
+        errors = list(dict.fromkeys(error for target in targets for error in get_spec_errors(target)))
+
+        if not errors and any(get_download_plan(target) is None for target in targets):
+            errors.append('component dependencies cannot be satisfied.')
+
+    except Exception:
+        logging.error(traceback.format_exc())
+        return 400, { 'errors': [ 'setting is invalid. (see the server output)' ] }
+
+    if errors:
+        return 400, { 'errors': errors }
+
+    build_id = uuid.uuid4().hex[:12]
+    target_names = get_matrix_target_names(targets)
+
+    build = {
+        'id': build_id,
+        'created_at': datetime.now().isoformat(),
+        'directory': path.join(arguments.serve_directory, build_id),
+        'targets': [
+            { 'target': target_name, 'status': 'queued', 'package': None, 'package_size': None, 'package_new_size': None, 'elapsed_time': None, 'report': None }
+            for target_name in target_names
+        ]
+    }
+
+    makedirs(build['directory'])
+
+    with served_builds_lock:
+        served_builds[build_id] = build
+
+    print(f'[INFO] build {build_id} is requested. ({", ".join(target_names)})')
+
+    for target, served_target in zip(targets, build['targets']):
+        executor.submit(build_served_target, build, served_target, target, arguments, docker_client)
+
+    return 202, get_served_build(build)
+
+def build_served_target(build, served_target, target, arguments, docker_client):
+
+    with served_builds_lock:
+        served_target['status'] = 'running'
+
+    # every build has its own checkpoints, so builds of the same setting can run at the same time
+    target_arguments = copy.copy(arguments)
+    target_arguments.checkpoint_directory = path.join(build['directory'], 'checkpoints')
+
+    reports = []
+    build_report_context.reports = reports
+
+    try:
+        success, package_file_name, elapsed_time, package_size, new_size = build_target(target, served_target['target'], target_arguments, docker_client, build['directory'])
+    except Exception:
+        logging.error(traceback.format_exc())
+        success, package_file_name, elapsed_time, package_size, new_size = False, None, None, None, None
+    finally:
+        build_report_context.reports = None
+
+    with served_builds_lock:
+
+        served_target.update({
+            'status': 'succeeded' if success else 'failed',
+            'package': package_file_name if success else None,
+            'package_size': package_size,
+            'package_new_size': new_size,
+            'elapsed_time': round(elapsed_time, 3) if elapsed_time is not None else None,
+            'report': reports[0] if reports else None
+        })
+
+        if reports:
+            served_target_reports[served_target['target']] = reports[0]
+
+        if arguments.metrics_file is not None:
+            write_metrics_file(get_run_report(datetime.now(), list(served_target_reports.values())), arguments.metrics_file)
+
+    print(f'[INFO] {served_target["target"]} of build {build["id"]} is {served_target["status"]}.')
+
+class BuildRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # api of the build server
+    #   POST /builds                            request a build of the setting in the body (yaml or json)
+    #   GET  /builds                            builds and the status of their targets
+    #   GET  /builds/{id}                       a build with the stage report of each target
+    #   GET  /builds/{id}/packages/{target}     package file of a built target
+    #   GET  /status                            builds by status and warm containers by worker image
+
+    def send_json(self, status, body):
+
+        data = json.dumps(body, indent=2).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+
+        if self.path.rstrip('/') != '/builds':
+            return self.send_json(404, { 'errors': [ f'there is no api {self.path}.' ] })
+
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        self.send_json(*submit_served_build(body, self.server.arguments, self.server.docker_client, self.server.executor))
+
+    def do_GET(self):
+
+        parts = [ urllib.parse.unquote(part) for part in self.path.split('?')[0].strip('/').split('/') ]
+
+        if parts == [ 'status' ]:
+
+            with served_builds_lock:
+                builds = list(served_builds.values())
+
+            with worker_container_pool_lock:
+                pool = { image_id.removeprefix('sha256:')[:12]: len(entry['idle']) for image_id, entry in worker_container_pool.items() }
+
+            statuses = [ get_served_build_status(build) for build in builds ]
+
+            return self.send_json(200, { 'builds': { status: statuses.count(status) for status in set(statuses) }, 'warm_containers': pool })
+
+        if parts == [ 'builds' ]:
+
+            with served_builds_lock:
+                builds = list(served_builds.values())
+
+            return self.send_json(200, [ get_served_build(build) for build in builds ])
+
+        with served_builds_lock:
+            build = served_builds.get(parts[1]) if len(parts) > 1 and parts[0] == 'builds' else None
+
+        if build is None:
+            return self.send_json(404, { 'errors': [ f'there is no build or api {self.path}.' ] })
+
+        if len(parts) == 2:
+            return self.send_json(200, get_served_build(build, with_reports=True))
+
+        served_target = next((target for target in get_served_build(build)['targets'] if len(parts) == 4 and parts[2] == 'packages' and target['target'] == parts[3]), None)
+
+        if served_target is None or served_target['package'] is None or not path.isfile(served_target['package']):
+            return self.send_json(404, { 'errors': [ f'there is no package {self.path}.' ] })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(path.getsize(served_target['package'])))
+        self.send_header('Content-Disposition', f'attachment; filename="{path.basename(served_target["package"])}"')
+        self.end_headers()
+
+        with open(served_target['package'], 'rb') as file:
+            shutil.copyfileobj(file, self.wfile, 1024 * 1024)
+
+    def log_message(self, format, *args):
+
+        print(f'[INFO] api {format % args}')
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+def warm_worker_containers(target, arguments, docker_client):
+
+    # the worker image of the target is prepared, and its containers are started before any build is requested
+    docker_image = get_os_docker_image(target[os][name], target[os][version], docker_client)
+
+    if docker_image is None: return
+
+    worker_image = get_worker_docker_image(target[os][name], target[os][version], target[database][version].split('.')[0], docker_image, docker_client, worker_container_pool_log, arguments.rebuild_worker_image)
+
+    if worker_image is None: return
+
+    fill_worker_container_pool(worker_image, worker_container_pool_log)
+
+    print(f'[INFO] worker containers of {get_target_name(target)} are warm.')
+
+def serve_builds(targets, arguments, docker_client):
+
+    global worker_container_pool, worker_container_pool_size, worker_container_pool_log
+
+    worker_container_pool = {}
+    worker_container_pool_size = arguments.serve_pool_size
+
+    makedirs(log_directory_name, exist_ok=True)
+    makedirs(arguments.serve_directory, exist_ok=True)
+
+    worker_container_pool_log = ContainerLog(f'{log_directory_name}/{datetime.now()} serve.log')
+
+    # unix:{path}, or {host}:{port}
+    if arguments.serve.startswith('unix:'):
+        socket_path = arguments.serve.removeprefix('unix:')
+
+        if path.exists(socket_path): remove(socket_path)
+
+        server = UnixHTTPServer(socket_path, BuildRequestHandler)
+    else:
+        host, _, port = arguments.serve.rpartition(':')
+        server = http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), BuildRequestHandler)
+
+    server.arguments = arguments
+    server.docker_client = docker_client
+    server.executor = ThreadPoolExecutor(max_workers=arguments.workers)
+
+    # the targets of the setting file are warmed up (each worker image once)
+    warm_targets = { (target[os][name], target[os][version], target[database][version].split('.')[0]): target for target in targets }
+
+    for target in warm_targets.values() if arguments.serve_pool_size > 0 else []:
+        threading.Thread(target=warm_worker_containers, args=(target, arguments, docker_client), daemon=True).start()
+
+    print(f'[INFO] build server is started. ({arguments.serve}, workers: {arguments.workers}, warm containers: {arguments.serve_pool_size} per worker image)')
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        print(f'[INFO] build server is stopped. the running builds are waited for...')
+
+    finally:
+
+        server.server_close()
+        server.executor.shutdown(wait=True, cancel_futures=True)
+
+        with worker_container_pool_lock:
+            docker_containers = [ docker_container for entry in worker_container_pool.values() for docker_container in entry['idle'] ]
+            worker_container_pool.clear()
+
+        for docker_container in docker_containers:
+            docker_container.kill()
+            docker_container.remove()
+
+        worker_container_pool_log.close()
+
+        if arguments.serve.startswith('unix:') and path.exists(arguments.serve.removeprefix('unix:')):
+            remove(arguments.serve.removeprefix('unix:'))
+
+def parse_arguments(argv=None):
+
+    parser = argparse.ArgumentParser(description="OpenSQL package setting file parser")
+
+    parser.add_argument('--setting', type=str, default=default_input_file_name, help="OpenSQL package setting yaml file name")
+    parser.add_argument('--jobs', type=int, default=default_jobs, help="number of component downloads running at the same time")
+    parser.add_argument('--workers', type=int, default=default_workers, help="number of targets packaged at the same time in a matrix build")
+    parser.add_argument('--compression', type=str, default='none', choices=package_compressions.keys(), help="package compression type")
+    parser.add_argument('--compression-level', type=int, default=None, help="package compression level (gzip: 1-9, zstd: 1-22)")
+    parser.add_argument('--compression-threads', type=int, default=0, help="zstd compression threads (0: all cores)")
+    parser.add_argument('--previous', type=str, default=None, help="previous package file whose unchanged components are reused")
+    parser.add_argument('--delta', action='store_true', help="package only the components changed since the --previous package")
+    parser.add_argument('--lock', type=str, default=None, help="lockfile whose files are downloaded as they are, without resolving dependencies")
+    parser.add_argument('--write-lock', type=str, default=None, help="write the resolved files of this build into a lockfile")
+    parser.add_argument('--store', type=str, default=None, help="write the package into a deduplicated store directory (shared blobs and a manifest per target) instead of a tar file")
+    parser.add_argument('--materialize', type=str, nargs=2, default=None, metavar=('STORE', 'TARGET'), help="write the package tar of a target in the store and exit")
+    parser.add_argument('--store-info', type=str, default=None, metavar='STORE', help="print the targets and the deduplicated size of the store and exit")
+    parser.add_argument('--store-prune', type=str, default=None, metavar='STORE', help="remove the blobs not referenced by any target of the store and exit")
+    parser.add_argument('--resume', action='store_true', help="restore the components completed by a failed build of the same setting from the checkpoints, and download the rest")
+    parser.add_argument('--checkpoint-directory', type=str, default=default_checkpoint_directory_name, help="directory where the completed components of a build are kept until it succeeds")
+    parser.add_argument('--download-retries', type=int, default=download_limits['retries'], help="attempts of each download (the wait doubles after each failure)")
+    parser.add_argument('--max-downloads', type=int, default=download_limits['max_downloads'], help="downloads running at the same time in the whole run (every target)")
+    parser.add_argument('--max-host-downloads', type=int, default=download_limits['max_host_downloads'], help="downloads from one host running at the same time in the whole run")
+    parser.add_argument('--download-rate-limit', type=str, default=None, help="bandwidth of all downloads in bytes per second (ex. 20M)")
+    parser.add_argument('--dnf-metadata-ttl', type=str, default=download_limits['metadata_ttl'], help="age of the kept dnf metadata before it is downloaded again (seconds, or with s, m, h, d, or never)")
+    parser.add_argument('--host-download-rate-limit', type=str, default=None, help="bandwidth of the downloads from one host in bytes per second (ex. 5M)")
+    parser.add_argument('--rebuild-worker-image', action='store_true', help="prepare the worker image again even if it already exists")
+    parser.add_argument('--cache-directory', type=str, default=default_cache_directory_name, help="download cache directory shared across packaging runs")
+    parser.add_argument('--cache-size-limit', type=str, default=default_cache_size_limit, help="download cache size limit (ex. 500M, 20G)")
+    parser.add_argument('--no-cache', action='store_true', help="download everything without the download cache")
+    parser.add_argument('--cache-info', action='store_true', help="print the download cache usage and exit")
+    parser.add_argument('--query', type=str, nargs='+', default=None, metavar=('PACKAGE', 'QUERY'), help=f"query the package index without extracting the package (queries: {', '.join(package_index_queries)})")
+    parser.add_argument('--cache-prune', action='store_true', help="evict the least recently used files over the cache size limit and exit")
+    parser.add_argument('--dry-run', action='store_true', help="print the download plan of each target with its estimated time and size (from the last downloads) and exit")
+    parser.add_argument('--validate', action='store_true', help="check the repository urls of every target from the host, print the download plans and exit (no container is started)")
+    parser.add_argument('--slim', action='store_true', help="leave out the rpms installed in the base os image at the same or a newer version (recorded in the METADATA)")
+    parser.add_argument('--serve', type=str, default=None, metavar='ADDRESS', help="run a build server taking builds over http at the address (host:port, or unix:path) with warm worker containers")
+    parser.add_argument('--serve-directory', type=str, default=default_serve_directory_name, help="directory where the packages of the served builds are written (a directory per build)")
+    parser.add_argument('--serve-pool-size', type=int, default=worker_container_pool_size, help="warm worker containers kept for each worker image by the build server")
+    parser.add_argument('--metrics-file', type=str, default=None, help="write the stage times and sizes of the run as prometheus text metrics (ex. into the node exporter textfile directory)")
+
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error('--jobs must be 1 or more')
+
+    if args.workers < 1:
+        parser.error('--workers must be 1 or more')
+
+    if args.delta and args.previous is None:
+        parser.error('--delta needs the --previous package')
+
+    if args.previous is not None and not path.isfile(args.previous):
+        parser.error(f'there is no previous package file("{args.previous}")')
+
+    if args.lock is not None and args.write_lock is not None:
+        parser.error('--lock and --write-lock cannot be used together')
+
+    if args.lock is not None and not path.isfile(args.lock):
+        parser.error(f'there is no lockfile("{args.lock}")')
+
+    if args.previous is not None and (args.lock is not None or args.write_lock is not None):
+        parser.error('--lock and --write-lock cannot be used with --previous')
+
+    if args.resume and (args.lock is not None or args.write_lock is not None):
+        parser.error('--resume cannot be used with --lock and --write-lock')
+
+    if args.query is not None and (len(args.query) < 2 or len(args.query) > 3 or args.query[1] not in package_index_queries):
+        parser.error(f'--query needs a package and a query with an optional argument. (queries: {", ".join(package_index_queries)})')
+
+    for store_directory in [ args.materialize[0] if args.materialize is not None else None, args.store_info, args.store_prune ]:
+        if store_directory is not None and not path.isdir(store_directory):
+            parser.error(f'there is no store directory("{store_directory}")')
+
+    if args.query is not None and not path.isfile(args.query[0]):
+        parser.error(f'there is no package file("{args.query[0]}")')
+
+    if parse_size(args.cache_size_limit) is None:
+        parser.error(f'--cache-size-limit is invalid. ({args.cache_size_limit})')
+
+    if args.download_retries < 1 or args.max_downloads < 1 or args.max_host_downloads < 1:
+        parser.error('--download-retries, --max-downloads and --max-host-downloads must be 1 or more')
+
+    dnf_metadata_ttl = args.dnf_metadata_ttl[:-1] if args.dnf_metadata_ttl[-1:] in ('s', 'm', 'h', 'd') else args.dnf_metadata_ttl
+
+    if args.dnf_metadata_ttl != 'never' and not dnf_metadata_ttl.isdigit():
+        parser.error(f'--dnf-metadata-ttl is invalid. ({args.dnf_metadata_ttl})')
+
+    if args.serve is not None and not args.serve.startswith('unix:') and not args.serve.rpartition(':')[2].isdigit():
+        parser.error(f'--serve must be host:port or unix:path. ({args.serve})')
+
+    if args.serve is not None and (args.previous is not None or args.lock is not None or args.write_lock is not None or args.resume):
+        parser.error('--serve cannot be used with --previous, --delta, --lock, --write-lock and --resume')
+
+    if args.serve_pool_size < 0:
+        parser.error('--serve-pool-size must be 0 or more')
+
+    if args.metrics_file is not None and not path.isdir(path.dirname(path.abspath(args.metrics_file))):
+        parser.error(f'there is no directory of the metrics file("{args.metrics_file}")')
+
+    for option, rate_limit in [ ('--download-rate-limit', args.download_rate_limit), ('--host-download-rate-limit', args.host_download_rate_limit) ]:
+        if rate_limit is not None and not parse_size(rate_limit):
+            parser.error(f'{option} is invalid. ({rate_limit})')
+
+    return args
+
+def parse_size(size):
+
+    units = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4 }
+
+    size = size.strip().upper().removesuffix('B')
+
+    try:
+        if size[-1:] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+
+        return int(size)
+
+    except ValueError:
+        return None
+
+def format_size(size):
+
+    for unit in [ 'B', 'KB', 'MB', 'GB' ]:
+        if size < 1024: return f'{size:.1f}{unit}'
+        size /= 1024
+
+    return f'{size:.1f}TB'
+
+def read_yaml(file_path: str):
+
+    if file_path is None: return None
+
+    file = open(file_path, 'r')
+
+    data = yaml.load(file, Loader=yaml.BaseLoader)
+
+    return data
+
+class ContainerLog:
+
+    # container log file written by several download steps at the same time,
+    # and its event log with one json line per command (start, end, duration, exit code, received bytes)
+
+    def __init__(self, log_file_name):
+        self.lock = threading.Lock()
+        self.file = open(log_file_name, 'ab')
+        self.events_file = open(f'{path.splitext(log_file_name)[0]}.events.jsonl', 'a')
+
+    def write(self, data):
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+
+    def write_event(self, event):
+        with self.lock:
+            self.events_file.write(json.dumps(event) + '\n')
+            self.events_file.flush()
+
+    def close(self):
+        self.file.close()
+        self.events_file.close()
+
+class DockerEngineError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(f'{status} {message}')
+        self.status = status
+
+def get_docker_engine_transport(api):
+
+    # connection opener of the host of the docker-py client (the adapter it mounted for its base url)
+    adapter = api.get_adapter(api.base_url)
+
+    if hasattr(adapter, 'socket_path'):
+        return lambda: asyncio.open_unix_connection(adapter.socket_path, limit=docker_engine_chunk_size)
+
+    # ssh://[user@]host[:port], through the docker cli of the remote host (as docker-py does without paramiko)
+    if hasattr(adapter, 'ssh_host'):
+        return functools.partial(open_ssh_connection, adapter.ssh_host)
+
+    url = urllib.parse.urlparse(api.base_url)
+    context = None
+
+    if url.scheme == 'https':
+        context = get_docker_ssl_context(api.verify, api.cert)
+
+    return lambda: asyncio.open_connection(url.hostname, url.port or (2376 if context else 2375), ssl=context, limit=docker_engine_chunk_size)
+
+def get_docker_ssl_context(verify, cert):
+
+    # verify is a ca certificate path, True (the system cas) or False, and cert a (certificate, key) pair, as set by docker-py
+    context = ssl.create_default_context(cafile=verify if type(verify) == str else None)
+
+    if verify is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    if type(cert) in (tuple, list):
+        context.load_cert_chain(*cert)
+    elif cert:
+        context.load_cert_chain(cert)
+
+    return context
+
+async def open_ssh_connection(ssh_host):
+
+    user, _, host = ssh_host.rpartition('@')
+    host, _, port = host.partition(':')
+
+    command = [ 'ssh' ] + ([ '-l', user ] if user else []) + ([ '-p', port ] if port else []) + [ '--', host, 'docker system dial-stdio' ]
+
+    process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=docker_engine_chunk_size)
+
+    # the connection is closed by closing the stdin of ssh, and the process is reaped when it exits
+    asyncio.get_running_loop().create_task(process.wait())
+
+    return process.stdout, process.stdin
+
+class DockerEngineResponse:
+
+    # http response of the docker engine api, with its body read as it arrives (content-length, chunked or until closed)
+
+    def __init__(self, reader, writer, status, headers):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers
+
+    async def read_chunks(self):
+
+        try:
+            if self.headers.get('transfer-encoding') == 'chunked':
+                while True:
+                    size = int((await self.reader.readline()).split(b';')[0], 16)
+                    if size == 0: break
+
+                    yield await self.reader.readexactly(size)
+                    await self.reader.readline()
+
+            elif 'content-length' in self.headers:
+                remaining = int(self.headers['content-length'])
+
+                while remaining > 0:
+                    chunk = await self.reader.read(min(remaining, docker_engine_chunk_size))
+                    if not chunk: break
+
+                    remaining -= len(chunk)
+                    yield chunk
+
+            else:
+                while chunk := await self.reader.read(docker_engine_chunk_size):
+                    yield chunk
+        finally:
+            self.close()
+
+    async def read(self):
+
+        return b''.join([ chunk async for chunk in self.read_chunks() ])
+
+    def close(self):
+        self.writer.close()
+
+class DockerEngine:
+
+    # asyncio client of the docker engine api. every request has its own connection, and all of them are served by one event loop,
+    # so many execs, archive streams and container lifecycles run at once without a thread (or a pooled connection) for each.
+    # the synchronous code calls it through run() and EngineContainer.
+    # the host, tls settings and api version are the ones docker-py resolved and negotiated (DOCKER_HOST, DOCKER_TLS_VERIFY,
+    # DOCKER_CERT_PATH), so both clients of the run talk to the same engine in the same way.
+
+    def __init__(self, api):
+        self.api_version = api.api_version
+        self.open_stream = get_docker_engine_transport(api)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='docker-engine', daemon=True).start()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def iterate(self, chunks):
+
+        # synchronous iterator over an async one, taking each chunk when it is needed
+        async def next_chunk():
+            return await anext(chunks, None)
+
+        try:
+            while (chunk := self.run(next_chunk())) is not None:
+                yield chunk
+        finally:
+            asyncio.run_coroutine_threadsafe(chunks.aclose(), self.loop)
+
+    async def open_connection(self):
+        return await self.open_stream()
+
+    async def request(self, method, url, body=None, content_type='application/json'):
+
+        reader, writer = await self.open_connection()
+
+        try:
+            if type(body) in (dict, list):
+                body = json.dumps(body).encode()
+
+            head = f'{method} /v{self.api_version}{url} HTTP/1.1\r\nHost: docker\r\nConnection: close\r\n'
+
+            # a stream body (not seekable, ex. a pipe) has no length, so it is sent in chunks
+            chunked = hasattr(body, 'read') and not body.seekable()
+
+            if chunked:
+                head += f'Content-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n'
+
+            elif body is not None:
+                length = body.seek(0, io.SEEK_END) if hasattr(body, 'read') else len(body)
+                head += f'Content-Type: {content_type}\r\nContent-Length: {length}\r\n'
+
+            writer.write(f'{head}\r\n'.encode())
+
+            # a file body is read in the executor, not to block the event loop
+            if hasattr(body, 'read'):
+                if not chunked: body.seek(0)
+
+                while chunk := await self.loop.run_in_executor(None, body.read, docker_engine_chunk_size):
+                    writer.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n' if chunked else chunk)
+                    await writer.drain()
+
+                if chunked: writer.write(b'0\r\n\r\n')
+
+            elif body is not None:
+                writer.write(body)
+
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+        except BaseException:
+            writer.close()
+            raise
+
+        response = DockerEngineResponse(reader, writer, status, headers)
+
+        if status >= 400:
+            message = (await response.read()).decode(errors='replace')
+
+            try:
+                message = json.loads(message)['message']
+            except (ValueError, KeyError, TypeError):
+                pass
+
+            raise DockerEngineError(status, message)
+
+        return response
+
+    async def request_json(self, method, url, body=None):
+
+        data = await (await self.request(method, url, body)).read()
+
+        return json.loads(data) if data.strip() else None
+
+    async def run_container(self, image, command, tty=True, volumes=None):
+
+        binds = [ f'{host_path}:{volume["bind"]}:{volume.get("mode", "rw")}' for host_path, volume in (volumes or {}).items() ]
+
+        created = await self.request_json('POST', '/containers/create', {
+            'Image': image, 'Cmd': command, 'Tty': tty, 'HostConfig': { 'Binds': binds }
+        })
+
+        await self.request_json('POST', f'/containers/{created["Id"]}/start')
+
+        return await self.request_json('GET', f'/containers/{created["Id"]}/json')
+
+    async def kill_container(self, container_id):
+        await self.request_json('POST', f'/containers/{container_id}/kill')
+
+    async def remove_container(self, container_id):
+        await self.request_json('DELETE', f'/containers/{container_id}')
+
+    async def commit_container(self, container_id, repository, tag):
+        return await self.request_json('POST', f'/commit?{urllib.parse.urlencode({ "container": container_id, "repo": repository, "tag": tag })}')
+
+    async def exec_create(self, container_id, command, workdir=None):
+
+        body = { 'Cmd': command, 'AttachStdout': True, 'AttachStderr': True, 'Tty': False }
+
+        if workdir is not None:
+            body['WorkingDir'] = workdir
+
+        return (await self.request_json('POST', f'/containers/{container_id}/exec', body))['Id']
+
+    async def exec_start(self, exec_id):
+
+        # the output without a tty comes in frames of an 8 byte header (stream type, size) and the data
+        response = await self.request('POST', f'/exec/{exec_id}/start', { 'Detach': False, 'Tty': False })
+        pending = b''
+
+        async for chunk in response.read_chunks():
+
+            pending += chunk
+
+            while len(pending) >= 8 and len(pending) >= 8 + int.from_bytes(pending[4:8], 'big'):
+                size = int.from_bytes(pending[4:8], 'big')
+                yield pending[8:8 + size]
+                pending = pending[8 + size:]
+
+    async def exec_exit_code(self, exec_id):
+
+        # the exec may be still finishing when its output is closed
+        while (inspect := await self.request_json('GET', f'/exec/{exec_id}/json'))['Running']:
+            await asyncio.sleep(0.05)
+
+        return inspect['ExitCode']
+
+    async def get_archive(self, container_id, container_path):
+
+        response = await self.request('GET', f'/containers/{container_id}/archive?{urllib.parse.urlencode({ "path": container_path })}')
+        stat = json.loads(base64.b64decode(response.headers.get('x-docker-container-path-stat', '') or b'e30=').decode())
+
+        return response.read_chunks(), stat
+
+    async def put_archive(self, container_id, container_path, data):
+
+        response = await self.request('PUT', f'/containers/{container_id}/archive?{urllib.parse.urlencode({ "path": container_path })}', data, 'application/x-tar')
+        await response.read()
+
+        return response.status == 200
+
+class EngineContainer:
+
+    # container of the docker engine, with the docker-py container methods the packaging steps use
+
+    def __init__(self, engine, attrs):
+        self.engine = engine
+        self.attrs = attrs
+        self.id = attrs['Id']
+
+    def exec_stream(self, command, workdir=None):
+
+        exec_id = self.engine.run(self.engine.exec_create(self.id, command, workdir))
+
+        return exec_id, self.engine.iterate(self.engine.exec_start(exec_id))
+
+    def exec_exit_code(self, exec_id):
+        return self.engine.run(self.engine.exec_exit_code(exec_id))
+
+    def get_archive(self, container_path):
+
+        chunks, stat = self.engine.run(self.engine.get_archive(self.id, container_path))
+
+        return self.engine.iterate(chunks), stat
+
+    def put_archive(self, container_path, data):
+        return self.engine.run(self.engine.put_archive(self.id, container_path, data))
+
+    def commit(self, repository, tag):
+        return self.engine.run(self.engine.commit_container(self.id, repository, tag))
+
+    def kill(self):
+        self.engine.run(self.engine.kill_container(self.id))
+
+    def remove(self):
+        self.engine.run(self.engine.remove_container(self.id))
+
+def get_docker_engine(api):
+
+    global docker_engine
+
+    with docker_engine_lock:
+
+        if docker_engine is None:
+            docker_engine = DockerEngine(api)
+
+        return docker_engine
+
+def run_container(image, volumes=None):
+
+    # the engine takes its transport and api version from the docker client the image was taken with
+    engine = get_docker_engine(image.client.api)
+
+    return EngineContainer(engine, engine.run(engine.run_container(image.id, [ '/bin/bash' ], volumes=volumes)))
+
+def get_worker_container_volumes():
+
+    volumes = {}
+
+    if download_cache_directory is not None:
+        volumes[download_cache_directory] = { 'bind': container_cache_directory, 'mode': 'rw' }
+
+    volumes[get_download_lock_directory()] = { 'bind': container_download_lock_directory, 'mode': 'rw' }
+
+    return volumes
+
+def start_worker_container(worker_image, docker_container_log):
+
+    docker_container = run_container(worker_image, get_worker_container_volumes())
+
+    try:
+        if not put_download_script(docker_container):
+            print(f'[ERROR] putting the download script is failed.')
+
+        # the rpms of the worker image, to find the rpms installed by a build when the container is reset
+        elif worker_container_pool is not None and execute_and_log_container(f'rpm -qa | sort > {worker_rpm_list_path}', docker_container, docker_container_log).exit_code != 0:
+            print(f'[ERROR] listing the rpms of the worker container is failed.')
+
+        else:
+            return docker_container
+
+    except Exception:
+        logging.error(traceback.format_exc())
+
+    docker_container.kill()
+    docker_container.remove()
+
+    return None
+
+def acquire_worker_container(worker_image, docker_container_log):
+
+    if worker_container_pool is None:
+        return start_worker_container(worker_image, docker_container_log)
+
+    # a warm container is taken from the pool, and another one is started for the next build
+    with worker_container_pool_lock:
+        idle_containers = worker_container_pool.setdefault(worker_image.id, { 'idle': [], 'starting': 0 })['idle']
+        docker_container = idle_containers.pop() if idle_containers else None
+
+    # the containers started in the background can outlive the build log, so they are logged to the server log
+    threading.Thread(target=fill_worker_container_pool, args=(worker_image, worker_container_pool_log), daemon=True).start()
+
+    if docker_container is not None:
+        print(f'[INFO] warm worker container ({docker_container.id[:12]}) is used.')
+        return docker_container
+
+    return start_worker_container(worker_image, docker_container_log)
+
+def fill_worker_container_pool(worker_image, docker_container_log):
+
+    # idle containers of the worker image are started up to the pool size
+    with worker_container_pool_lock:
+        entry = worker_container_pool.setdefault(worker_image.id, { 'idle': [], 'starting': 0 })
+        count = max(worker_container_pool_size - len(entry['idle']) - entry['starting'], 0)
+        entry['starting'] += count
+
+    for _ in range(count):
+
+        try:
+            docker_container = start_worker_container(worker_image, docker_container_log)
+        except Exception:
+            logging.error(traceback.format_exc())
+            docker_container = None
+
+        with worker_container_pool_lock:
+            entry['starting'] -= 1
+
+            # the pool can be closed meanwhile
+            if docker_container is not None and worker_container_pool is not None and worker_container_pool.get(worker_image.id) is entry:
+                entry['idle'].append(docker_container)
+                docker_container = None
+
+        if docker_container is not None:
+            docker_container.kill()
+            docker_container.remove()
+
+def reset_worker_container(docker_container, docker_container_log):
+
+    # the files of the build are removed, and the rpms installed by it (ex. the pgpool release rpm and its repository).
+    # a container whose worker image rpms are changed or removed is not reused.
+    steps = [
+        (f'rm -rf {work_directory} {lock_directory} {base_root_directory} /tmp/* /tmp/.[!.]*', 'removing the build files is failed'),
+        (f'rpm -qa | sort | comm -23 {worker_rpm_list_path} - | grep -q . && exit 1; true', 'rpms of the worker image are changed'),
+        (f'rpm -qa | sort | comm -13 {worker_rpm_list_path} - | xargs -r rpm -e --nodeps', 'removing the rpms installed by the build is failed')
+    ]
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def release_worker_container(worker_image, docker_container, docker_container_log, reusable=True):
+
+    # a reset container goes back to the pool (up to the pool size), any other is removed
+    if worker_container_pool is not None and worker_container_pool_size > 0 and reusable:
+
+        try:
+            reset = reset_worker_container(docker_container, docker_container_log)
+        except Exception:
+            logging.error(traceback.format_exc())
+            reset = False
+
+        with worker_container_pool_lock:
+            idle_containers = worker_container_pool.setdefault(worker_image.id, { 'idle': [], 'starting': 0 })['idle']
+
+            if reset and len(idle_containers) < worker_container_pool_size:
+                idle_containers.append(docker_container)
+                return
+
+    docker_container.kill()
+    docker_container.remove()
+
+def execute_and_log_container(command, container, log, workdir=None):
+
+    results = execute_commands_and_log_container([ command ], container, log, workdir)
+
+    return results[0]
+
+def execute_commands_and_log_container(commands, container, log, workdir=None):
+
+    # the commands run in one exec, separated by marker lines carrying the step number, time, received bytes and exit code.
+    # it stops at the first failed command, and returns the results of the commands which have run.
+    # the output is written to the log as it arrives, and only its tail is kept in memory.
+    marker = f'@@opensql-step-{uuid.uuid4().hex}'
+    tag = marker[-6:]
+
+    # the download script adds the bytes of each download to the file of the exec, so a step counts only its own downloads
+    # (not the ones of other steps running in the same container)
+    received_bytes_path = f'/tmp/opensql-received-{marker[-32:]}'
+
+    script = (
+        f'export OPENSQL_RECEIVED_BYTES={received_bytes_path}\n'
+        f'trap \'rm -f "$OPENSQL_RECEIVED_BYTES"\' EXIT\n'
+    )
+
+    commands = [ shlex.join(command) if type(command) == list else command for command in commands ]
+
+    for index, command in enumerate(commands):
+
+        script += (
+            f': > "$OPENSQL_RECEIVED_BYTES"\n'
+            f'printf "\\n{marker} begin {index} %s\\n" "$(date +%s.%N)"\n'
+            f'( {command}\n) 2>&1\n'
+            f'exit_code=$?\n'
+            f'printf "\\n{marker} end {index} %s %s %s\\n" "$(date +%s.%N)" "$(cat "$OPENSQL_RECEIVED_BYTES" 2> /dev/null | awk \'{{ total += $1 }} END {{ print total + 0 }}\')" "$exit_code"\n'
+            f'[ "$exit_code" -eq 0 ] || exit "$exit_code"\n'
+        )
+
+    exec_id, output_stream = container.exec_stream(['sh', '-c', script], workdir)
+
+    marker_prefix = marker.encode() + b' '
+    results = []
+    step = None
+
+    def finish_step(exit_code, ended_at, received_bytes):
+
+        nonlocal step
+
+        # the line break printed before the end marker is not a part of the output
+        output = step['output'][:-1] if step['output'].endswith(b'\n') else step['output']
+
+        results.append(ExecResult(exit_code, output))
+
+        log.write_event({
+            'container': container.id[:12],
+            'command': commands[step['index']],
+            'started_at': datetime.fromtimestamp(step['started_at']).isoformat(),
+            'ended_at': datetime.fromtimestamp(ended_at).isoformat(),
+            'duration': round(ended_at - step['started_at'], 6),
+            'exit_code': exit_code,
+            'received_bytes': received_bytes,
+            'output_bytes': step['output_bytes']
+        })
+
+        if received_bytes is not None:
+            add_received_bytes(received_bytes)
+
+        step = None
+
+    def process_line(line):
+
+        nonlocal step
+
+        if line.startswith(marker_prefix):
+
+            fields = line.decode().split()
+
+            if fields[1] == 'begin':
+                step = { 'index': int(fields[2]), 'started_at': float(fields[3]), 'output': b'', 'output_bytes': 0 }
+                log.write(f'\n[{datetime.fromtimestamp(step["started_at"])}] ({tag}) {commands[step["index"]]}\n'.encode())
+
+            elif step is not None:
+                finish_step(int(fields[5]), float(fields[3]), int(fields[4]))
+
+            return
+
+        if step is None: return
+
+        step['output'] = (step['output'] + line)[-output_tail_limit:]
+        step['output_bytes'] += len(line)
+
+        if line != b'\n':
+            log.write(f'({tag}) '.encode() + line)
+
+    pending = b''
+
+    for chunk in output_stream:
+
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+
+        for line in lines:
+            process_line(line + b'\n')
+
+        # a very long line without a line break is not kept whole
+        if len(pending) > output_tail_limit:
+            process_line(pending)
+            pending = b''
+
+    if pending: process_line(pending)
+
+    exit_code = container.exec_exit_code(exec_id)
+
+    # the script was stopped in the middle of a command (ex. killed)
+    if step is not None:
+        finish_step(exit_code if exit_code else -1, time.time(), None)
+
+    if not results:
+        results.append(ExecResult(exit_code, b''))
+
+    return results
+
+def execute_steps_and_log_container(steps, container, log, workdir=None):
+
+    # steps are (command, error message) pairs. a step without an error message never fails.
+    results = execute_commands_and_log_container([ command for command, _ in steps ], container, log, workdir)
+
+    if len(results) == len(steps) and results[-1].exit_code == 0: return True
+
+    error_message = steps[len(results) - 1][1] if results else steps[0][1]
+    output = results[-1].output.decode() if results else ''
+
+    print(f'[ERROR] {error_message}.\n{output}')
+
+    return False
+
+def parse_spec(spec: dict):
+
+    if spec is None or type(spec) != dict: return None
+
+    specifications = '[SUPPORTED OS VERSION]'
+    specifications += f'\n{spec[os][name]} {spec[os][version]}'
+
+    specifications += '\n[INSTALLABLE BINARIES]'
+    specifications += f'\n{spec[database][name]} {spec[database][version]}'
+
+    for component in spec[options]:
+        specifications += f'\n{component[name]} {component[version]}'
+
+    return specifications
+
+def download_component(spec, component, docker_container, docker_container_log):
+
+    # the getter is looked up by its name, so a replaced getter (ex. timed by benchmark.py) is called
+    download = globals()[component_registry[component[name]]['download']]
+
+    return download(spec, component, docker_container, docker_container_log)
+
+def timed_setup_component(spec, component, docker_container, docker_container_log, checkpoint_directory=None):
+
+    # the repository setup changes only the container, so it has no checkpoint (it runs again in a resumed build)
+    started_at = time.monotonic()
+
+    with measure_stage('repository', docker_container, component):
+        success = globals()[component_registry[component[name]]['setup']](spec, component, docker_container, docker_container_log)
+
+    elapsed_time = time.monotonic() - started_at
+
+    if success:
+        write_download_history(spec, component, elapsed_time, None, get_setup_step_name(component[name]))
+
+    return success, elapsed_time
+
+def timed_download_component(spec, component, docker_container, docker_container_log, checkpoint_directory=None):
+
+    started_at = time.monotonic()
+
+    with measure_stage('download', docker_container, component) as stage:
+        success = download_component(spec, component, docker_container, docker_container_log)
+
+    elapsed_time = time.monotonic() - started_at
+
+    # the completed component is kept on the host, so a failed build can resume from it
+    if success and checkpoint_directory is not None:
+
+        with measure_stage('checkpoint_save', docker_container, component):
+            size = save_component_checkpoint(checkpoint_directory, component, docker_container)
+
+        stage['size'] = size
+        write_download_history(spec, component, elapsed_time, size)
+
+    return success, elapsed_time
+
+def get_setup_step_name(component_name):
+
+    return f'{component_name}-repository'
+
+def get_download_plan(spec, skip_components=()):
+
+    # steps in dependency order, each with the steps it waits for and its wave (the steps of a wave can run at the same time).
+    # a component with a repository setup has it as a separate step before its download. dependencies not in the setting are not waited for.
+    steps = {}
+
+    for component in [ spec[database] ] + list(spec[options]):
+
+        if component[name] in skip_components: continue
+
+        entry = component_registry[component[name]]
+        dependencies = set(entry.get('dependencies', ()))
+
+        if 'setup' in entry:
+            steps[get_setup_step_name(component[name])] = (component, True, set())
+            dependencies.add(get_setup_step_name(component[name]))
+
+        steps[component[name]] = (component, False, dependencies)
+
+    remaining = list(steps)
+
+    plan = []
+    wave = 1
+
+    while remaining:
+
+        ready = [ step_name for step_name in remaining if not steps[step_name][2] & set(remaining) ]
+
+        if not ready:
+            print(f'[ERROR] component dependencies cannot be satisfied. ({remaining})')
+            return None
+
+        for step_name in ready:
+            component, setup, dependencies = steps[step_name]
+            plan.append({
+                'name': step_name,
+                'component': component,
+                'setup': setup,
+                'dependencies': dependencies & { step['name'] for step in plan },
+                'wave': wave
+            })
+
+        remaining = [ step_name for step_name in remaining if step_name not in ready ]
+        wave += 1
+
+    return plan
+
+def download_components(spec, jobs, docker_container, docker_container_log, skip_components=(), checkpoint_directory=None):
+
+    plan = get_download_plan(spec, skip_components)
+
+    if plan is None: return False
+
+    # the steps are started in plan order (by wave, the database first in its wave), as soon as their dependencies are completed
+    pending = list(plan)
+    completed = set()
+    running = {}
+    elapsed_times = {}
+    success = True
+
+    # the downloads running in the executor are measured for the report of this build
+    build_report = getattr(build_report_context, 'report', None)
+    build_stages = getattr(build_report_context, 'stages', ())
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+
+        while pending or running:
+
+            # after a failure, no more downloads are started and the running ones are waited for
+            for step in list(pending) if success else []:
+
+                if not step['dependencies'] <= completed: continue
+
+                pending.remove(step)
+                run_step = timed_setup_component if step['setup'] else timed_download_component
+                future = executor.submit(run_with_build_report, build_report, build_stages, run_step, spec, step['component'], docker_container, docker_container_log, checkpoint_directory)
+                running[future] = step
+
+            if not running: break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+
+                step = running.pop(future)
+                action = 'setting' if step['setup'] else 'download'
+
+                try:
+                    step_success, elapsed_time = future.result()
+                except Exception:
+                    logging.error(traceback.format_exc())
+                    step_success, elapsed_time = False, 0.0
+
+                elapsed_times[step['name']] = elapsed_time
+
+                if not step_success:
+                    print(f'[ERROR] {step["name"]} {action} is failed. ({elapsed_time:.1f}s)')
+                    success = False
+                    continue
+
+                print(f'[INFO] {step["name"]} {action} is completed. ({elapsed_time:.1f}s)')
+                completed.add(step['name'])
+
+    print('[INFO] component download times')
+    for step_name, elapsed_time in elapsed_times.items():
+        print(f'    {step_name}: {elapsed_time:.1f}s')
+
+    return success
+
+def get_download_history_key(spec, component, step_name=None):
+
+    return f'{spec[os][name]}{spec[os][version]}-pg{spec[database][version].split(".")[0]} {step_name or component[name]} {component[version]}'
+
+def read_download_history(cache_directory):
+
+    history_path = path.join(cache_directory, download_history_file_name)
+
+    if not path.isfile(history_path): return {}
+
+    try:
+        with open(history_path, 'r') as file: return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_download_history(spec, component, elapsed_time, size, step_name=None):
+
+    # the last download time and size of each component are kept in the download cache, for --dry-run estimates
+    if download_cache_directory is None: return
+
+    with download_history_lock:
+
+        history = read_download_history(download_cache_directory)
+        history[get_download_history_key(spec, component, step_name)] = { 'time': round(elapsed_time, 1), 'size': size, 'downloaded_at': datetime.now().isoformat() }
+
+        history_path = path.join(download_cache_directory, download_history_file_name)
+        temporary_path = f'{history_path}.{getpid()}'
+
+        with open(temporary_path, 'w') as file: json.dump(history, file, indent=2, sort_keys=True)
+        replace(temporary_path, history_path)
+
+def estimate_plan_time(plan, times, jobs):
+
+    # the steps are put on the jobs as download_components starts them: in plan order, on the first free job,
+    # after their dependencies are completed
+    job_free_at = [ 0.0 ] * jobs
+    completed_at = {}
+
+    for step in plan:
+
+        job = min(range(jobs), key=lambda index: job_free_at[index])
+        started_at = max([ job_free_at[job] ] + [ completed_at[dependency] for dependency in step['dependencies'] ])
+
+        completed_at[step['name']] = job_free_at[job] = started_at + times.get(step['name'], 0.0)
+
+    return max(completed_at.values(), default=0.0)
+
+def format_duration(seconds):
+
+    return f'{int(seconds // 60)}m {seconds % 60:.0f}s' if seconds >= 60 else f'{seconds:.1f}s'
+
+def print_download_plan(spec, arguments, target_name=None):
+
+    # the plan of a build, without starting any container. the time and size of each step are taken from
+    # the last download of the same component (with the download cache of that time).
+    skip_components = set()
+
+    if arguments.resume:
+        skip_components = set(read_checkpoint_state(get_checkpoint_directory(arguments.checkpoint_directory, spec, target_name))['components'])
+
+    plan = get_download_plan(spec, skip_components)
+
+    if plan is None: return False
+
+    history = read_download_history(path.abspath(arguments.cache_directory))
+    times, sizes, unknown_components = {}, {}, []
+
+    print(f'[INFO] download plan of {target_name or get_target_name(spec)} ({arguments.jobs} jobs)')
+    print(f'    {"wave":<5} {"component":<34} {"version":<9} {"strategy":<9} {"after":<20} {"directories":<36} {"time":>8} {"size":>10}')
+
+    for step in plan:
+
+        component = step['component']
+        strategy = 'setup' if step['setup'] else component_registry[component[name]]['strategy']
+        directories = '-' if step['setup'] else ', '.join(get_component_directories(component[name]))
+        record = history.get(get_download_history_key(spec, component, step['name']))
+
+        if record is None:
+            unknown_components.append(step['name'])
+        else:
+            times[step['name']] = record['time']
+            sizes[step['name']] = record['size'] or 0
+
+        print(
+            f'    {step["wave"]:<5} {step["name"]:<34} {component[version]:<9} {strategy:<9} {", ".join(sorted(step["dependencies"])) or "-":<20} '
+            f'{directories:<36} '
+            f'{format_duration(record["time"]) if record else "?":>8} {format_size(record["size"]) if record and record["size"] is not None else "?":>10}'
+        )
+
+    for component_name in sorted(skip_components):
+        print(f'    {"-":<5} {component_name:<34} restored from the checkpoint')
+
+    estimate = f'estimated download time {format_duration(estimate_plan_time(plan, times, arguments.jobs))} with {arguments.jobs} jobs, {format_size(sum(sizes.values()))}'
+
+    if unknown_components:
+        estimate += f' (no download history of {", ".join(unknown_components)})'
+
+    print(f'    {estimate}')
+
+    return True
+
+def validate_targets(targets, arguments):
+
+    # the repository urls of every target are checked from the host (with their mirrors) without starting any container,
+    # then the download plans are printed
+    started_at = time.monotonic()
+    target_names = get_matrix_target_names(targets) if len(targets) > 1 else [ None ]
+
+    candidate_urls = {
+        (index, component[name]): get_candidate_urls(target, component)
+        for index, target in enumerate(targets) for component in [ target[database] ] + list(target[options])
+    }
+
+    results = check_urls([ mirror_url for urls in candidate_urls.values() for url in urls for mirror_url in get_mirror_urls(url) ])
+    unavailable_components = 0
+
+    for index, (target, target_name) in enumerate(zip(targets, target_names)):
+
+        print(f'[INFO] repository urls of {target_name or get_target_name(target)}')
+
+        for component in [ target[database] ] + list(target[options]):
+
+            urls = candidate_urls[(index, component[name])]
+
+            if not urls:
+                source = 'pypi' if component_registry[component[name]]['strategy'] == 'pip' else 'the dnf repositories'
+                print(f'    {component[name]:<34} {"-":<9} {"":>10} from {source} (resolved in the worker container)')
+                continue
+
+            available_urls = [ (url, mirror_url) for url in urls for mirror_url in get_mirror_urls(url) if results[mirror_url] is not None ]
+
+            if not available_urls:
+                unavailable_components += 1
+                print(f'    {component[name]:<34} {"not found":<9} {"":>10} {urls[0]}' + (f' (and {len(urls) - 1} more candidates)' if len(urls) > 1 else ''))
+                continue
+
+            url, mirror_url = available_urls[0]
+            size = results[mirror_url][1]
+
+            print(f'    {component[name]:<34} {"ok":<9} {format_size(size) if size else "?":>10} {url}')
+
+    if unavailable_components:
+        print(f'[ERROR] {unavailable_components} components have no available url.')
+        return False
+
+    for target, target_name in zip(targets, target_names):
+        if not print_download_plan(target, arguments, target_name): return False
+
+    print(f'[INFO] setting is valid. ({time.monotonic() - started_at:.1f}s)')
+
+    return True
+
+def get_component_directories(component_name):
+
+    return component_registry.get(component_name, {}).get('directories', [ component_name ])
+
+def get_checkpoint_directory(checkpoint_root, spec, target_name=None):
+
+    # checkpoints of a build are kept by its target and setting, so a changed setting never resumes from them
+    return path.join(checkpoint_root, f'{target_name or get_target_name(spec)}-{get_spec_digest(spec)[:12]}')
+
+def read_checkpoint_state(checkpoint_directory):
+
+    state_path = path.join(checkpoint_directory, checkpoint_state_file_name)
+
+    if not path.isfile(state_path): return { 'version': checkpoint_version, 'components': {} }
+
+    with open(state_path, 'r') as file:
+        state = json.load(file)
+
+    return state if state.get('version') == checkpoint_version else { 'version': checkpoint_version, 'components': {} }
+
+def save_component_checkpoint(checkpoint_directory, component, docker_container):
+
+    # each directory of the completed component is saved as a docker archive, and the state lists them with their checksums
+    directories = {}
+
+    for directory in get_component_directories(component[name]):
+
+        archive_path = path.join(checkpoint_directory, f'{directory.replace("/", "_")}.tar')
+        temporary_path = f'{archive_path}.{getpid()}.{threading.get_ident()}'
+        archive_hash = hashlib.sha256()
+        size = 0
+
+        try:
+            stream, _ = docker_container.get_archive(f'{work_directory}/{directory}')
+        except DockerEngineError as e:
+            if e.status == 404: continue
+            raise
+
+        with open(temporary_path, 'wb') as file:
+            for chunk in stream:
+                archive_hash.update(chunk)
+                file.write(chunk)
+                size += len(chunk)
+
+        replace(temporary_path, archive_path)
+        directories[directory] = { 'archive': path.basename(archive_path), 'sha256': archive_hash.hexdigest(), 'size': size }
+
+    with checkpoint_lock:
+
+        state = read_checkpoint_state(checkpoint_directory)
+        state['components'][component[name]] = { version: component[version], 'directories': directories, 'saved_at': datetime.now().isoformat() }
+
+        state_path = path.join(checkpoint_directory, checkpoint_state_file_name)
+        temporary_path = f'{state_path}.{getpid()}'
+
+        with open(temporary_path, 'w') as file: json.dump(state, file, indent=2)
+        replace(temporary_path, state_path)
+
+    size = sum(directory['size'] for directory in directories.values())
+
+    print(f'[INFO] {component[name]} checkpoint is saved. ({format_size(size)})')
+
+    return size
+
+def restore_component_checkpoints(spec, checkpoint_directory, skip_components, docker_container, docker_container_log):
+
+    state = read_checkpoint_state(checkpoint_directory)
+    restored_components = set()
+
+    for component in [ spec[database] ] + list(spec[options]):
+
+        checkpoint = state['components'].get(component[name])
+
+        if checkpoint is None or checkpoint[version] != component[version] or component[name] in skip_components: continue
+
+        archive_paths = [ path.join(checkpoint_directory, directory['archive']) for directory in checkpoint['directories'].values() ]
+
+        # a broken checkpoint is downloaded again
+        for archive_path, directory in zip(archive_paths, checkpoint['directories'].values()):
+
+            archive_hash = hashlib.sha256()
+
+            if path.isfile(archive_path):
+                with open(archive_path, 'rb') as file:
+                    for chunk in iter(lambda: file.read(1024 * 1024), b''): archive_hash.update(chunk)
+
+            if archive_hash.hexdigest() != directory['sha256']:
+                print(f'[WARN] checkpoint of {component[name]} is broken. it is downloaded again. ({archive_path})')
+                break
+
+        else:
+            for archive_path in archive_paths:
+
+                with open(archive_path, 'rb') as file:
+                    if not docker_container.put_archive(work_directory, file):
+                        print(f'[ERROR] restoring the checkpoint of {component[name]} is failed.')
+                        return None
+
+            docker_container_log.write(f'\n[{datetime.now()}] restore {component[name]} from the checkpoint {checkpoint_directory}\n'.encode())
+            restored_components.add(component[name])
+
+    print(f'[INFO] {len(restored_components)} components are restored from the checkpoint. ({", ".join(sorted(restored_components)) or "none"})')
+
+    return restored_components
+
+def open_package_archive(package_file_name):
+
+    # tarfile reads plain and gzip packages, and a zstd package is decompressed into a temporary file first
+    if package_file_name.endswith(package_compressions['zstd']):
+
+        import zstandard
+
+        temporary_file = tempfile.TemporaryFile()
+
+        with open(package_file_name, 'rb') as file:
+            zstandard.ZstdDecompressor().copy_stream(file, temporary_file)
+
+        temporary_file.seek(0)
+
+        return tarfile.open(fileobj=temporary_file, mode='r:')
+
+    return tarfile.open(package_file_name, mode='r:*')
+
+def parse_metadata(metadata):
+
+    sections, section = {}, None
+
+    for line in metadata.splitlines():
+
+        line = line.strip()
+
+        if not line: continue
+
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1]
+            sections[section] = []
+            continue
+
+        if section is not None:
+            sections[section].append(line)
+
+    return sections
+
+def parse_manifest(manifest):
+
+    # sha256 of every file by its path in the work directory (sha256sum format: digest, two spaces, ./path)
+    return { line[66:]: line[:64] for line in manifest.splitlines() if len(line) > 66 }
+
+def read_previous_package(package_file_name):
+
+    print(f'[INFO] read the previous package ({package_file_name})...')
+
+    try:
+        archive = open_package_archive(package_file_name)
+
+        root_name = path.basename(work_directory)
+        metadata_file = archive.extractfile(f'{root_name}/{metadata_file_name}')
+        manifest_file = archive.extractfile(f'{root_name}/{manifest_file_name}')
+
+    except (tarfile.TarError, KeyError, ImportError) as e:
+        print(f'[ERROR] previous package cannot be read. ({e})')
+        return None
+
+    package_hash = hashlib.sha256()
+
+    with open(package_file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''): package_hash.update(chunk)
+
+    return {
+        'file_name': package_file_name,
+        'sha256': package_hash.hexdigest(),
+        'archive': archive,
+        metadata_file_name: parse_metadata(metadata_file.read().decode()),
+        manifest_file_name: parse_manifest(manifest_file.read().decode())
+    }
+
+def get_reusable_components(spec, previous_metadata, slim=False):
+
+    previous_binaries = previous_metadata.get('INSTALLABLE BINARIES', [])
+
+    # every component is downloaded again if the target os or database is changed
+    if previous_metadata.get('SUPPORTED OS VERSION', []) != [ f'{spec[os][name]} {spec[os][version]}' ]:
+        return set()
+
+    # the components of a slim package miss the rpms of the base image
+    if (pruned_rpms_section in previous_metadata) != slim:
+        return set()
+
+    if f'{spec[database][name]} {spec[database][version]}' not in previous_binaries[:1]:
+        return set()
+
+    return {
+        component[name] for component in [ spec[database] ] + list(spec[options])
+        if f'{component[name]} {component[version]}' in previous_binaries
+    }
+
+def restore_previous_components(previous_package, component_names, docker_container, docker_container_log):
+
+    # returns the restored components, or None if restoring is failed. the files are checked against the previous
+    # manifest while they are streamed into the container, and a component having a missing or broken file is downloaded again.
+    if not component_names: return set()
+
+    print(f'[INFO] reuse unchanged components of the previous package. ({", ".join(sorted(component_names))})')
+
+    archive = previous_package['archive']
+    manifest = previous_package[manifest_file_name]
+    root_name = path.basename(work_directory)
+
+    directories = { component_name: get_component_directories(component_name) for component_name in component_names }
+    members = [ f'{root_name}/{directory}' for component_directories in directories.values() for directory in component_directories ]
+
+    # sha256 of the restored files by their manifest path
+    digests = {}
+    errors = []
+
+    read_descriptor, write_descriptor = pipe()
+
+    def write_restored_archive():
+
+        try:
+            with open(write_descriptor, 'wb') as write_file, tarfile.open(fileobj=write_file, mode='w|') as restored_archive:
+
+                for member in archive.getmembers():
+
+                    if not any(member.name == directory or member.name.startswith(directory + '/') for directory in members): continue
+
+                    manifest_path = '.' + member.name[len(root_name):]
+
+                    # a hard link to a file of a component not restored becomes a regular file
+                    if member.islnk() and member.linkname in digests:
+                        restored_archive.addfile(member)
+                        digests[manifest_path] = digests['.' + member.linkname[len(root_name):]]
+
+                    elif member.islnk() or member.isfile():
+                        regular_member = copy.copy(member)
+                        regular_member.type = tarfile.REGTYPE
+                        regular_member.linkname = ''
+                        regular_member.size = archive.getmember(member.linkname).size if member.islnk() else member.size
+
+                        reader = HashingFileReader(archive.extractfile(member))
+                        restored_archive.addfile(regular_member, reader)
+                        digests[manifest_path] = reader.hash.hexdigest()
+
+                    else:
+                        restored_archive.addfile(member)
+
+        except (tarfile.TarError, EOFError, OSError) as e:
+            errors.append(e)
+
+    writer_thread = threading.Thread(target=write_restored_archive, name='previous-restore', daemon=True)
+    writer_thread.start()
+
+    try:
+        with open(read_descriptor, 'rb') as read_file:
+            success = docker_container.put_archive(path.dirname(work_directory), read_file)
+
+    except DockerEngineError as e:
+        print(f'[WARN] docker engine refused the previous components. ({e})')
+        success = False
+
+    finally:
+        writer_thread.join()
+
+    docker_container_log.write(f'\n[{datetime.now()}] restore {len(digests)} files from {previous_package["file_name"]}\n'.encode())
+
+    # the previous package cannot be read to the end, so nothing is reused
+    if errors:
+        print(f'[WARN] previous package is broken. every component is downloaded. ({errors[0]})')
+        broken_components = set(component_names)
+
+    elif not success:
+        print(f'[ERROR] restoring components of the previous package is failed.')
+        return None
+
+    else:
+        broken_components = set()
+
+        for component_name, component_directories in directories.items():
+
+            prefixes = tuple(f'./{directory}/' for directory in component_directories)
+
+            expected = { file_path: digest for file_path, digest in manifest.items() if file_path.startswith(prefixes) }
+            restored = { file_path: digest for file_path, digest in digests.items() if file_path.startswith(prefixes) }
+
+            if not expected or restored != expected:
+                broken_components.add(component_name)
+
+    if broken_components:
+
+        if not errors:
+            print(f'[WARN] files of {", ".join(sorted(broken_components))} do not match the previous manifest. they are downloaded again.')
+
+        broken_directories = [ f'{work_directory}/{directory}' for component_name in broken_components for directory in directories[component_name] ]
+        result = execute_and_log_container(['rm', '-rf'] + broken_directories, docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] removing the broken components is failed.\n{result.output.decode()}')
+            return None
+
+    return set(component_names) - broken_components
+
+def prepare_delta_directory(spec, previous_package, reused_components, docker_container, docker_container_log):
+
+    print(f'[INFO] make a delta package directory...')
+
+    delta_directory = f'{work_directory}-delta/{path.basename(work_directory)}'
+
+    components = [ spec[database] ] + list(spec[options])
+    changed_components = [ component for component in components if component[name] not in reused_components ]
+
+    # directories of changed and removed components must be removed from the base package before the delta is extracted.
+    # the repodata of the delta is written for the whole new package, so the base one is removed too.
+    previous_binaries = previous_package[metadata_file_name].get('INSTALLABLE BINARIES', [])
+    previous_component_names = [ binary.split()[0] for binary in previous_binaries ]
+
+    removed_directories = sorted({
+        directory for component_name in previous_component_names if component_name not in reused_components
+        for directory in get_component_directories(component_name)
+    } | { 'repodata' })
+
+    changed_directories = [ directory for component in changed_components for directory in get_component_directories(component[name]) ]
+
+    delta = '[BASE PACKAGE]'
+    delta += f'\n{path.basename(previous_package["file_name"])} {previous_package["sha256"]}'
+
+    delta += '\n[CHANGED COMPONENTS]'
+    for component in changed_components:
+        delta += f'\n{component[name]} {component[version]}'
+
+    delta += '\n[REMOVED DIRECTORIES]'
+    for directory in removed_directories:
+        delta += f'\n{directory}'
+
+    # the delta directory is made of hard links, so nothing is copied
+    script = (
+        f'mkdir -p {delta_directory} && cd {work_directory} && '
+        f'cp -al {metadata_file_name} {manifest_file_name} {index_file_name} {install_script_name} repodata {delta_directory}/ && '
+        f'for directory in "$@"; do [ ! -e "$directory" ] || cp -al --parents "$directory" {delta_directory}/ || exit 1; done && '
+        f'printf "%s\\n" "$DELTA" > {delta_directory}/{delta_file_name}'
+    )
+
+    result = execute_and_log_container(['sh', '-c', f'DELTA="$0"; {script}', delta] + changed_directories, docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] making a delta package directory is failed.\n{result.output.decode()}')
+        return None
+
+    print(f'[INFO] delta package has {len(changed_components)} changed components. ({", ".join(component[name] for component in changed_components) or "none"})')
+
+    return delta_directory
+
+def get_path_component(file_path):
+
+    # component of a package file, by its top directory
+    top_directory = file_path.split('/')[0]
+
+    for component_name in component_registry:
+        if top_directory in get_component_directories(component_name): return component_name
+
+    return top_directory if '/' in file_path else None
+
+def write_package_index(spec, docker_container, docker_container_log):
+
+    print(f'[INFO] write the package index...')
+
+    # every file with its size and checksum, and every rpm (once by checksum) with its nevra, provides and requires.
+    # the list can be large, so it is written to a file and taken with get_archive.
+    list_file_path = '/tmp/opensql-index.list'
+
+    script = (
+        f'cd {work_directory} && {{ '
+        'find . -type f -printf "F %s %P\\n" && '
+        f'sed "s/^/S /" {manifest_file_name} && '
+        f'awk \'$2 ~ /\\.rpm$/ && !($1 in seen) {{ seen[$1]; print $1, $2 }}\' {manifest_file_name} | while read -r digest file; do '
+        'rpm -qp --nosignature --nodigest --qf "N $digest %{NAME} %|EPOCH?{%{EPOCH}}:{0}| %{VERSION} %{RELEASE} %{ARCH}\\n[P $digest %{PROVIDENAME}\\n][R $digest %{REQUIRENAME}\\n]" "$file" || exit 1; '
+        f'done; }} > {list_file_path}'
+    )
+
+    result = execute_and_log_container(['sh', '-c', script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] listing the package files is failed.\n{result.output.decode()}')
+        return False
+
+    lines = read_container_file(docker_container, list_file_path).decode().splitlines()
+
+    with tempfile.TemporaryDirectory() as index_directory:
+
+        index_file_path = path.join(index_directory, index_file_name)
+
+        build_package_index(spec, lines, index_file_path)
+
+        # the index is put at the package root, where get_archive puts it before the component directories
+        index_archive = io.BytesIO()
+
+        with tarfile.open(fileobj=index_archive, mode='w') as archive:
+            archive.add(index_file_path, arcname=index_file_name)
+
+        if not docker_container.put_archive(work_directory, index_archive.getvalue()):
+            print(f'[ERROR] putting the package index is failed.')
+            return False
+
+    return True
+
+def build_package_index(spec, lines, index_file_path):
+
+    files, sha256s, rpms, dependencies = {}, {}, {}, []
+
+    for line in lines:
+
+        kind, _, fields = line.partition(' ')
+
+        if kind == 'F':
+            size, file_path = fields.split(' ', 1)
+            files[file_path] = int(size)
+
+        elif kind == 'S':
+            digest, file_path = fields.split('  ', 1)
+            sha256s[file_path.removeprefix('./')] = digest
+
+        elif kind == 'N':
+            digest, rpm_name, epoch, rpm_version, release, arch = fields.split()
+            rpms[digest] = (rpm_name, int(epoch), rpm_version, release, arch)
+
+        elif kind in ('P', 'R'):
+            digest, capability = fields.split(' ', 1)
+            dependencies.append((kind, digest, capability))
+
+    connection = sqlite3.connect(index_file_path)
+
+    with connection:
+        connection.executescript(package_index_schema)
+
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)', [
+            ('version', package_index_version),
+            ('target', get_target_name(spec)),
+            ('created_at', datetime.now().isoformat())
+        ])
+
+        # rpms and capabilities are stored once, and the files refer to them
+        rpm_ids = {}
+
+        for digest, rpm in rpms.items():
+            rpm_ids[digest] = connection.execute('INSERT INTO rpms (sha256, name, epoch, version, release, arch) VALUES (?, ?, ?, ?, ?, ?)', (digest, *rpm)).lastrowid
+
+        connection.executemany('INSERT INTO files (path, component, size, sha256, rpm_id) VALUES (?, ?, ?, ?, ?)', [
+            (file_path, get_path_component(file_path), size, sha256s.get(file_path), rpm_ids.get(sha256s.get(file_path)))
+            for file_path, size in sorted(files.items())
+        ])
+
+        capability_ids = {}
+
+        for kind, digest, capability in dependencies:
+
+            if capability not in capability_ids:
+                capability_ids[capability] = connection.execute('INSERT INTO capabilities (name) VALUES (?)', (capability,)).lastrowid
+
+            table = 'provides' if kind == 'P' else 'requires'
+            connection.execute(f'INSERT OR IGNORE INTO {table} VALUES (?, ?)', (rpm_ids[digest], capability_ids[capability]))
+
+    connection.execute('VACUUM')
+    connection.close()
+
+def read_package_index(package_file_name, index_file_path):
+
+    # the index is taken without extracting the package. it is near the start of the archive,
+    # so only the archive members before it are read (and decompressed).
+    root_name = path.basename(work_directory)
+
+    with open(package_file_name, 'rb') as file:
+
+        if package_file_name.endswith(package_compressions['zstd']):
+            import zstandard
+            archive = tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(file), mode='r|')
+        else:
+            archive = tarfile.open(fileobj=file, mode='r|*')
+
+        for member in archive:
+
+            if member.name != f'{root_name}/{index_file_name}': continue
+
+            with open(index_file_path, 'wb') as index_file:
+                shutil.copyfileobj(archive.extractfile(member), index_file)
+
+            return True
+
+    return False
+
+def query_package_index(package_file_name, query, query_arguments):
+
+    statement, default_argument = package_index_queries[query]
+
+    if statement is None: statement = query_arguments[0] if query_arguments else None
+
+    parameters = []
+
+    if statement is not None and '?' in statement and query != 'sql':
+        argument = query_arguments[0] if query_arguments else default_argument
+        parameters = [ argument ] * statement.count('?')
+
+    if statement is None or None in parameters:
+        print(f'[ERROR] {query} query needs an argument.')
+        return False
+
+    with tempfile.TemporaryDirectory() as index_directory:
+
+        index_file_path = path.join(index_directory, index_file_name)
+
+        try:
+            found = read_package_index(package_file_name, index_file_path)
+        except (OSError, tarfile.TarError, ImportError) as e:
+            print(f'[ERROR] package cannot be read. ({e})')
+            return False
+
+        if not found:
+            print(f'[ERROR] there is no package index in {package_file_name}.')
+            return False
+
+        connection = sqlite3.connect(index_file_path)
+
+        try:
+            cursor = connection.execute(statement, parameters)
+            columns = [ column[0] for column in cursor.description or [] ]
+            rows = [ [ '' if value is None else str(value) for value in row ] for row in cursor.fetchall() ]
+        except sqlite3.Error as e:
+            print(f'[ERROR] query is failed. ({e})')
+            return False
+        finally:
+            connection.close()
+
+    widths = [ max([ len(column) ] + [ len(row[index]) for row in rows ]) for index, column in enumerate(columns) ]
+
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)).rstrip())
+
+    for row in rows:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+    return True
+
+def record_download(docker_container, kind, record):
+
+    with download_records_lock:
+        download_records.setdefault(docker_container.id, {}).setdefault(kind, []).append(record)
+
+def get_spec_digest(spec):
+
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+def parse_pip_file_name(file_name):
+
+    # wheel: {name}-{version}-{tags}.whl, sdist: {name}-{version}.tar.gz or .zip
+    if file_name.endswith('.whl'):
+        return file_name.split('-')[:2]
+
+    return file_name.removesuffix('.tar.gz').removesuffix('.zip').rsplit('-', 1)
+
+def write_lock_file(spec, lock_file_name, docker_container, docker_container_log):
+
+    print(f'[INFO] write the lockfile... ({lock_file_name})')
+
+    # every rpm with its nevra, and every pip file, with their checksums. the number of files of each kind is listed first,
+    # so a listing missing some files is found.
+    pip_directories = [ component[name] for component in spec[options] if component[name] == 'patroni' ]
+    pip_count = f'find {" ".join(pip_directories)} -maxdepth 1 -type f | wc -l' if pip_directories else 'echo 0'
+
+    script = (
+        f'cd {work_directory} && {{ '
+        'echo "count rpm $(find . -type f -name "*.rpm" | wc -l)" && '
+        f'echo "count pip $({pip_count})" && '
+        'find . -type f -name "*.rpm" | sort | while read -r file; do '
+        'echo "rpm ${file#./} $(sha256sum "$file" | cut -d " " -f 1) '
+        '$(rpm -qp --nosignature --nodigest --qf "%{NAME}-%|EPOCH?{%{EPOCH}}:{0}|:%{VERSION}-%{RELEASE}.%{ARCH}" "$file")"; done'
+    )
+
+    for directory in pip_directories:
+        script += (
+            f' && find {directory} -maxdepth 1 -type f | sort | while read -r file; do '
+            'echo "pip $file $(sha256sum "$file" | cut -d " " -f 1)"; done'
+        )
+
+    script += f'; }} > {lock_list_path}'
+
+    result = execute_and_log_container(['sh', '-c', script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] listing the package files is failed.\n{result.output.decode()}')
+        return False
+
+    rpms, pip_files = parse_lock_list(read_container_file(docker_container, lock_list_path).decode())
+
+    if rpms is None: return False
+
+    # rpm urls are taken from the repositories, or from the rpms given by url
+    urls = {}
+    nevras = sorted({ rpm['nevra'] for rpm in rpms })
+
+    if nevras:
+        result = execute_and_log_container(['sh', '-c', f'dnf repoquery -q --location "$@" > {lock_locations_path}', 'sh'] + nevras, docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] repoquery of the rpm locations is failed.\n{result.output.decode()}')
+            return False
+
+        for url in read_container_file(docker_container, lock_locations_path).decode().split():
+            urls.setdefault(path.basename(url), url)
+
+    with download_records_lock:
+        records = copy.deepcopy(download_records.get(docker_container.id, {}))
+
+    for url in records.get('rpm_urls', []):
+        urls[path.basename(url)] = url
+
+    for rpm in rpms:
+        rpm['url'] = urls.get(path.basename(rpm['path']))
+
+        if rpm['url'] is None:
+            print(f'[ERROR] there is no download url of {rpm["nevra"]}.')
+            return False
+
+    tarballs = sorted(records.get('tarballs', []), key=lambda tarball: tarball['directory'])
+
+    lock = {
+        'version': lock_file_version,
+        'target': get_target_name(spec),
+        'spec': get_spec_digest(spec),
+        'rpms': rpms,
+        'pip': pip_files,
+        'tarballs': tarballs
+    }
+
+    with open(lock_file_name, 'w') as file:
+        file.write('# generated by package.py --write-lock. use it with --lock to download the same files.\n')
+        yaml.safe_dump(lock, file, sort_keys=False)
+
+    print(f'[INFO] lockfile has {len(rpms)} rpms, {len(pip_files)} pip files and {len(tarballs)} tarballs.')
+
+    return True
+
+def parse_lock_list(listing):
+
+    # count lines (number of files of each kind), then rpm (path, sha256, nevra) and pip (path, sha256) lines
+    counts, rpms, pip_files = {}, [], []
+
+    for line in listing.splitlines():
+        fields = line.split()
+
+        if len(fields) == 3 and fields[0] == 'count':
+            counts[fields[1]] = int(fields[2])
+
+        if len(fields) == 4 and fields[0] == 'rpm':
+            rpms.append({ 'path': fields[1], 'nevra': fields[3], 'sha256': fields[2] })
+
+        if len(fields) == 3 and fields[0] == 'pip':
+            pip_name, pip_version = parse_pip_file_name(path.basename(fields[1]))
+            pip_files.append({ 'path': fields[1], 'name': pip_name, 'version': pip_version, 'sha256': fields[2] })
+
+    for kind, entries in [ ('rpm', rpms), ('pip', pip_files) ]:
+        if counts.get(kind) != len(entries):
+            print(f'[ERROR] {len(entries)} of {counts.get(kind)} {kind} files are listed for the lockfile.')
+            return None, None
+
+    return rpms, pip_files
+
+def read_lock_file(lock_file_name, spec):
+
+    lock = read_yaml(lock_file_name)
+
+    if type(lock) != dict or lock.get('version') != lock_file_version:
+        print(f'[ERROR] {lock_file_name} is not a lockfile of this version.')
+        return None
+
+    # a lockfile only describes the setting it was written for
+    if lock.get('spec') != get_spec_digest(spec):
+        print(f'[ERROR] {lock_file_name} is written for another setting ({lock.get("target")}). write it again with --write-lock.')
+        return None
+
+    for kind in [ 'rpms', 'pip', 'tarballs' ]:
+        lock[kind] = lock.get(kind) or []
+
+    return lock
+
+def download_locked_rpms(rpms, jobs, docker_container, docker_container_log):
+
+    print(f'[INFO] {len(rpms)} locked rpms download...')
+
+    # each rpm is downloaded once by its checksum, then linked to every path having it
+    files_directory = f'{lock_directory}/rpms'
+    files = '\n'.join(sorted({ f'{rpm["sha256"]} {rpm["url"]}' for rpm in rpms }))
+    links = '\n'.join(f'{rpm["sha256"]} {rpm["path"]}' for rpm in rpms)
+    rpms_cache_directory = container_rpm_cache_directory
+
+    steps = [
+        (f"mkdir -p {files_directory} && cd {files_directory} && cat > files <<'EOF'\n{files}\nEOF\ncat > links <<'EOF'\n{links}\nEOF", 'writing the locked rpm list is failed')
+    ]
+
+    if download_cache_directory is not None:
+        steps.append((
+            f'cd {files_directory} && while read -r digest url; do '
+            f'file={rpms_cache_directory}/$(basename "$url"); [ ! -f "$file" ] || {{ cp "$file" "$digest" && touch "$file" && echo "cached: $url"; }}; '
+            'done < files; true',
+            None
+        ))
+
+    # the rpms not cached (or broken) are downloaded at the same time
+    steps += [
+        (
+            f'cd {files_directory} && while read -r digest url; do echo "$digest  $digest" | sha256sum -c --status 2>/dev/null || echo "$digest $url"; done < files | '
+            f'xargs -r -n 2 -P {jobs} sh -c \'{download_script_path} fetch "$1" "$0.part" && mv "$0.part" "$0" && echo "downloaded: $1"\'',
+            'locked rpm download is failed'
+        ),
+        (f'cd {files_directory} && awk \'{{ print $1 "  " $1 }}\' files | sha256sum -c --quiet', 'locked rpm checksum is not matched')
+    ]
+
+    if download_cache_directory is not None:
+        steps.append((
+            f'cd {files_directory} && while read -r digest url; do file=$(basename "$url"); '
+            f'[ -f {rpms_cache_directory}/"$file" ] || {{ cp "$digest" {rpms_cache_directory}/."$file".$$ && mv {rpms_cache_directory}/."$file".$$ {rpms_cache_directory}/"$file"; }} || echo "$file is not cached."; '
+            'done < files; true',
+            None
+        ))
+
+    steps.append((
+        f'cd {work_directory} && while read -r digest file; do mkdir -p "$(dirname "$file")" && ln -f {files_directory}/"$digest" "$file" || exit 1; done < {files_directory}/links',
+        'linking the locked rpms is failed'
+    ))
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def download_locked_pip_files(directory, pip_files, docker_container, docker_container_log):
+
+    print(f'[INFO] {len(pip_files)} locked pip files download... ({directory})')
+
+    # pinned requirements with hashes need no dependency resolution, and give the same files
+    hashes = {}
+
+    for pip_file in pip_files:
+        hashes.setdefault(f'{pip_file["name"]}=={pip_file["version"]}', []).append(pip_file['sha256'])
+
+    requirements = '\n'.join(requirement + ''.join(f' --hash=sha256:{digest}' for digest in digests) for requirement, digests in hashes.items())
+    requirements_file = f'{lock_directory}/{directory}-requirements.txt'
+
+    pip_options = ''
+
+    if download_cache_directory is not None:
+        pip_options = f'--cache-dir {container_cache_directory}/pip '
+
+    steps = [
+        (f"mkdir -p {lock_directory} {work_directory}/{directory} && cat > {requirements_file} <<'EOF'\n{requirements}\nEOF", 'writing the locked pip requirements is failed'),
+        (f'cd {work_directory}/{directory} && {download_script_path} run pypi pip3 download {get_pip_download_options()}{pip_options}--no-deps --require-hashes -r {requirements_file}', f'locked pip download of {directory} is failed')
+    ]
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def download_locked_files(lock, jobs, docker_container, docker_container_log):
+
+    print(f'[INFO] download the locked files...')
+
+    started_at = time.monotonic()
+
+    pip_directories = {}
+
+    for pip_file in lock['pip']:
+        pip_directories.setdefault(path.dirname(pip_file['path']), []).append(pip_file)
+
+    success = True
+
+    # rpms, pip files of each directory and tarballs are downloaded at the same time
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+
+        futures = []
+
+        if lock['rpms']:
+            futures.append(executor.submit(download_locked_rpms, lock['rpms'], jobs, docker_container, docker_container_log))
+
+        for directory, pip_files in pip_directories.items():
+            futures.append(executor.submit(download_locked_pip_files, directory, pip_files, docker_container, docker_container_log))
+
+        for tarball in lock['tarballs']:
+            futures.append(executor.submit(
+                curl_download_and_extract, tarball['url'], f'{work_directory}/{tarball["directory"]}', docker_container, docker_container_log, None, tarball['sha256']
+            ))
+
+        for future in futures:
+            try:
+                success = future.result() and success
+            except Exception:
+                logging.error(traceback.format_exc())
+                success = False
+
+    if not success:
+        print(f'[ERROR] locked files download is failed.')
+        return False
+
+    print(f'[INFO] locked files download is completed. ({time.monotonic() - started_at:.1f}s)')
+
+    return True
+
+def get_os_docker_image(os_name, os_version, docker_client):
+
+    docker_image = None
+    try:
+
+        os_repository = os_repositories.get(os_name, os_name)
+
+        docker_image = docker_client.images.get(os_repository+':'+os_version)
+
+    except docker.errors.ImageNotFound:
+
+        print(f'[WARN] docker image ({os_repository}:{os_version}) does not exist in this machine. docker pull will be started.')
+
+    if docker_image is None:
+        try:
+
+            docker_image = docker_client.images.pull(os_repository, os_version)
+
+            print(f'[INFO] docker image ({os_repository}:{os_version}) pull is completed.')
+
+        except docker.errors.NotFound:
+
+            print(f'[ERROR] docker image ({os_repository}:{os_version}) pull is failed. please check the os name and version.')
+            return None
+
+    return docker_image
+
+def get_worker_docker_image_tag(os_name, os_version, pg_major_version):
+
+    os_major_version = os_version.split('.')[0]
+
+    # the image is prepared again only when the settings used for the preparation are changed
+    preparation_settings = {
+        'os_init_settings': os_init_settings.get(os_name),
+        'tools': [ 'yum-utils', 'createrepo_c' ],
+        'postgresql_repository': component_registry['postgresql']['repository'].format(os_major_version=os_major_version)
+    }
+
+    settings_hash = hashlib.sha256(json.dumps(preparation_settings, sort_keys=True, default=sorted).encode()).hexdigest()
+
+    return f'{os_name}-{os_version}-pg{pg_major_version}-{settings_hash[:12]}'
+
+def get_worker_docker_image(os_name, os_version, pg_major_version, docker_image, docker_client, docker_container_log, rebuild=False):
+
+    worker_image_name = f'{worker_image_repository}:{get_worker_docker_image_tag(os_name, os_version, pg_major_version)}'
+
+    with worker_image_locks.setdefault(worker_image_name, threading.Lock()):
+        return get_or_prepare_worker_docker_image(worker_image_name, os_name, os_version, docker_image, docker_client, docker_container_log, rebuild)
+
+def get_or_prepare_worker_docker_image(worker_image_name, os_name, os_version, docker_image, docker_client, docker_container_log, rebuild):
+
+    # an image is rebuilt only once in a run, even if several targets share it
+    if not rebuild or worker_image_name in prepared_worker_images:
+        try:
+            worker_image = docker_client.images.get(worker_image_name)
+
+            print(f'[INFO] prepared worker image ({worker_image_name}) is used.')
+
+            return worker_image
+
+        except docker.errors.ImageNotFound:
+            pass
+
+    print(f'[INFO] prepare a worker image ({worker_image_name})...')
+
+    docker_container = None
+
+    try:
+        volumes = {}
+
+        if download_cache_directory is not None:
+            volumes[download_cache_directory] = { 'bind': container_cache_directory, 'mode': 'rw' }
+
+        docker_container = run_container(docker_image, volumes)
+
+        success = prepare_worker_container(os_name, os_version.split('.')[0], docker_container, docker_container_log)
+
+        if not success: return None
+
+        repository, tag = worker_image_name.split(':')
+        with measure_stage('worker_commit'):
+            docker_container.commit(repository, tag)
+
+        worker_image = docker_client.images.get(worker_image_name)
+        prepared_worker_images.add(worker_image_name)
+
+        print(f'[INFO] worker image ({worker_image_name}) is prepared.')
+
+        return worker_image
+
+    finally:
+
+        if docker_container is not None:
+
+            docker_container.kill()
+            docker_container.remove()
+
+def prepare_worker_container(os_name, os_major_version, docker_container, docker_container_log):
+
+    # kept dnf metadata of the os
+    with measure_stage('worker_dnf_metadata', docker_container):
+        success = restore_dnf_metadata(os_name, os_major_version, docker_container, docker_container_log)
+
+    if not success: return False
+
+    with measure_stage('worker_tools', docker_container):
+
+        # set repotrack
+        success = get_repotrack_if_not_exists(docker_container, docker_container_log)
+
+        if not success: return False
+
+        # set createrepo_c (repodata of the package)
+        success = get_createrepo_if_not_exists(docker_container, docker_container_log)
+
+        if not success: return False
+
+    # os init settings
+    if os_name in os_init_settings:
+
+        with measure_stage('init_os', docker_container):
+            success = init_os(os_name, os_major_version, docker_container, docker_container_log)
+
+        if not success: return False
+
+    print(f'[INFO] pg repository setting...')
+
+    with measure_stage('pg_repository', docker_container):
+        success = set_postgresql_repository(os_major_version, docker_container, docker_container_log)
+
+    if not success: return False
+
+    with measure_stage('worker_dnf_metadata_save', docker_container):
+        return save_dnf_metadata(os_name, os_major_version, docker_container, docker_container_log)
+
+def get_repotrack_if_not_exists(docker_container, docker_container_log):
+
+    print(f'[INFO] check repotrack exists...')
+    result = execute_and_log_container('command -v repotrack', docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[INFO] repotrack is not found. install yum-utils with dnf...')
+        result = execute_and_log_container('dnf install -y yum-utils', docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] yum-utils install failed.')
+            return False
+
+        print(f'[INFO] yum-utils install is completed.')
+
+        result = execute_and_log_container('command -v repotrack', docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] yum-utils is installed, but repotrack is not found.')
+            return False
+
+    return True
+
+def get_createrepo_if_not_exists(docker_container, docker_container_log):
+
+    print(f'[INFO] check createrepo_c exists...')
+    result = execute_and_log_container('command -v createrepo_c', docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[INFO] createrepo_c is not found. install createrepo_c with dnf...')
+        result = execute_and_log_container('dnf install -y createrepo_c', docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] createrepo_c install failed.')
+            return False
+
+        print(f'[INFO] createrepo_c install is completed.')
+
+    return True
+
+def init_os(os_name, os_major_version, docker_container, docker_container_log):
+
+    print(f'[INFO] os init setting...')
+
+    epel_setting = os_init_settings[os_name]
+
+    if common in epel_setting:
+        commands = epel_setting[common]
+    else:
+        commands = epel_setting[os_major_version]
+
+    steps = [ (command.format(os_major_version=os_major_version), 'os init setting is failed') for command in commands ]
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def get_dnf_metadata_directory(os_name, os_major_version):
+
+    # the metadata of each repository is in a directory by its repository id and url hash,
+    # so the worker images of every os minor version share the metadata of their os major version
+    return f'{container_cache_directory}/dnf/{os_name}{os_major_version}'
+
+def restore_dnf_metadata(os_name, os_major_version, docker_container, docker_container_log):
+
+    # every repository takes the metadata ttl of the run, and the kept metadata is copied into the container
+    # under a shared lock (while no container replaces it). the marker is older than any metadata refreshed later.
+    steps = [(
+        f"sed -i '/^metadata_expire *=/d' /etc/dnf/dnf.conf $(ls /etc/yum.repos.d/*.repo 2>/dev/null) && "
+        f"sed -i '/^\\[main\\]/a metadata_expire={download_limits['metadata_ttl']}' /etc/dnf/dnf.conf && touch {dnf_metadata_marker_path}",
+        'setting the dnf metadata ttl is failed'
+    )]
+
+    if download_cache_directory is not None:
+
+        directory = get_dnf_metadata_directory(os_name, os_major_version)
+
+        steps.append((
+            f'mkdir -p {directory} && [ ! -d {directory}/cache ] || {{ flock -s {directory}/lock cp -a {directory}/cache/. {container_dnf_cache_directory}/ && echo "dnf metadata is restored."; }}',
+            'restoring the dnf metadata is failed'
+        ))
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def save_dnf_metadata(os_name, os_major_version, docker_container, docker_container_log):
+
+    if download_cache_directory is None: return True
+
+    # only the metadata refreshed in this container is written back (without the packages and the dnf lock files).
+    # it is written next to the kept one and replaced under an exclusive lock, unless another container has written
+    # the metadata after this one was restored.
+    directory = get_dnf_metadata_directory(os_name, os_major_version)
+
+    script = (
+        f'find {container_dnf_cache_directory} -name repomd.xml -newer {dnf_metadata_marker_path} | grep -q . || exit 0; '
+        f'flock -x {directory}/lock sh -c \''
+        f'[ ! -f "$0/cache/.saved" ] || [ ! "$0/cache/.saved" -nt {dnf_metadata_marker_path} ] || exit 0; '
+        f'rm -rf "$0/cache.$$" && mkdir "$0/cache.$$" && '
+        f'tar -C {container_dnf_cache_directory} --exclude="./*/packages" --exclude="*.pid" -cf - . | tar -C "$0/cache.$$" -xf - && '
+        f'touch "$0/cache.$$/.saved" && rm -rf "$0/cache" && mv "$0/cache.$$" "$0/cache" && echo "dnf metadata is saved."'
+        f'\' {directory}'
+    )
+
+    result = execute_and_log_container(['sh', '-c', script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[WARN] saving the dnf metadata is failed. it is downloaded again by the next container.\n{result.output.decode()}')
+
+    return True
+
+def get_link_package_directories_command():
+
+    # the metadata of every repository is downloaded first, so each repository has its directory to link.
+    # a package directory already having rpms (downloaded before it is linked) is left as it is.
+    return (
+        f'{download_script_path} run repositories dnf -q makecache {get_dnf_download_options()} && '
+        f'for repository in {container_dnf_cache_directory}/*/repodata; do packages=$(dirname "$repository")/packages; '
+        f'[ -L "$packages" ] || {{ rmdir "$packages" 2>/dev/null; [ -e "$packages" ] || ln -s {container_rpm_cache_directory} "$packages"; }}; done'
+    )
+
+def link_rpm_cache(os_name, os_major_version, repositories, docker_container, docker_container_log):
+
+    if download_cache_directory is None: return True
+
+    # dnf keeps every downloaded rpm (keepcache) in the rpms of the os. the package directories are linked
+    # only if the repositories are used (the locked rpms are downloaded by their urls).
+    directory = f'{container_cache_directory}/rpms/{os_name}{os_major_version}'
+
+    steps = [(
+        f'mkdir -p {directory} && ln -sfn {directory} {container_rpm_cache_directory} && '
+        f"sed -i '/^keepcache *=/d' /etc/dnf/dnf.conf && sed -i '/^\\[main\\]/a keepcache=1' /etc/dnf/dnf.conf",
+        'linking the rpm cache is failed'
+    )]
+
+    if repositories:
+        steps.append((get_link_package_directories_command(), 'linking the dnf package directories is failed'))
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def make_download_cache_directories(cache_directory):
+
+    # blobs: curl downloads by sha256, refs: url -> sha256, rpms: rpm files by os and file name, pip: pip http cache, probes: available urls,
+    # dnf: dnf metadata by os (history.json: the last download time and size of each component)
+    for directory in [ 'blobs', 'refs', 'rpms', 'pip', 'probes', 'dnf' ]:
+        makedirs(path.join(cache_directory, directory), exist_ok=True)
+
+def get_download_cache_files(cache_directory):
+
+    cache_files = []
+
+    for directory in [ 'blobs', 'rpms', 'pip' ]:
+        for root, _, file_names in walk(path.join(cache_directory, directory)):
+            for file_name in file_names:
+                file_path = path.join(root, file_name)
+                file_stat = stat(file_path)
+                cache_files.append((max(file_stat.st_atime, file_stat.st_mtime), file_stat.st_size, file_path))
+
+    return cache_files
+
+def print_download_cache_info(cache_directory, size_limit):
+
+    if not path.isdir(cache_directory):
+        print(f'[INFO] there is no download cache. ({cache_directory})')
+        return
+
+    cache_files = get_download_cache_files(cache_directory)
+
+    print(f'[INFO] download cache: {cache_directory}')
+
+    for directory in [ 'blobs', 'rpms', 'pip' ]:
+        directory_path = path.join(cache_directory, directory) + '/'
+        sizes = [ size for _, size, file_path in cache_files if file_path.startswith(directory_path) ]
+        print(f'    {directory}: {len(sizes)} files, {format_size(sum(sizes))}')
+
+    total_size = sum(size for _, size, _ in cache_files)
+    print(f'    total: {format_size(total_size)} / limit {format_size(size_limit)}')
+
+def prune_download_cache(cache_directory, size_limit):
+
+    if not path.isdir(cache_directory): return
+
+    cache_files = sorted(get_download_cache_files(cache_directory))
+    total_size = sum(size for _, size, _ in cache_files)
+
+    removed_count, removed_size = 0, 0
+
+    # least recently used files are evicted first
+    for _, size, file_path in cache_files:
+
+        if total_size <= size_limit: break
+
+        try:
+            remove(file_path)
+        except OSError as e:
+            print(f'[WARN] cache file cannot be removed. ({e})')
+            continue
+
+        total_size -= size
+        removed_count += 1
+        removed_size += size
+
+    # drop url references to evicted blobs
+    references_directory = path.join(cache_directory, 'refs')
+
+    for reference_name in listdir(references_directory):
+        reference_path = path.join(references_directory, reference_name)
+        with open(reference_path, 'r') as file: digest = file.read().strip()
+        if not path.isfile(path.join(cache_directory, 'blobs', digest)):
+            remove(reference_path)
+
+    print(f'[INFO] download cache is pruned. ({removed_count} files, {format_size(removed_size)} removed, {format_size(total_size)} left)')
+
+def set_download_limits(arguments):
+
+    download_limits.update({
+        'retries': arguments.download_retries,
+        'max_downloads': arguments.max_downloads,
+        'max_host_downloads': arguments.max_host_downloads,
+        'rate': parse_size(arguments.download_rate_limit) if arguments.download_rate_limit else None,
+        'host_rate': parse_size(arguments.host_download_rate_limit) if arguments.host_download_rate_limit else None,
+        'metadata_ttl': arguments.dnf_metadata_ttl
+    })
+
+def get_transfer_rate_limit():
+
+    # a download takes an equal share of the global and host bandwidth, so the running downloads never exceed them
+    limits = []
+
+    if download_limits['rate'] is not None:
+        limits.append(download_limits['rate'] // download_limits['max_downloads'])
+
+    if download_limits['host_rate'] is not None:
+        limits.append(download_limits['host_rate'] // download_limits['max_host_downloads'])
+
+    return max(min(limits), 1) if limits else 0
+
+def get_download_lock_directory():
+
+    global download_lock_directory
+
+    with download_lock_directory_lock:
+
+        if download_lock_directory is None:
+            download_lock_directory = tempfile.mkdtemp(prefix='opensql-download-locks-')
+            atexit.register(shutil.rmtree, download_lock_directory, True)
+
+        return download_lock_directory
+
+def put_download_script(docker_container):
+
+    values = {
+        'RETRIES': download_limits['retries'],
+        'RETRY_DELAY': download_limits['retry_delay'],
+        'MAX_DOWNLOADS': download_limits['max_downloads'],
+        'MAX_HOST_DOWNLOADS': download_limits['max_host_downloads'],
+        'TRANSFER_RATE': get_transfer_rate_limit(),
+        'SEGMENTS': download_limits['segments'],
+        'SEGMENT_SIZE': download_limits['segment_size'],
+        'LOCK_DIRECTORY': container_download_lock_directory,
+        'CONNECT_TIMEOUT': download_limits['connect_timeout'],
+        'STALL_TIME': download_limits['stall_time'],
+        'DNF_CACHE_DIRECTORY': container_dnf_cache_directory
+    }
+
+    script = download_script_template
+
+    for key, value in values.items():
+        script = script.replace(f'@{key}@', str(value))
+
+    script_archive = io.BytesIO()
+
+    with tarfile.open(fileobj=script_archive, mode='w') as archive:
+        script_info = tarfile.TarInfo(path.basename(download_script_path))
+        script_info.size = len(script.encode())
+        script_info.mode = 0o755
+        archive.addfile(script_info, io.BytesIO(script.encode()))
+
+    return docker_container.put_archive(path.dirname(download_script_path), script_archive.getvalue())
+
+def get_dnf_download_options():
+
+    # dnf retries and times out by itself, and downloads 3 files at the same time within the slot
+    options = f'--setopt=retries={download_limits["retries"]} --setopt=timeout={download_limits["connect_timeout"]} --setopt=max_parallel_downloads=3'
+
+    if get_transfer_rate_limit():
+        options += f' --setopt=throttle={max(get_transfer_rate_limit() // 3, 1)}'
+
+    return options
+
+def get_pip_download_options():
+
+    # pip has no bandwidth limit, so only the slot limits it
+    return f'--retries {download_limits["retries"]} --timeout {download_limits["stall_time"]} '
+
+def get_cache_reference_path(url):
+
+    return path.join(download_cache_directory, 'refs', hashlib.sha256(url.encode()).hexdigest())
+
+def find_cached_file(url):
+
+    if download_cache_directory is None: return None
+
+    reference_path = get_cache_reference_path(url)
+
+    if not path.isfile(reference_path): return None
+
+    with open(reference_path, 'r') as file: digest = file.read().strip()
+
+    blob_path = path.join(download_cache_directory, 'blobs', digest)
+
+    if not path.isfile(blob_path): return None
+
+    return digest
+
+def extract_cached_file(url, tar_options, directory, docker_container, docker_container_log, sha256=None):
+
+    # returns the sha256 of the extracted cached file, or None if it is not cached.
+    # a locked file is looked up by its checksum, since the blobs are stored by checksum.
+    if download_cache_directory is None: return None
+
+    if sha256 is not None:
+        digest = sha256 if path.isfile(path.join(download_cache_directory, 'blobs', sha256)) else None
+    else:
+        digest = find_cached_file(url)
+
+    if digest is None: return None
+
+    cached_file_path = f'{container_cache_directory}/blobs/{digest}'
+
+    commands = [
+        f'mkdir -p {directory}',
+        f'echo "{digest}  {cached_file_path}" | sha256sum -c - && tar {tar_options} {cached_file_path} -C {directory}'
+    ]
+
+    results = execute_commands_and_log_container(commands, docker_container, docker_container_log)
+
+    if results[-1].exit_code != 0:
+        print(f'[WARN] cached file of {url} is broken. it will be downloaded again.')
+        if sha256 is None: remove(get_cache_reference_path(url))
+        return None
+
+    # mark as recently used for the lru eviction
+    utime(path.join(download_cache_directory, 'blobs', digest))
+
+    print(f'[INFO] cached file is used. ({url})')
+
+    return digest
+
+def write_cache_reference(url, digest):
+
+    # references are replaced atomically, so a concurrent reader never sees a partial one
+    reference_path = get_cache_reference_path(url)
+    temporary_path = f'{reference_path}.{getpid()}.{threading.get_ident()}'
+
+    with open(temporary_path, 'w') as file: file.write(digest)
+    replace(temporary_path, reference_path)
+
+def get_download_rpms_steps(artifacts, directory):
+
+    # all artifacts are resolved by one repotrack, so the shared dependencies are downloaded once
+    artifacts = ' '.join(sorted(artifacts))
+    download_directory = work_directory + '/' + directory
+
+    # the rpms kept in the download cache are reused by dnf from its package cache (see link_rpm_cache)
+    return [
+        (f'mkdir -p {download_directory}', f'make a directory of {directory} is failed'),
+        (f'{download_script_path} run repositories repotrack {get_dnf_download_options()} --destdir {download_directory} {artifacts}', f'{artifacts} download is failed')
+    ]
+
+def download_rpms(artifacts, directory, docker_container, docker_container_log):
+
+    print(f'[INFO] {" ".join(sorted(artifacts))} download...')
+
+    # rpms given by url are not in any repository, so the lockfile takes their url from here
+    for artifact in artifacts:
+        if '://' in artifact: record_download(docker_container, 'rpm_urls', artifact)
+
+    return execute_steps_and_log_container(get_download_rpms_steps(artifacts, directory), docker_container, docker_container_log)
+
+def deduplicate_package_files(docker_container, docker_container_log):
+
+    print(f'[INFO] deduplicate rpms shared between components...')
+
+    # the manifest is written first (checksums by a job per core), then every rpm having the same checksum as an earlier one is replaced with a hard link.
+    # docker get_archive stores hard links once, so a shared rpm takes its size only once in the package.
+    script = (
+        f'cd {work_directory} && '
+        f'parts=$(mktemp -d) && find . -type f ! -path ./{manifest_file_name} -print0 | '
+        'xargs -0 -r -n 64 -P "$(nproc)" sh -c \'sha256sum "$@" > "$(mktemp -p $0)"\' "$parts" && '
+        f'cat "$parts"/* /dev/null | sort -k 2 > {manifest_file_name} && rm -rf "$parts" && '
+        f'awk \'$2 ~ /\\.rpm$/ {{ if ($1 in first) print first[$1], $2; else first[$1] = $2 }}\' {manifest_file_name} | '
+        '{ while read -r source target; do '
+        'size=$(stat -c %s "$target") && ln -f "$source" "$target" && count=$((count + 1)) && saved=$((saved + size)) || exit 1; '
+        'done; '
+        'echo "${count:-0} ${saved:-0}"; }'
+    )
+
+    result = execute_and_log_container(['sh', '-c', script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] rpm deduplication is failed.\n{result.output.decode()}')
+        return False
+
+    count, saved = result.output.decode().split()[-2:]
+    print(f'[INFO] {count} shared rpm files are deduplicated. ({int(saved) / 1024 / 1024:.1f}MB saved)')
+
+    return True
+
+def read_container_file(docker_container, file_path):
+
+    # a file of the container, taken with get_archive
+    with tempfile.TemporaryFile() as archive_file:
+
+        for chunk in docker_container.get_archive(file_path)[0]: archive_file.write(chunk)
+
+        archive_file.seek(0)
+
+        with tarfile.open(fileobj=archive_file, mode='r:') as archive:
+            return archive.extractfile(path.basename(file_path)).read()
+
+def get_install_directories(spec, install_types):
+
+    # package directories of the components by their install types (component name -> directories)
+    directories = {}
+
+    for component in [ spec[database] ] + list(spec[options]):
+        for directory, install_type, _ in component_registry[component[name]]['install']:
+            if install_type in install_types: directories.setdefault(component[name], []).append(directory)
+
+    return directories
+
+def compare_rpm_versions(version1, version2):
+
+    # rpmvercmp: alphabetic and numeric segments are compared in order (a numeric one is newer),
+    # ~ sorts before anything (even the end) and ^ after the end only
+    def is_alnum(character): return character.isascii() and character.isalnum()
+
+    one, two = 0, 0
+
+    while one < len(version1) or two < len(version2):
+
+        while one < len(version1) and not is_alnum(version1[one]) and version1[one] not in '~^': one += 1
+        while two < len(version2) and not is_alnum(version2[two]) and version2[two] not in '~^': two += 1
+
+        character1 = version1[one] if one < len(version1) else ''
+        character2 = version2[two] if two < len(version2) else ''
+
+        if '~' in (character1, character2):
+            if character1 != '~': return 1
+            if character2 != '~': return -1
+            one, two = one + 1, two + 1
+            continue
+
+        if '^' in (character1, character2):
+            if not character1: return -1
+            if not character2: return 1
+            if character1 != '^': return 1
+            if character2 != '^': return -1
+            one, two = one + 1, two + 1
+            continue
+
+        if not (character1 and character2): break
+
+        is_number = character1.isdigit()
+        is_segment = (lambda character: character.isdigit()) if is_number else (lambda character: character.isascii() and character.isalpha())
+
+        end1, end2 = one, two
+
+        while end1 < len(version1) and is_segment(version1[end1]): end1 += 1
+        while end2 < len(version2) and is_segment(version2[end2]): end2 += 1
+
+        segment1, segment2 = version1[one:end1], version2[two:end2]
+
+        if not segment2: return 1 if is_number else -1
+
+        if is_number:
+            segment1, segment2 = segment1.lstrip('0'), segment2.lstrip('0')
+
+            if len(segment1) != len(segment2): return 1 if len(segment1) > len(segment2) else -1
+
+        if segment1 != segment2: return 1 if segment1 > segment2 else -1
+
+        one, two = end1, end2
+
+    if one >= len(version1) and two >= len(version2): return 0
+
+    return -1 if one >= len(version1) else 1
+
+def compare_rpm_evrs(evr1, evr2):
+
+    # (epoch, version, release)
+    if int(evr1[0]) != int(evr2[0]):
+        return 1 if int(evr1[0]) > int(evr2[0]) else -1
+
+    return compare_rpm_versions(evr1[1], evr2[1]) or compare_rpm_versions(evr1[2], evr2[2])
+
+def get_base_rpm_database(docker_image, docker_container_log):
+
+    # the rpm database of the os image (not of the worker image, which has the packaging tools)
+    with base_rpm_database_locks.setdefault(docker_image.id, threading.Lock()):
+
+        if docker_image.id in base_rpm_databases: return base_rpm_databases[docker_image.id]
+
+        docker_container = run_container(docker_image)
+
+        try:
+            # the database directory can be a link (ex. /var/lib/rpm to /usr/lib/sysimage/rpm)
+            result = execute_and_log_container('readlink -f "$(rpm --eval %_dbpath)"', docker_container, docker_container_log)
+
+            if result.exit_code != 0:
+                print(f'[ERROR] rpm database of the base image is not found.\n{result.output.decode()}')
+                return None
+
+            chunks, _ = docker_container.get_archive(result.output.decode().strip())
+            base_rpm_databases[docker_image.id] = b''.join(chunks)
+
+        finally:
+            docker_container.kill()
+            docker_container.remove()
+
+        return base_rpm_databases[docker_image.id]
+
+def prune_base_rpms(docker_image, docker_container, docker_container_log):
+
+    print(f'[INFO] prune the rpms installed in the base os image...')
+
+    rpm_database_archive = get_base_rpm_database(docker_image, docker_container_log)
+
+    if rpm_database_archive is None: return None
+
+    # the database directory (rpm in the archive) is put as the database of the base root. the environment files of the
+    # os image database are not used.
+    result = execute_and_log_container(f'rm -rf {base_root_directory} && mkdir -p {base_root_directory}/var/lib', docker_container, docker_container_log)
+
+    if result.exit_code != 0 or not docker_container.put_archive(f'{base_root_directory}/var/lib', rpm_database_archive):
+        print(f'[ERROR] putting the rpm database of the base image is failed.')
+        return None
+
+    # B (rpm of the base image) and N (rpm file of the package, with its size and path) lines, the rpm files read with a job per core
+    query_format = '%{NAME} %|EPOCH?{%{EPOCH}}:{0}| %{VERSION} %{RELEASE} %{ARCH}'
+
+    script = (
+        f'rm -f {base_root_directory}/var/lib/rpm/__db.* && '
+        f'rpm --root {base_root_directory} -qa --qf "B {query_format}\\n" > {prune_list_path} && '
+        f'cd {work_directory} && parts=$(mktemp -d) && find . -type f -name "*.rpm" -printf "%P\\n" | '
+        'xargs -d "\\n" -r -n 64 -P "$(nproc)" sh -c \'for file; do '
+        f'rpm=$(rpm -qp --nosignature --nodigest --qf "{query_format}" "$file") || exit 1; '
+        'echo "N $rpm $(stat -c %s "$file") $file"; done > "$(mktemp -p $0)"\' "$parts" && '
+        f'cat "$parts"/* >> {prune_list_path} && rm -rf "$parts"'
+    )
+
+    result = execute_and_log_container(['sh', '-c', script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] listing the rpms of the base image and the package is failed.\n{result.output.decode()}')
+        return None
+
+    base_rpms, package_rpms = {}, []
+
+    for line in read_container_file(docker_container, prune_list_path).decode().splitlines():
+
+        kind, _, fields = line.partition(' ')
+
+        if kind == 'B':
+            rpm_name, epoch, rpm_version, release, arch = fields.split()
+            base_rpms.setdefault((rpm_name, arch), []).append((epoch, rpm_version, release))
+
+        elif kind == 'N':
+            rpm_name, epoch, rpm_version, release, arch, size, file_path = fields.split(' ', 6)
+            package_rpms.append((rpm_name, arch, (epoch, rpm_version, release), int(size), file_path))
+
+    # an rpm is left out if the base image has it (same name and arch) at the same or a newer version
+    pruned = []
+
+    for rpm_name, arch, evr, size, file_path in package_rpms:
+
+        base_evr = max(base_rpms.get((rpm_name, arch), []), key=functools.cmp_to_key(compare_rpm_evrs), default=None)
+
+        if base_evr is not None and compare_rpm_evrs(base_evr, evr) >= 0:
+            pruned.append((file_path, size, f'{rpm_name}-{base_evr[1]}-{base_evr[2]}.{arch}'))
+
+    if pruned:
+        files = '\n'.join(file_path for file_path, _, _ in pruned)
+        result = execute_and_log_container(f"cd {work_directory} && xargs -d '\\n' rm -f <<'EOF'\n{files}\nEOF", docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] removing the pruned rpms is failed.\n{result.output.decode()}')
+            return None
+
+    # a file shared by several components is counted once
+    pruned_size = sum({ path.basename(file_path): size for file_path, size, _ in pruned }.values())
+    base_rpm_count = sum(len(evrs) for evrs in base_rpms.values())
+
+    print(f'[INFO] {len(pruned)} rpm files ({format_size(pruned_size)}) are left out. (base image has {base_rpm_count} rpms)')
+
+    section = f'\n[{pruned_rpms_section}]'
+    section += f'\nbase image {docker_image.tags[0] if docker_image.tags else docker_image.id} ({base_rpm_count} rpms)'
+    section += f'\npruned {len(pruned)} files ({format_size(pruned_size)})'
+
+    for file_path, _, base_rpm in sorted(pruned):
+        section += f'\n{file_path} (base has {base_rpm})'
+
+    return section
+
+def verify_package_files(spec, docker_container, docker_container_log, base_root=None):
+
+    print(f'[INFO] verify the package files...')
+
+    started_at = time.monotonic()
+
+    # the keys of the repositories (installed by the os and the repository release rpms) are imported to check the signatures.
+    # every rpm is checked once by its checksum.
+    script = (
+        f'cd {work_directory} && list={verification_list_path} && echo "F $(wc -l < {manifest_file_name})" > $list && '
+        'for key in /etc/pki/rpm-gpg/*; do [ ! -f "$key" ] || rpm --import "$key" 2>/dev/null; done; '
+        f'awk \'$2 ~ /\\.rpm$/ && !($1 in seen) {{ seen[$1]; print $2 }}\' {manifest_file_name} | '
+        'xargs -d "\\n" -r -n 16 -P "$(nproc)" sh -c "$RPMS" sh >> $list || exit 1; '
+    )
+
+    pip_directories = [ directory for directories in get_install_directories(spec, { 'pip' }).values() for directory in directories ]
+
+    if pip_directories:
+        script += (
+            f'find {" ".join(pip_directories)} -maxdepth 1 -type f \\( -name "*.whl" -o -name "*.zip" -o -name "*.tar.gz" -o -name "*.tgz" \\) | '
+            'xargs -d "\\n" -r -n 8 -P "$(nproc)" python3 -c "$PIP" >> $list || exit 1; '
+        )
+
+    for directories in get_install_directories(spec, { 'make', 'binary' }).values():
+        for directory in directories:
+            script += f'if [ -n "$(ls -A {directory} 2>/dev/null)" ]; then echo "T ok {directory}"; else echo "T empty {directory}"; fi >> $list; '
+
+    # the rpms of each component (once by inode, the shared ones are hard links) are test installed on an empty rpm database
+    # (or on a copy of the base image database for a slim package), so a dependency not in the package is reported
+    # even if the worker image has it. the components are checked at the same time.
+    initialize_root = f'cp -a {base_root}/. "$root"' if base_root is not None else 'rpm --root "$root" --initdb'
+
+    for component_name, directories in get_install_directories(spec, { 'rpm' }).items():
+        script += (
+            f'( root=$(mktemp -d) && {initialize_root} && '
+            f'find {" ".join(directories)} -name "*.rpm" -printf "%i %p\\n" | sort -u -k 1,1 | cut -d " " -f 2- | '
+            'xargs -d "\\n" -r rpm -i --test --nosignature --nodigest --root "$root" 2>&1 | '
+            f'sed -n "s/^[[:space:]]*\\(.*\\) is needed by \\(.*\\)$/D {component_name} \\1 (needed by \\2)/p" >> $list; rm -rf "$root" ) & '
+        )
+
+    script += 'wait'
+
+    result = execute_and_log_container(['sh', '-c', f'RPMS="$0"; PIP="$1"; {script}', verify_rpms_script, verify_pip_files_script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] package file verification is failed.\n{result.output.decode()}')
+        return None
+
+    file_count, rpms, pip_files, tarball_directories, missing_dependencies = 0, {}, {}, {}, []
+
+    for line in read_container_file(docker_container, verification_list_path).decode().splitlines():
+
+        kind, _, fields = line.partition(' ')
+
+        if kind == 'F':
+            file_count = int(fields)
+        elif kind in ('R', 'P', 'T'):
+            status, file_path = fields.split(' ', 1)
+            { 'R': rpms, 'P': pip_files, 'T': tarball_directories }[kind].setdefault(status, []).append(file_path.removeprefix('./'))
+        elif kind == 'D':
+            missing_dependencies.append(fields)
+
+    errors = [ f'{file_path} is corrupt.' for file_path in rpms.get('corrupt', []) + pip_files.get('corrupt', []) ]
+    errors += [ f'{file_path} has a bad signature.' for file_path in rpms.get('bad-signature', []) ]
+    errors += [ f'{directory} is empty.' for directory in tarball_directories.get('empty', []) ]
+    errors += [ f'{component_name} misses {dependency}' for component_name, dependency in (fields.split(' ', 1) for fields in sorted(set(missing_dependencies))) ]
+
+    if errors:
+        print(f'[ERROR] {len(errors)} problems are found in the package files.')
+        for error in errors:
+            print(f'    {error}')
+        return None
+
+    # rpms without a signature or without a configured key are allowed, and listed in the metadata
+    unchecked_rpms = sorted({ path.basename(file_path) for status in ('unsigned', 'nokey') for file_path in rpms.get(status, []) })
+
+    if unchecked_rpms:
+        print(f'[WARN] {len(unchecked_rpms)} rpms are not signed with a configured key. ({", ".join(unchecked_rpms[:3])}{", ..." if len(unchecked_rpms) > 3 else ""})')
+
+    with download_records_lock:
+        tarballs = sorted(download_records.get(docker_container.id, {}).get('tarballs', []), key=lambda tarball: tarball['directory'])
+
+    verification = '[VERIFICATION]'
+    verification += f'\nfiles {file_count} (sha256 in {manifest_file_name})'
+    verification += f'\nrpms {sum(len(file_paths) for file_paths in rpms.values())} (digests ok, {len(rpms.get("signed", []))} signed, {len(rpms.get("unsigned", []))} unsigned, {len(rpms.get("nokey", []))} without a configured key)'
+    verification += f'\npip files {len(pip_files.get("ok", []))} (archives ok)'
+    verification += f'\ndependency closure complete ({", ".join(get_install_directories(spec, { "rpm" }))}{" with the base image rpms" if base_root is not None else ""})'
+
+    for tarball in tarballs:
+        verification += f'\ntarball {tarball["directory"]} sha256 {tarball["sha256"]}'
+
+    for rpm_name in unchecked_rpms:
+        verification += f'\nunchecked signature {rpm_name}'
+
+    print(f'[INFO] package files are verified. ({file_count} files, {sum(len(file_paths) for file_paths in rpms.values())} rpms, {time.monotonic() - started_at:.1f}s)')
+
+    return verification
+
+def get_install_plan(spec):
+
+    # install type and arguments of each package directory, as lines of install.sh
+    pg_major_version = spec[database][version].split('.')[0]
+    plan = []
+
+    for component in [ spec[database] ] + list(spec[options]):
+
+        format_arguments = {
+            version: component[version],
+            major_version: component[version].split('.')[0],
+            'pg_major_version': pg_major_version
+        }
+
+        entry = component_registry[component[name]]
+
+        for directory, install_type, install_arguments in entry['install']:
+
+            # {artifacts}: the artifacts of the component are installed by their names
+            if '{artifacts}' in install_arguments:
+                install_arguments = install_arguments.replace('{artifacts}', ' '.join(sorted(artifact.format(**format_arguments) for artifact in entry['artifacts'])))
+
+            plan.append(f'{component[name]} {install_type} {directory} {install_arguments.format(**format_arguments)}'.rstrip())
+
+    return plan
+
+def write_install_files(spec, docker_container, docker_container_log):
+
+    print(f'[INFO] write the package repository and install script...')
+
+    # the repository has every rpm once, by the first path of its checksum (the others are hard links of it).
+    # the new files are added to the manifest.
+    list_file_path = '/tmp/opensql-repository.list'
+    install_script = install_script_template.replace('@PLAN@', '\n'.join(get_install_plan(spec)))
+
+    script = (
+        f'cd {work_directory} && '
+        f'awk \'$2 ~ /\\.rpm$/ && !($1 in seen) {{ seen[$1]; print substr($2, 3) }}\' {manifest_file_name} > {list_file_path} && '
+        f'createrepo_c --quiet --no-database --pkglist {list_file_path} . && '
+        f'printf "%s" "$INSTALL" > {install_script_name} && chmod 755 {install_script_name} && '
+        f'sha256sum ./repodata/* ./{install_script_name} >> {manifest_file_name}'
+    )
+
+    result = execute_and_log_container(['sh', '-c', f'INSTALL="$0"; {script}', install_script], docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] writing the package repository is failed.\n{result.output.decode()}')
+        return False
+
+    return True
+
+def set_postgresql_repository(os_major_version, docker_container, docker_container_log):
+
+    repository_url = component_registry['postgresql']['repository'].format(os_major_version=os_major_version)
+
+    steps = [
+        (f'dnf -y install {repository_url}', 'dnf pg repository setting is failed'),
+        ('dnf -qy module disable postgresql', 'dnf disable default postgresql is failed')
+    ]
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
+def get_postgresql(spec, component, docker_container, docker_container_log):
+
+    pg_version = component[version]
+    pg_major_version = pg_version.split('.')[0]
+
+    print(f'[INFO] pg download...')
+
+    artifacts = [
+        artifact_format.format(version=pg_version, major_version=pg_major_version)
+        for artifact_format in component_registry[component[name]]['artifacts']
+    ]
+
+    return download_rpms(artifacts, 'postgresql', docker_container, docker_container_log)
+
+def set_pgpool_repository(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] pgpool repository setting...')
+
+    # the release rpm number is not known, so all the candidates are probed at once and the lowest available one is used
+    _, repository_url = resolve_url(get_candidate_urls(spec, component), docker_container, docker_container_log)
+
+    if repository_url is None:
+        print(f'[ERROR] there is no available pgpool release rpm for {component[version]}.')
+        return False
+
+    result = execute_and_log_container(f'{download_script_path} run repositories dnf -y install {get_dnf_download_options()} {repository_url}', docker_container, docker_container_log)
+
+    if result.exit_code != 0:
+        print(f'[ERROR] pgpool repository setting is failed.\n{result.output.decode()}')
+        return False
+
+    # the package directory of the new repository takes the rpm cache too
+    if download_cache_directory is not None:
+
+        result = execute_and_log_container(get_link_package_directories_command(), docker_container, docker_container_log)
+
+        if result.exit_code != 0:
+            print(f'[ERROR] linking the dnf package directory of the pgpool repository is failed.\n{result.output.decode()}')
+            return False
+
+    return True
+
+def get_pgpool(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] pgpool download...')
+
+    format_arguments = get_component_format_arguments(spec, component)
+
+    artifacts = [ artifact.format(**format_arguments) for artifact in component_registry[component[name]]['artifacts'] ]
+    return download_rpms(artifacts, 'pgpool', docker_container, docker_container_log)
+
+def get_postgis(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] postgis download...')
+
+    format_arguments = {
+        version: component[version],
+        'pg_major_version': spec[database][version].split('.')[0]
+    }
+
+    # the postgis minor version in the package name is not known, so all the candidates are queried at once
+    candidate_artifacts = [
+        artifact.format(**format_arguments, number=number)
+        for artifact in sorted(component_registry[component[name]]['artifacts']) for number in range(1, 10)
+    ]
+
+    artifact = resolve_rpm_artifact(candidate_artifacts, docker_container, docker_container_log)
+
+    if artifact is None:
+        print(f'[ERROR] there is no available postgis package for {component[version]}.')
+        return False
+
+    return download_rpms([ artifact ], 'postgis', docker_container, docker_container_log)
+
+def get_barman(spec, component, docker_container, docker_container_log):
+
+    artifacts = [ artifact.format(version=component[version]) for artifact in component_registry[component[name]]['artifacts'] ]
+
+    return download_rpms(artifacts, 'barman', docker_container, docker_container_log)
+
+def get_pg_hint_plan(spec, component, docker_container, docker_container_log):
+
+    # the rpm is downloaded by its url
+    artifact = get_candidate_urls(spec, component)[0]
+
+    return download_rpms([ artifact ], 'pg_hint_plan', docker_container, docker_container_log)
+
+def get_pg_build_extension_install_utils(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] pg build extension install utils download...')
+
+    # all utils are resolved by one repotrack, and install.sh installs them in one dnf transaction
+    return download_rpms(component_registry[component[name]]['artifacts'], 'extension-utils', docker_container, docker_container_log)
+
+def get_component_format_arguments(spec, component):
+
+    version_tokens = (str(component[version]).split('.') + [ '0', '0' ])[:3]
+
+    return {
+        name: component[name],
+        version: component[version],
+        major_version: version_tokens[0],
+        minor_version: version_tokens[1],
+        patch_version: version_tokens[2],
+        'os_name': spec[os][name],
+        'os_version': spec[os][version],
+        'os_major_version': spec[os][version].split('.')[0],
+        'pg_major_version': spec[database][version].split('.')[0]
+    }
+
+def get_candidate_urls(spec, component):
+
+    # urls of the component repository in order of preference: every release rpm number ({number}), and the file with
+    # os full version before the one with os major version ({os_version}). a component without a repository url has none.
+    repository = component_registry[component[name]].get('repository')
+
+    if repository is None: return []
+
+    format_arguments = get_component_format_arguments(spec, component)
+    numbers = range(1, 5) if '{number}' in repository else [ None ]
+    os_versions = [ spec[os][version], spec[os][version].split('.')[0] ] if '{os_version}' in repository else [ spec[os][version] ]
+
+    return list(dict.fromkeys(
+        repository.format(**{ **format_arguments, 'os_version': os_version, 'number': number })
+        for os_version in os_versions for number in numbers
+    ))
+
+def get_mirror_urls(url):
+
+    # the url itself first, then the same file on each mirror of its prefix
+    urls = [ url ]
+
+    for prefix, mirror_prefixes in url_mirrors.items():
+        prefix = prefix.rstrip('/')
+
+        if not url.startswith(prefix + '/'): continue
+
+        urls += [ mirror_prefix.rstrip('/') + url[len(prefix):] for mirror_prefix in mirror_prefixes ]
+
+    return urls
+
+def read_url_probe_record(url):
+
+    # (latency, size) of an available url, where the size is known only if it was checked from the host
+    if download_cache_directory is None: return None
+
+    probe_path = path.join(download_cache_directory, 'probes', hashlib.sha256(url.encode()).hexdigest())
+
+    try:
+        if time.time() - stat(probe_path).st_mtime > url_probe_cache_ttl: return None
+
+        with open(probe_path, 'r') as file: fields = file.read().split()
+
+        return float(fields[0]), int(fields[1]) if len(fields) > 1 else None
+
+    except (OSError, ValueError, IndexError):
+        return None
+
+def read_url_probe_cache(url):
+
+    record = read_url_probe_record(url)
+
+    return None if record is None else record[0]
+
+def write_url_probe_cache(url, latency, size=None):
+
+    if download_cache_directory is None: return
+
+    probe_path = path.join(download_cache_directory, 'probes', hashlib.sha256(url.encode()).hexdigest())
+    temporary_path = f'{probe_path}.{getpid()}.{threading.get_ident()}'
+
+    with open(temporary_path, 'w') as file: file.write(str(latency) if size is None else f'{latency} {size}')
+    replace(temporary_path, probe_path)
+
+def check_url(url):
+
+    # (latency, size) of an available url checked from the host, or None. redirects (ex. github releases) are followed.
+    started_at = time.monotonic()
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=url_probe_timeout) as response:
+            size = response.headers.get('Content-Length', '')
+
+            return time.monotonic() - started_at, int(size) if size.isdigit() else 0
+
+    except (OSError, ValueError):
+        return None
+
+def check_urls(urls):
+
+    # url -> (latency, size) or None. the urls checked from the host within a day are taken from the download cache,
+    # and the others are checked at the same time.
+    results = {}
+    unknown_urls = []
+
+    for url in dict.fromkeys(urls):
+
+        record = read_url_probe_record(url)
+
+        if record is not None and record[1] is not None: results[url] = record
+        else: unknown_urls.append(url)
+
+    if not unknown_urls: return results
+
+    with ThreadPoolExecutor(max_workers=min(len(unknown_urls), url_check_workers)) as executor:
+
+        for url, result in zip(unknown_urls, executor.map(check_url, unknown_urls)):
+
+            results[url] = result
+
+            if result is not None: write_url_probe_cache(url, *result)
+
+    return results
+
+def probe_urls(urls, docker_container, docker_container_log):
+
+    # returns url -> latency in seconds (None if not available).
+    # the urls not answered yet are checked by background curls in one exec, so failed guesses wait for one timeout at most.
+    latencies = {}
+    unknown_urls = []
+
+    with url_probe_lock:
+        for url in dict.fromkeys(urls):
+            if url in url_probe_results:
+                latencies[url] = url_probe_results[url]
+                continue
+
+            latency = read_url_probe_cache(url)
+
+            if latency is None: unknown_urls.append(url)
+            else: latencies[url] = url_probe_results[url] = latency
+
+    if not unknown_urls: return latencies
+
+    command = ''
+
+    for index, url in enumerate(unknown_urls):
+        command += f'{{ time=$(curl -s -f -I -o /dev/null --max-time {url_probe_timeout} -w "%{{time_total}}" {shlex.quote(url)}); echo "probe {index} $? $time"; }} & '
+
+    command += 'wait'
+
+    result = execute_and_log_container(command, docker_container, docker_container_log)
+
+    answers = {}
+
+    for line in result.output.decode().splitlines():
+        fields = line.split()
+
+        if len(fields) == 4 and fields[0] == 'probe' and fields[2] == '0':
+            answers[unknown_urls[int(fields[1])]] = float(fields[3])
+
+    with url_probe_lock:
+        for url in unknown_urls:
+            latencies[url] = url_probe_results[url] = answers.get(url)
+
+            if url in answers: write_url_probe_cache(url, answers[url])
+
+    return latencies
+
+def resolve_url(candidate_urls, docker_container, docker_container_log):
+
+    # candidates are in order of preference. returns (url, download url) of the first available candidate,
+    # where the download url is the fastest of its mirrors, or (None, None) if no candidate is available.
+    candidate_urls = list(dict.fromkeys(candidate_urls))
+    probe_candidate_urls = []
+
+    # a candidate in the download cache needs no probe, and neither do the less preferred ones
+    for url in candidate_urls:
+        if find_cached_file(url) is not None: break
+        probe_candidate_urls.append(url)
+
+    mirror_urls = { url: get_mirror_urls(url) for url in probe_candidate_urls }
+    latencies = probe_urls([ mirror_url for url in probe_candidate_urls for mirror_url in mirror_urls[url] ], docker_container, docker_container_log)
+
+    for url in candidate_urls:
+
+        if url not in mirror_urls: return url, url
+
+        available_urls = [ (latencies[mirror_url], mirror_url) for mirror_url in mirror_urls[url] if latencies[mirror_url] is not None ]
+
+        if not available_urls: continue
+
+        download_url = min(available_urls)[1]
+
+        if download_url != url:
+            print(f'[INFO] {path.basename(url)} is downloaded from a mirror ({download_url})')
+
+        return url, download_url
+
+    return None, None
+
+def resolve_rpm_artifact(candidate_artifacts, docker_container, docker_container_log):
+
+    # candidates are in order of preference, and all of them are looked up by one repoquery
+    key = (docker_container.attrs['Image'], tuple(candidate_artifacts))
+
+    if key in resolved_artifacts: return resolved_artifacts[key]
+
+    result = execute_and_log_container(f'dnf repoquery -q --qf "%{{name}}-%{{version}}" {" ".join(candidate_artifacts)}', docker_container, docker_container_log)
 
     if result.exit_code != 0:
-        print(f'[ERROR] patroni download is failed.')
+        print(f'[ERROR] repoquery of {candidate_artifacts[0]} is failed.\n{result.output.decode()}')
+        return None
+
+    packages = result.output.decode().split()
+
+    for artifact in candidate_artifacts:
+        if artifact in packages:
+            resolved_artifacts[key] = artifact
+            return artifact
+
+    return None
+
+def curl_download_and_extract(url, directory, docker_container, docker_container_log, download_url=None, sha256=None):
+
+    # sha256: expected checksum of the archive (from a lockfile)
+    tar_options = '-xzvf' if url.endswith(('.tar.gz', '.tgz')) else '-xvf'
+
+    # the archive is extracted from the download cache, or streamed from curl into tar without an intermediate file
+    digest = extract_cached_file(url, tar_options, directory, docker_container, docker_container_log, sha256)
+
+    if digest is not None:
+        record_download(docker_container, 'tarballs', { 'url': url, 'sha256': digest, 'directory': path.relpath(directory, work_directory) })
+        return True
+
+    # the file is downloaded (with retries and resume) next to the cache blobs, or to a temporary file without the cache
+    if download_cache_directory is None:
+        command = (
+            f'file=/tmp/opensql-download.$$; '
+            f'{download_script_path} fetch {download_url or url} $file && digest=$(sha256sum $file | cut -d " " -f 1) || {{ rm -f $file; exit 1; }}; '
+            f'[ -z "{sha256 or ""}" ] || [ "$digest" = "{sha256 or ""}" ] || {{ rm -f $file; echo "sha256 $digest is not the locked one."; exit 1; }}; '
+            f'tar {tar_options} $file -C {directory} && rm -f $file && echo "sha256: $digest"'
+        )
+    else:
+        blobs_directory = f'{container_cache_directory}/blobs'
+        command = (
+            f'file={blobs_directory}/.download.$$; '
+            f'{download_script_path} fetch {download_url or url} $file && digest=$(sha256sum $file | cut -d " " -f 1) && mv $file {blobs_directory}/$digest || {{ rm -f $file; exit 1; }}; '
+            f'[ -z "{sha256 or ""}" ] || [ "$digest" = "{sha256 or ""}" ] || {{ echo "sha256 $digest is not the locked one."; exit 1; }}; '
+            f'tar {tar_options} {blobs_directory}/$digest -C {directory} && echo "sha256: $digest"'
+        )
+
+    steps = [
+        (f'mkdir -p {directory}', f'make a directory of {path.basename(directory)} is failed'),
+        (command, f'curl download and tar {tar_options} is failed')
+    ]
+
+    results = execute_commands_and_log_container([ command for command, _ in steps ], docker_container, docker_container_log)
+
+    if results[-1].exit_code != 0:
+        print(f'[ERROR] {steps[len(results) - 1][1]}.\n({url})\n{results[-1].output.decode()}')
+        return False
+
+    digest = [ line.split()[1] for line in results[-1].output.decode().splitlines() if line.startswith('sha256: ') ][-1]
+
+    if sha256 is not None and digest != sha256:
+        print(f'[ERROR] sha256 of {url} is not the locked one. ({digest})')
         return False
 
+    if download_cache_directory is not None:
+        write_cache_reference(url, digest)
+
+    record_download(docker_container, 'tarballs', { 'url': url, 'sha256': digest, 'directory': path.relpath(directory, work_directory) })
+
     return True
 
+def get_pg_build_extension(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] pg build extension [{component[name]}] download...')
+
+    # the file with os full version info is preferred, and the one with os major version is used if it is not available.
+    # both are probed at the same time.
+    url, download_url = resolve_url(get_candidate_urls(spec, component), docker_container, docker_container_log)
+
+    # if is not available with os major version, then we give up. no choice.
+    if url is None:
+        print(f'[ERROR] there is no availabe pg build extension file {component} for {spec[os]} {spec[database]}')
+        return False
+
+    return curl_download_and_extract(url, f'{work_directory}/{component[name]}', docker_container, docker_container_log, download_url)
+
+def get_etcd(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] etcd download...')
+
+    # parse download url of etcd
+    url, download_url = resolve_url(get_candidate_urls(spec, component), docker_container, docker_container_log)
+
+    # if is not available, then we give up. no choice.
+    if url is None:
+        print(f'[ERROR] there is no availabe pg build extension file {component}')
+        return False
+
+    return curl_download_and_extract(url, f'{work_directory}/{component[name]}', docker_container, docker_container_log, download_url)
+
+def get_patroni(spec, component, docker_container, docker_container_log):
+
+    print(f'[INFO] patroni and its dependencies download...')
+
+    # the dependencies are resolved by one repotrack, and install.sh installs them in one dnf transaction
+    steps = get_download_rpms_steps(component_registry[component[name]]['artifacts'], f'{component[name]}-dependencies')
+
+    component_directory = f'{work_directory}/{component[name]}'
+
+    artifact = 'patroni[etcd]==' + component[version]
+
+    pip_options = ''
+
+    if download_cache_directory is not None:
+        pip_options = f'--cache-dir {container_cache_directory}/pip '
+
+    steps += [
+        (f'mkdir -p {component_directory}', f'make a directory of {component[name]} is failed'),
+        (f'cd {component_directory} && {download_script_path} run pypi pip3 download {get_pip_download_options()}{pip_options}\'{artifact}\'', 'patroni download is failed')
+    ]
+
+    return execute_steps_and_log_container(steps, docker_container, docker_container_log)
+
 # python3 package.py
 if __name__ == '__main__':
 
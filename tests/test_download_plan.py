@@ -0,0 +1,90 @@
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+import package
+
+
+def make_spec(*option_names):
+
+    return {
+        'os': { 'name': 'rockylinux', 'version': '8.10' },
+        'database': { 'name': 'postgresql', 'version': '15.8' },
+        'options': [ { 'name': option_name, 'version': '1.0' } for option_name in option_names ]
+    }
+
+
+def get_waves(plan):
+
+    return { step['name']: step['wave'] for step in plan }
+
+
+class GetDownloadPlanTest(unittest.TestCase):
+
+    def test_dnf_components_wait_for_the_pgpool_repository(self):
+
+        plan = package.get_download_plan(make_spec('pgpool', 'postgis', 'etcd', 'patroni'))
+
+        self.assertEqual(get_waves(plan), { 'pgpool-repository': 1, 'etcd': 1, 'postgresql': 2, 'pgpool': 2, 'postgis': 2, 'patroni': 2 })
+        self.assertEqual({ step['name']: step['dependencies'] for step in plan }, {
+            'pgpool-repository': set(), 'etcd': set(),
+            'postgresql': { 'pgpool-repository' }, 'pgpool': { 'pgpool-repository' }, 'postgis': { 'pgpool-repository' }, 'patroni': { 'pgpool-repository' }
+        })
+
+    def test_repository_setup_is_a_separate_step(self):
+
+        plan = package.get_download_plan(make_spec('pgpool'))
+        steps = { step['name']: step for step in plan }
+
+        self.assertTrue(steps['pgpool-repository']['setup'])
+        self.assertFalse(steps['pgpool']['setup'])
+        self.assertIs(steps['pgpool-repository']['component'], steps['pgpool']['component'])
+
+    def test_dependencies_not_in_the_package_are_not_waited_for(self):
+
+        plan = package.get_download_plan(make_spec('postgis', 'etcd'))
+
+        self.assertEqual(get_waves(plan), { 'postgresql': 1, 'postgis': 1, 'etcd': 1 })
+        self.assertTrue(all(step['dependencies'] == set() for step in plan))
+
+    def test_skipped_components_have_no_repository_setup(self):
+
+        plan = package.get_download_plan(make_spec('pgpool', 'barman'), skip_components={ 'pgpool' })
+
+        self.assertEqual(get_waves(plan), { 'postgresql': 1, 'barman': 1 })
+
+    def test_database_is_first_in_its_wave(self):
+
+        plan = package.get_download_plan(make_spec('etcd', 'pgpool', 'barman'))
+
+        self.assertEqual([ step['name'] for step in plan ], [ 'etcd', 'pgpool-repository', 'postgresql', 'pgpool', 'barman' ])
+
+    def test_cycle_fails(self):
+
+        registry = {
+            **package.component_registry,
+            'etcd': { **package.component_registry['etcd'], 'dependencies': { 'system_stats' } },
+            'system_stats': { **package.component_registry['system_stats'], 'dependencies': { 'etcd' } }
+        }
+
+        with mock.patch.dict(package.component_registry, registry), contextlib.redirect_stdout(io.StringIO()) as output:
+            plan = package.get_download_plan(make_spec('etcd', 'system_stats'))
+
+        self.assertIsNone(plan)
+        self.assertIn('[ERROR] component dependencies cannot be satisfied.', output.getvalue())
+
+
+class EstimatePlanTimeTest(unittest.TestCase):
+
+    def test_waves_and_jobs(self):
+
+        plan = package.get_download_plan(make_spec('pgpool', 'etcd', 'barman'))
+        times = { 'pgpool-repository': 5.0, 'etcd': 30.0, 'postgresql': 20.0, 'pgpool': 10.0, 'barman': 5.0 }
+
+        # the repository and etcd at once, then postgresql, pgpool and barman after the repository
+        self.assertEqual(package.estimate_plan_time(plan, times, 4), 30.0)
+        # postgresql is not held back by the pgpool download
+        self.assertEqual(package.estimate_plan_time(plan, { **times, 'etcd': 1.0 }, 4), 25.0)
+        # one job runs every step in turn
+        self.assertEqual(package.estimate_plan_time(plan, times, 1), 70.0)
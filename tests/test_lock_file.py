@@ -0,0 +1,42 @@
+import unittest
+
+import package
+
+
+class ParseLockListTest(unittest.TestCase):
+
+    def test_all_files_are_parsed(self):
+
+        lines = [ 'count rpm 800', 'count pip 1' ]
+        lines += [ f'rpm postgis/gdal{index}.rpm {index:064x} gdal{index}-0:3.4.3-1.el8.x86_64' for index in range(800) ]
+        lines += [ 'pip patroni/patroni-3.2.2-py3-none-any.whl ' + 'a' * 64 ]
+
+        rpms, pip_files = package.parse_lock_list('\n'.join(lines))
+
+        self.assertEqual(len(rpms), 800)
+        self.assertEqual(rpms[0], { 'path': 'postgis/gdal0.rpm', 'nevra': 'gdal0-0:3.4.3-1.el8.x86_64', 'sha256': '0' * 64 })
+        self.assertEqual(pip_files, [ { 'path': 'patroni/patroni-3.2.2-py3-none-any.whl', 'name': 'patroni', 'version': '3.2.2', 'sha256': 'a' * 64 } ])
+
+    def test_missing_files_fail(self):
+
+        # an rpm whose nevra cannot be read has no nevra field
+        listing = 'count rpm 2\ncount pip 0\nrpm a.rpm 00 a-0:1-1.noarch\nrpm b.rpm 11 \n'
+
+        self.assertEqual(package.parse_lock_list(listing), (None, None))
+
+    def test_listing_without_counts_fails(self):
+
+        self.assertEqual(package.parse_lock_list('rpm a.rpm 00 a-0:1-1.noarch\n'), (None, None))
+
+
+class ParsePipFileNameTest(unittest.TestCase):
+
+    def test_wheel_and_sdist(self):
+
+        self.assertEqual(package.parse_pip_file_name('python_etcd-0.4.5-py3-none-any.whl'), [ 'python_etcd', '0.4.5' ])
+        self.assertEqual(package.parse_pip_file_name('psutil-5.9.8.tar.gz'), [ 'psutil', '5.9.8' ])
+        self.assertEqual(package.parse_pip_file_name('click-8.1.7.zip'), [ 'click', '8.1.7' ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import package
+
+
+run_report = {
+    'version': '1',
+    'started_at': '2026-01-01T00:00:00',
+    'ended_at': '2026-01-01T00:10:00',
+    'success': False,
+    'targets': [
+        {
+            'target': 'rockylinux8.10-pg15.8',
+            'success': True,
+            'duration': 600.0,
+            'package': 'opensql-rockylinux8.10-pg15.8.tar',
+            'package_size': 1000,
+            'package_new_size': None,
+            'stages': [
+                { 'stage': 'os_image', 'duration': 10.0, 'size': 200 },
+                { 'stage': 'download', 'component': 'postgresql', 'version': '15.8', 'duration': 30.0, 'received_bytes': 100, 'size': 300 },
+                { 'stage': 'checkpoint_save', 'component': 'postgresql', 'version': '15.8', 'duration': 1.5, 'received_bytes': 0 },
+                { 'stage': 'checkpoint_save', 'component': 'postgresql', 'version': '15.8', 'duration': 2.5, 'received_bytes': 0 }
+            ]
+        },
+        {
+            'target': 'oracle "8"\\pg',
+            'success': False,
+            'duration': None,
+            'package': None,
+            'package_size': None,
+            'stages': []
+        }
+    ]
+}
+
+
+class FormatMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.lines = package.format_metrics(run_report).splitlines()
+
+    def test_build_metrics(self):
+
+        self.assertIn('opensql_packager_build_success{target="rockylinux8.10-pg15.8"} 1', self.lines)
+        self.assertIn('opensql_packager_build_duration_seconds{target="rockylinux8.10-pg15.8"} 600.0', self.lines)
+        self.assertIn('opensql_packager_package_size_bytes{target="rockylinux8.10-pg15.8"} 1000', self.lines)
+
+    def test_failed_build(self):
+
+        self.assertIn('opensql_packager_build_success{target="oracle \\"8\\"\\\\pg"} 0', self.lines)
+        self.assertIn('opensql_packager_build_duration_seconds{target="oracle \\"8\\"\\\\pg"} 0', self.lines)
+        self.assertFalse(any(line.startswith('opensql_packager_package_size_bytes{target="oracle') for line in self.lines))
+
+    def test_stage_metrics(self):
+
+        self.assertIn('opensql_packager_stage_duration_seconds{target="rockylinux8.10-pg15.8",stage="os_image",component=""} 10.0', self.lines)
+        self.assertIn('opensql_packager_stage_received_bytes{target="rockylinux8.10-pg15.8",stage="download",component="postgresql"} 100', self.lines)
+        self.assertIn('opensql_packager_stage_size_bytes{target="rockylinux8.10-pg15.8",stage="download",component="postgresql"} 300', self.lines)
+
+    def test_repeated_stages_are_added_up(self):
+
+        self.assertIn('opensql_packager_stage_duration_seconds{target="rockylinux8.10-pg15.8",stage="checkpoint_save",component="postgresql"} 4.0', self.lines)
+
+    def test_metric_without_samples_is_left_out(self):
+
+        self.assertFalse(any('package_new_bytes' in line for line in self.lines))
+
+    def test_help_and_type_before_samples(self):
+
+        index = self.lines.index('# TYPE opensql_packager_build_success gauge')
+
+        self.assertEqual(self.lines[index - 1], '# HELP opensql_packager_build_success whether the package build of the target succeeded (1) or failed (0)')
+        self.assertTrue(self.lines[index + 1].startswith('opensql_packager_build_success{'))
+        self.assertEqual(self.lines[-1].split(' ')[0], 'opensql_packager_last_run_timestamp_seconds')
+
+
+class FormatMetricLabelsTest(unittest.TestCase):
+
+    def test_escaping(self):
+
+        self.assertEqual(package.format_metric_labels({ 'target': 'a"b\\c\nd', 'stage': 'os' }), '{target="a\\"b\\\\c\\nd",stage="os"}')
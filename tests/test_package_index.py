@@ -0,0 +1,89 @@
+import sqlite3
+import tempfile
+import unittest
+from os import path
+
+import package
+
+
+spec = {
+    'os': { 'name': 'rockylinux', 'version': '8.10' },
+    'database': { 'name': 'postgresql', 'version': '15.8' },
+    'options': []
+}
+
+# listing of write_package_index: files (F), manifest checksums (S), rpms (N) with provides (P) and requires (R)
+lines = [
+    'F 1000 postgresql/postgresql15-15.8-1.x86_64.rpm',
+    'F 1000 postgis/postgresql15-15.8-1.x86_64.rpm',
+    'F 500 postgis/libpq5-16.4-1.x86_64.rpm',
+    'F 20 install.sh',
+    'F 7 extension-utils/make/README',
+    'S ' + 'a' * 64 + '  ./postgresql/postgresql15-15.8-1.x86_64.rpm',
+    'S ' + 'a' * 64 + '  ./postgis/postgresql15-15.8-1.x86_64.rpm',
+    'S ' + 'b' * 64 + '  ./postgis/libpq5-16.4-1.x86_64.rpm',
+    'N ' + 'a' * 64 + ' postgresql15 0 15.8 1PGDG.rhel8 x86_64',
+    'P ' + 'a' * 64 + ' postgresql15',
+    'R ' + 'a' * 64 + ' libpq.so.5()(64bit)',
+    'N ' + 'b' * 64 + ' libpq5 1 16.4 1PGDG.rhel8 x86_64',
+    'P ' + 'b' * 64 + ' libpq.so.5()(64bit)'
+]
+
+
+class BuildPackageIndexTest(unittest.TestCase):
+
+    def setUp(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        index_file_path = path.join(directory.name, package.index_file_name)
+        package.build_package_index(spec, lines, index_file_path)
+
+        self.connection = sqlite3.connect(index_file_path)
+        self.addCleanup(self.connection.close)
+
+    def query(self, query, argument=None):
+
+        statement, default_argument = package.package_index_queries[query]
+
+        return self.connection.execute(statement, [ argument or default_argument ] if (argument or default_argument) else []).fetchall()
+
+    def test_metadata(self):
+
+        metadata = dict(self.connection.execute('SELECT key, value FROM metadata'))
+
+        self.assertEqual(metadata['version'], package.package_index_version)
+        self.assertEqual(metadata['target'], 'rockylinux8.10-pg15.8')
+
+    def test_files_refer_to_their_rpms(self):
+
+        rows = self.connection.execute('SELECT files.path, files.component, rpms.name, rpms.epoch FROM files LEFT JOIN rpms ON rpms.id = files.rpm_id ORDER BY files.path').fetchall()
+
+        self.assertEqual(rows, [
+            ('extension-utils/make/README', 'pg_build_extension_install_utils', None, None),
+            ('install.sh', None, None, None),
+            ('postgis/libpq5-16.4-1.x86_64.rpm', 'postgis', 'libpq5', 1),
+            ('postgis/postgresql15-15.8-1.x86_64.rpm', 'postgis', 'postgresql15', 0),
+            ('postgresql/postgresql15-15.8-1.x86_64.rpm', 'postgresql', 'postgresql15', 0)
+        ])
+
+    def test_rpms_are_stored_once(self):
+
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM rpms').fetchone(), (2,))
+
+    def test_shared_files_are_stored_in_the_first_path(self):
+
+        components = { row[0]: row[1:] for row in self.query('components') }
+
+        # the postgresql rpm is shared by postgis (a hard link), so only postgis stores it
+        self.assertEqual(components['postgis'], (2, 2, 1500, 1500))
+        self.assertEqual(components['postgresql'], (1, 1, 1000, 0))
+
+    def test_dependencies(self):
+
+        self.assertEqual(self.query('whatrequires', 'libpq5'), [
+            ('postgis', 'postgresql15', 'libpq.so.5()(64bit)'),
+            ('postgresql', 'postgresql15', 'libpq.so.5()(64bit)')
+        ])
+        self.assertEqual(self.query('requires', 'postgresql15'), [ ('libpq.so.5()(64bit)', 'libpq5') ])
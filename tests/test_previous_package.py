@@ -0,0 +1,112 @@
+import hashlib, io, tarfile, tempfile, unittest
+
+import package
+
+
+class FakeResult:
+
+    exit_code = 0
+    output = b''
+
+
+class FakeContainer:
+
+    # extracts the archive stream as the docker engine does, and records the removed directories
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.removed = []
+
+    def put_archive(self, container_path, data):
+        with tarfile.open(fileobj=data, mode='r|') as archive:
+            archive.extractall(self.directory)
+        return True
+
+
+class FakeLog:
+
+    def write(self, data):
+        pass
+
+
+def make_package(files, manifest_files=None):
+
+    # previous package with the files (path in the work directory -> content) and their manifest
+    manifest = ''.join(f'{hashlib.sha256(content).hexdigest()}  ./{file_path}\n' for file_path, content in sorted((manifest_files or files).items()))
+    data = io.BytesIO()
+
+    with tarfile.open(fileobj=data, mode='w') as archive:
+        for file_path, content in [ *files.items(), (package.manifest_file_name, manifest.encode()) ]:
+            info = tarfile.TarInfo(f'opensql/{file_path}')
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+    data.seek(0)
+
+    return {
+        'file_name': 'opensql.tar',
+        'archive': tarfile.open(fileobj=data, mode='r:'),
+        package.manifest_file_name: package.parse_manifest(manifest)
+    }
+
+
+class RestorePreviousComponentsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.container = FakeContainer(self.directory.name)
+        self.execute = package.execute_and_log_container
+
+        def execute(command, container, log, workdir=None):
+            container.removed.append(command)
+            return FakeResult()
+
+        package.execute_and_log_container = execute
+
+    def tearDown(self):
+
+        package.execute_and_log_container = self.execute
+        self.directory.cleanup()
+
+    def test_parse_manifest(self):
+
+        digest = hashlib.sha256(b'a').hexdigest()
+
+        self.assertEqual(package.parse_manifest(f'{digest}  ./etcd/etcd.tar.gz\n'), { './etcd/etcd.tar.gz': digest })
+
+    def test_matching_components_are_restored(self):
+
+        previous_package = make_package({ 'etcd/etcd.tar.gz': b'etcd', 'barman/barman.rpm': b'barman' })
+
+        restored = package.restore_previous_components(previous_package, { 'etcd', 'barman' }, self.container, FakeLog())
+
+        self.assertEqual(restored, { 'etcd', 'barman' })
+        self.assertEqual(self.container.removed, [])
+
+    def test_broken_component_is_dropped(self):
+
+        previous_package = make_package(
+            { 'etcd/etcd.tar.gz': b'broken', 'barman/barman.rpm': b'barman' },
+            { 'etcd/etcd.tar.gz': b'etcd', 'barman/barman.rpm': b'barman' }
+        )
+
+        restored = package.restore_previous_components(previous_package, { 'etcd', 'barman' }, self.container, FakeLog())
+
+        self.assertEqual(restored, { 'barman' })
+        self.assertEqual(self.container.removed, [ [ 'rm', '-rf', f'{package.work_directory}/etcd' ] ])
+
+    def test_missing_file_drops_its_component(self):
+
+        previous_package = make_package(
+            { 'etcd/etcd.tar.gz': b'etcd' },
+            { 'etcd/etcd.tar.gz': b'etcd', 'etcd/etcdctl': b'etcdctl' }
+        )
+
+        restored = package.restore_previous_components(previous_package, { 'etcd' }, self.container, FakeLog())
+
+        self.assertEqual(restored, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import contextlib
+import io
+import unittest
+
+import package
+
+
+def make_spec(**overrides):
+
+    spec = {
+        'os': { 'name': 'rockylinux', 'version': '8.10' },
+        'database': { 'name': 'postgresql', 'version': '15.8' },
+        'options': [ { 'name': 'pgaudit', 'version': '1.7.0' } ]
+    }
+    spec.update(overrides)
+
+    return spec
+
+
+def expand(spec):
+
+    # the errors are printed, the output is kept out of the test report
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        targets = package.expand_spec_targets(spec)
+
+    return targets, output.getvalue()
+
+
+class ExpandSpecTargetsTest(unittest.TestCase):
+
+    def test_single_target(self):
+
+        targets, _ = expand(make_spec())
+
+        self.assertEqual(targets, [ make_spec() ])
+
+    def test_version_lists_are_expanded(self):
+
+        targets, _ = expand(make_spec(
+            os=[ { 'name': 'rockylinux', 'version': [ '8.10', '9.4' ] } ],
+            database={ 'name': 'postgresql', 'version': [ '14.13', '15.8' ] }
+        ))
+
+        self.assertEqual([ (target['os']['version'], target['database']['version']) for target in targets ], [
+            ('8.10', '14.13'), ('8.10', '15.8'), ('9.4', '14.13'), ('9.4', '15.8')
+        ])
+
+    def test_option_versions_follow_the_db_major_version(self):
+
+        targets, _ = expand(make_spec(
+            database={ 'name': 'postgresql', 'version': [ '14.13', '15.8' ] },
+            options=[ { 'name': 'pg_hint_plan', 'version': [ '1.4.3', '1.5.2' ] } ]
+        ))
+
+        self.assertEqual([ target['options'][0]['version'] for target in targets ], [ '1.4.3', '1.5.2' ])
+
+    def test_all_os_versions(self):
+
+        targets, _ = expand(make_spec(os={ 'name': 'rockylinux', 'version': '*' }))
+
+        self.assertEqual(len(targets), len(package.support_os_versions['rockylinux']))
+
+    def test_invalid_entries_are_reported_together(self):
+
+        targets, output = expand({
+            'os': [ { 'name': 'rockylinux' }, { 'version': '9.4' }, 'rockylinux' ],
+            'database': { 'name': 'postgresql' },
+            'options': [ { 'name': 'pgaudit' } ]
+        })
+
+        self.assertIsNone(targets)
+        self.assertEqual(output.count('[ERROR] an os entry must have a name and a version.'), 3)
+        self.assertIn('[ERROR] database must have a name and a version.', output)
+        self.assertIn('[ERROR] an option must have a name and a version.', output)
+        self.assertIn('[ERROR] the setting has 5 errors.', output)
+
+    def test_missing_os_or_database(self):
+
+        targets, output = expand({ 'os': { 'name': 'rockylinux', 'version': '8.10' } })
+
+        self.assertIsNone(targets)
+        self.assertIn('[ERROR] target OS and Database must be set.', output)
+
+
+class GetSpecErrorsTest(unittest.TestCase):
+
+    def test_valid_spec(self):
+
+        self.assertEqual(package.get_spec_errors(make_spec()), [])
+
+    def test_unsupported_versions(self):
+
+        errors = package.get_spec_errors(make_spec(
+            os={ 'name': 'rockylinux', 'version': '7.9' },
+            options=[ { 'name': 'pgaudit', 'version': '0.1' }, { 'name': 'unknown', 'version': '1.0' } ]
+        ))
+
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(errors[0].startswith('os version 7.9 is not supported.'))
+        self.assertTrue(errors[1].startswith('there is no supported version 0.1 of pgaudit'))
+        self.assertTrue(errors[2].startswith('unknown is not an opensql component.'))
+
+    def test_unknown_database(self):
+
+        errors = package.get_spec_errors(make_spec(database={ 'name': 'mysql', 'version': '8.0' }))
+
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('target Database must be set.'))